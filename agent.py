@@ -0,0 +1,136 @@
+"""Agente di lavoro: esegue le sessioni rtkrcv di un host per conto del coordinatore.
+
+Ogni host del cluster avvia un agente con il proprio SessionManager; il
+server principale (app.py con RTKRCV_AGENTS) assegna le nuove sessioni
+all'agente meno carico e ne raccoglie lo stato (vedi coordinator.py).
+
+Uso:
+    python agent.py --port 5101 --rtkrcv rtklib/rtkrcv --max-sessions 40
+"""
+import argparse
+import os
+
+from flask import Flask, jsonify, request
+
+from convergence import StopCriteria
+from health import HealthProber
+from sessions import SessionManager
+
+
+def create_agent_app(manager, max_sessions=50, token=None):
+    """Applicazione Flask dell'agente sopra un SessionManager locale."""
+    app = Flask(__name__)
+
+    @app.before_request
+    def check_token():
+        if token and request.headers.get('X-Agent-Token') != token:
+            return jsonify({"error": "Token dell'agente non valido"}), 403
+
+    @app.route('/agent/load', methods=['GET'])
+    def get_load():
+        """Carico dell'host: sessioni attive e load average per CPU"""
+        cpus = os.cpu_count() or 1
+        return jsonify({
+            "sessions": len(manager.get_active_serials()),
+            "max_sessions": max_sessions,
+            "cpu_count": cpus,
+            "load": round(os.getloadavg()[0] / cpus, 3),
+        })
+
+    @app.route('/agent/sessions', methods=['GET'])
+    def list_sessions():
+        """Stato e coordinate di tutte le sessioni dell'agente"""
+        return jsonify({"sessions": {
+            serial: {
+                "status": snap.status,
+                "coordinates": snap.rover_coords,
+                "active": manager.is_session_running(serial),
+            } for serial, snap in manager.get_snapshots().items()
+        }})
+
+    @app.route('/agent/sessions/<serial>/start', methods=['POST'])
+    def start_session(serial):
+        """Avvia una sessione: rover, master, criteri e impostazioni rtkrcv della campagna"""
+        data = request.json or {}
+        rover, master = data.get('rover'), data.get('master')
+        if not isinstance(rover, dict) or not isinstance(master, dict) or rover.get('serial') != serial:
+            return jsonify({"error": "Specificare 'rover' (con questo seriale) e 'master'"}), 400
+        try:
+            if 'campaign' in data and data['campaign'] != manager.config_engine.get_campaign():
+                manager.config_engine.set_campaign(data['campaign'])
+            criteria = data.get('criteria')
+            if criteria is not None:
+                criteria = StopCriteria.from_dict(criteria, manager.stop_criteria)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+
+        if len(manager.get_active_serials()) >= max_sessions:
+            return jsonify({"error": "Numero massimo di sessioni raggiunto"}), 503
+        success, message = manager.start_session(rover, master, criteria)
+        if success:
+            return jsonify({"message": message})
+        return jsonify({"error": message}), 500
+
+    @app.route('/agent/sessions/<serial>/stop', methods=['POST'])
+    def stop_session(serial):
+        success, message = manager.stop_session(serial)
+        if success:
+            return jsonify({"message": message})
+        return jsonify({"error": message}), 404
+
+    @app.route('/agent/sessions/<serial>/process', methods=['GET'])
+    def get_process(serial):
+        info = manager.get_process_info(serial)
+        if info is None:
+            return jsonify({"error": "Nessuna sessione per questo rover"}), 404
+        return jsonify(info)
+
+    @app.route('/agent/sessions/<serial>/output', methods=['GET'])
+    def get_output(serial):
+        """Righe del .pos della sessione (?lines, ?after come in /api/sessions/<serial>/output)"""
+        try:
+            lines = min(int(request.args.get('lines', 20)), 1000)
+            after = request.args.get('after')
+            after = int(after) if after is not None else None
+        except ValueError:
+            return jsonify({"error": "Parametri non validi"}), 400
+        if lines < 0 or (after is not None and after < 0):
+            return jsonify({"error": "Parametri non validi"}), 400
+        return jsonify(manager.get_session_output(serial, lines, after))
+
+    @app.route('/agent/sessions/<serial>/output/version', methods=['GET'])
+    def get_output_version(serial):
+        """Versione del .pos (per l'ETag del server principale), senza leggerne il contenuto"""
+        return jsonify({"version": manager.get_session_output_version(serial)})
+
+    @app.route('/agent/sessions/<serial>/timeline', methods=['GET'])
+    def get_timeline(serial):
+        timeline = manager.get_session_timeline(serial)
+        if timeline is None:
+            return jsonify({"error": "Nessuna sessione per questo rover"}), 404
+        return jsonify(timeline)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--rtkrcv', default=os.path.join('rtklib', 'rtkrcv'), help="eseguibile rtkrcv")
+    parser.add_argument('--max-sessions', type=int, default=50, help="sessioni massime su questo host")
+    parser.add_argument('--solution-mode', choices=('file', 'stream'), default='file')
+    parser.add_argument('--no-health-check', action='store_true',
+                        help="avvia rtkrcv senza verificare prima rover e master")
+    args = parser.parse_args()
+
+    # La verifica parte da questo host: è la sua rete che conta per rtkrcv
+    health = None if args.no_health_check else HealthProber()
+    manager = SessionManager(rtkrcv_path=args.rtkrcv, solution_mode=args.solution_mode, health=health)
+    app = create_agent_app(manager, args.max_sessions, os.environ.get('RTKRCV_AGENT_TOKEN'))
+    print(f"Agente in ascolto su {args.host}:{args.port} (massimo {args.max_sessions} sessioni)")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
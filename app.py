@@ -1,28 +1,54 @@
-from flask import Flask, render_template, request, jsonify
-import json
+from flask import Flask, Response, g, render_template, request, jsonify, send_file
 import os
-from sessions import SessionManager
+import time
+from convergence import StopCriteria
+from manager_server import build_services, connect_services
+from metrics import MetricsRegistry
 
 app = Flask(__name__)
-session_manager = SessionManager()
-
-# File di configurazione del pool dispositivi
-POOL_CONFIG_FILE = 'pool_list.json'
-
-def load_pool_config():
-    """Carica la configurazione del pool dai file JSON"""
-    if os.path.exists(POOL_CONFIG_FILE):
-        try:
-            with open(POOL_CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {"devices": []}
-    return {"devices": []}
-
-def save_pool_config(config):
-    """Salva la configurazione del pool nel file JSON"""
-    with open(POOL_CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
+
+# Con RTKRCV_MANAGER_SOCKET lo stato vive nel processo manager_server.py e
+# questo processo (o ciascun worker WSGI) vi accede tramite proxy; altrimenti
+# i servizi vengono costruiti qui (sviluppo, singolo processo)
+MANAGER_SOCKET = os.environ.get('RTKRCV_MANAGER_SOCKET')
+services = connect_services(MANAGER_SOCKET) if MANAGER_SOCKET else build_services()
+
+session_manager = services.sessions
+registry = services.registry
+config_engine = services.config_engine
+events = services.events
+HISTORY = services.history
+HEALTH = services.health
+ARCHIVE = services.archive
+REPLAY = services.replay
+SCHEDULER = services.scheduler
+coordinator = services.coordinator
+
+# Latenza delle richieste, misurata in ogni processo che serve l'API: con più
+# worker ciascuno riporta le proprie (etichetta worker), le metriche del
+# manager arrivano invece da services.metrics
+API_METRICS = MetricsRegistry()
+API_LATENCY = API_METRICS.histogram('rtkrcv_api_request_seconds', "Durata delle richieste all'API",
+                                    ['worker', 'method', 'endpoint', 'status'])
+WORKER = str(os.getpid())
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _observe_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        API_LATENCY.labels(WORKER, request.method, endpoint, response.status_code).observe(time.perf_counter() - started)
+    return response
+
+def _sessions_for(serial):
+    """Gestore (coordinatore o manager locale) che esegue la sessione di un rover"""
+    if coordinator is not None and coordinator.has_session(serial):
+        return coordinator
+    return session_manager
 
 @app.route('/')
 def index():
@@ -32,19 +58,44 @@ def index():
 @app.route('/api/devices', methods=['GET'])
 def get_devices():
     """Restituisce l'elenco dei dispositivi configurati"""
-    config = load_pool_config()
+    config = {"devices": registry.list_devices()}
+    # Vista coerente di tutte le sessioni, letta senza lock
+    snapshots = session_manager.get_snapshots()
+    if coordinator is not None:
+        snapshots = {**snapshots, **coordinator.get_snapshots()}
+    # Master assegnato a ogni rover (il più vicino) e distanza in metri
+    assignments = registry.get_masters_for([d['serial'] for d in config['devices'] if d['role'] == 'Rover'])
     # Aggiungi lo stato delle sessioni e le coordinate a ogni dispositivo rover
     for device in config['devices']:
         if device['role'] == 'Rover':
-            device['session_status'] = session_manager.get_session_status(device['serial'])
+            assignment = assignments.get(device['serial'])
+            if assignment:
+                device['master'] = {'serial': assignment['master']['serial'], 'name': assignment['master']['name'],
+                                    'distance': assignment['distance']}
+            snap = snapshots.get(device['serial'])
+            device['session_status'] = snap.status if snap else 'stopped'
             # Ottieni le coordinate XYZ del rover se disponibili
-            rover_coords = session_manager.get_rover_coordinates(device['serial'])
+            rover_coords = snap.rover_coords if snap else None
             if rover_coords:
                 device['coordinates'] = rover_coords
             else:
                 device['coordinates'] = {'x': 'N/A', 'y': 'N/A', 'z': 'N/A'}
+            if getattr(snap, 'agent', None):
+                device['agent'] = snap.agent
+    # Ultima verifica di raggiungibilità e dati RTCM (senza attese)
+    if HEALTH is not None:
+        health = HEALTH.last_results(config['devices'])
+        for device in config['devices']:
+            device['health'] = health.get(device['serial'])
     return jsonify(config)
 
+@app.route('/api/devices/probe', methods=['POST'])
+def probe_devices():
+    """Verifica subito tutti i dispositivi (in parallelo, al più un timeout)"""
+    if HEALTH is None:
+        return jsonify({"error": "Verifica dei dispositivi non attiva"}), 404
+    return jsonify({"devices": HEALTH.probe_devices(registry.list_devices(), refresh=True)})
+
 @app.route('/api/devices', methods=['POST'])
 def add_device():
     """Aggiunge un nuovo dispositivo alla configurazione"""
@@ -58,12 +109,10 @@ def add_device():
     if data['role'] not in ['Master', 'Rover']:
         return jsonify({"error": "Ruolo deve essere Master o Rover"}), 400
     
-    config = load_pool_config()
-    
-    # Controlla se il seriale esiste già
-    for device in config['devices']:
-        if device['serial'] == data['serial']:
-            return jsonify({"error": "Dispositivo con questo seriale già esistente"}), 400
+    try:
+        rtk_fields = _rtkrcv_device_fields(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     # Aggiungi il nuovo dispositivo
     new_device = {
@@ -73,24 +122,26 @@ def add_device():
         "port": int(data['port']),
         "role": data['role']
     }
+    new_device.update(rtk_fields)
     
-    config['devices'].append(new_device)
-    save_pool_config(config)
+    # Controlla se il seriale esiste già
+    if not registry.add(new_device):
+        return jsonify({"error": "Dispositivo con questo seriale già esistente"}), 400
+    events.publish('devices', {})
     
     return jsonify({"message": "Dispositivo aggiunto con successo"})
 
 @app.route('/api/devices/<serial>', methods=['DELETE'])
 def delete_device(serial):
     """Rimuove un dispositivo dalla configurazione"""
-    config = load_pool_config()
-    
     # Ferma la sessione se è attiva
-    if session_manager.is_session_running(serial):
-        session_manager.stop_session(serial)
+    sessions = _sessions_for(serial)
+    if sessions.is_session_running(serial):
+        sessions.stop_session(serial)
     
     # Rimuovi il dispositivo
-    config['devices'] = [d for d in config['devices'] if d['serial'] != serial]
-    save_pool_config(config)
+    registry.remove(serial)
+    events.publish('devices', {})
     
     return jsonify({"message": "Dispositivo rimosso con successo"})
 
@@ -98,56 +149,165 @@ def delete_device(serial):
 def update_device(serial):
     """Aggiorna un dispositivo esistente"""
     data = request.json
-    config = load_pool_config()
     
     # Trova il dispositivo
-    device = None
-    for d in config['devices']:
-        if d['serial'] == serial:
-            device = d
-            break
+    device = registry.get(serial)
     
     if not device:
         return jsonify({"error": "Dispositivo non trovato"}), 404
     
+    try:
+        rtk_fields = _rtkrcv_device_fields(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     # Ferma la sessione se è attiva e il dispositivo sta cambiando
-    if session_manager.is_session_running(serial):
-        session_manager.stop_session(serial)
+    sessions = _sessions_for(serial)
+    if sessions.is_session_running(serial):
+        sessions.stop_session(serial)
     
     # Aggiorna i campi
-    device.update({
+    registry.update(serial, {
         "name": data.get('name', device['name']),
         "ip": data.get('ip', device['ip']),
         "port": int(data.get('port', device['port'])),
-        "role": data.get('role', device['role'])
+        "role": data.get('role', device['role']),
+        **rtk_fields
     })
+    events.publish('devices', {})
     
-    save_pool_config(config)
     return jsonify({"message": "Dispositivo aggiornato con successo"})
 
-@app.route('/api/sessions/<serial>/start', methods=['POST'])
-def start_session(serial):
-    """Avvia una sessione RTKRCV per un rover"""
-    config = load_pool_config()
+def _rtkrcv_device_fields(data):
+    """Campi facoltativi del dispositivo: profilo e opzioni rtkrcv del rover,
+    coordinate di riserva del master (lat/lon/alt) se lo stream RTCM non le fornisce"""
+    fields = {key: data[key] for key in ('profile', 'options') if key in data}
+    config_engine.validate_device(fields.get('profile'), fields.get('options'))
+    position = [key for key in ('lat', 'lon', 'alt') if data.get(key) not in (None, '')]
+    if position:
+        if len(position) != 3:
+            raise ValueError("Specificare lat, lon e alt insieme")
+        for key in position:
+            fields[key] = float(data[key])
+    return fields
+
+@app.route('/api/config/rtkrcv', methods=['GET'])
+def get_rtkrcv_config():
+    """Profili disponibili e impostazioni rtkrcv della campagna"""
+    return jsonify({
+        "profiles": config_engine.profile_names(),
+        "campaign": config_engine.get_campaign()
+    })
+
+@app.route('/api/config/rtkrcv', methods=['PUT'])
+def update_rtkrcv_config():
+    """Imposta profilo, opzioni e profili personalizzati della campagna"""
+    settings = request.json or {}
+    try:
+        config_engine.set_campaign(settings)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    registry.set_setting('rtkrcv', settings)
+    return jsonify({"message": "Impostazioni rtkrcv aggiornate. Valide dal prossimo avvio delle sessioni"})
+
+def _requested_serials(data):
+    """Seriali richiesti per un'operazione in blocco: lista 'serials' oppure 'all': true"""
+    if data.get('all'):
+        return [rover['serial'] for rover in registry.get_rovers()]
+    serials = data.get('serials')
+    if not isinstance(serials, list):
+        return None
+    return serials
+
+def _requested_criteria(data):
+    """Criteri di arresto per le sessioni richieste (None = predefiniti del manager)"""
+    criteria = data.get('criteria')
+    if criteria is None:
+        return None
+    if not isinstance(criteria, dict):
+        raise ValueError("'criteria' deve essere un oggetto")
+    return StopCriteria.from_dict(criteria, services.stop_criteria)
+
+def _requested_pairs(serials):
+    """Coppie (rover, master più vicino) e risultati dei rover sconosciuti; None senza master"""
+    assignments = registry.get_masters_for(serials)
+    if not assignments:
+        return None, None
+    results = {}
+    pairs = []
+    for serial in serials:
+        assignment = assignments.get(serial)
+        if assignment:
+            pairs.append((assignment['rover'], assignment['master']))
+        else:
+            results[serial] = {"success": False, "message": "Rover non trovato"}
+    return pairs, results
+
+@app.route('/api/sessions/start', methods=['POST'])
+def start_sessions():
+    """Avvia le sessioni RTKRCV per più rover in parallelo"""
+    data = request.json or {}
+    serials = _requested_serials(data)
+    if serials is None:
+        return jsonify({"error": "Specificare 'serials' (lista) oppure 'all': true"}), 400
+    try:
+        criteria = _requested_criteria(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Trova il rover
-    rover = None
-    master = None
+    # Ogni rover con il master più vicino
+    pairs, results = _requested_pairs(serials)
+    if pairs is None:
+        return jsonify({"error": "Master non configurato"}), 400
     
-    for device in config['devices']:
-        if device['serial'] == serial and device['role'] == 'Rover':
-            rover = device
-        elif device['role'] == 'Master':
-            master = device
+    if coordinator is not None:
+        results.update(coordinator.start_sessions(pairs, criteria, config_engine.get_campaign()))
+    else:
+        results.update(session_manager.start_sessions(pairs, criteria))
+    return jsonify({"results": results})
+
+@app.route('/api/sessions/stop', methods=['POST'])
+def stop_sessions():
+    """Ferma le sessioni RTKRCV per più rover in parallelo"""
+    data = request.json or {}
+    if data.get('all'):
+        serials = session_manager.get_active_serials()
+        if coordinator is not None:
+            serials += coordinator.get_active_serials()
+    else:
+        serials = _requested_serials(data)
+    if serials is None:
+        return jsonify({"error": "Specificare 'serials' (lista) oppure 'all': true"}), 400
     
-    if not rover:
+    remote = [serial for serial in serials if _sessions_for(serial) is coordinator]
+    results = session_manager.stop_sessions([serial for serial in serials if serial not in remote])
+    if remote:
+        results.update(coordinator.stop_sessions(remote))
+    return jsonify({"results": results})
+
+@app.route('/api/sessions/<serial>/start', methods=['POST'])
+def start_session(serial):
+    """Avvia una sessione RTKRCV per un rover"""
+    # Trova il rover e il master più vicino
+    assignments = registry.get_masters_for([serial])
+    if not assignments:
+        if not registry.get_rover(serial):
+            return jsonify({"error": "Rover non trovato"}), 404
+        return jsonify({"error": "Master non configurato"}), 400
+    if not assignments[serial]:
         return jsonify({"error": "Rover non trovato"}), 404
+    rover, master = assignments[serial]['rover'], assignments[serial]['master']
     
-    if not master:
-        return jsonify({"error": "Master non configurato"}), 400
+    try:
+        criteria = _requested_criteria(request.get_json(silent=True) or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     
-    # Avvia la sessione
-    success, message = session_manager.start_session(rover, master)
+    # Avvia la sessione (sull'agente meno carico, se configurati)
+    if coordinator is not None:
+        success, message = coordinator.start_session(rover, master, criteria, config_engine.get_campaign())
+    else:
+        success, message = session_manager.start_session(rover, master, criteria)
     
     if success:
         return jsonify({"message": message})
@@ -157,7 +317,7 @@ def start_session(serial):
 @app.route('/api/sessions/<serial>/stop', methods=['POST'])
 def stop_session(serial):
     """Ferma una sessione RTKRCV per un rover"""
-    success, message = session_manager.stop_session(serial)
+    success, message = _sessions_for(serial).stop_session(serial)
     
     if success:
         return jsonify({"message": message})
@@ -167,18 +327,265 @@ def stop_session(serial):
 @app.route('/api/sessions/<serial>/status', methods=['GET'])
 def get_session_status(serial):
     """Ottieni lo stato di una sessione"""
-    status = session_manager.get_session_status(serial)
+    status = _sessions_for(serial).get_session_status(serial)
     return jsonify({"status": status})
 
 @app.route('/api/sessions/<serial>/output', methods=['GET'])
 def get_session_output(serial):
-    """Ottieni l'output NMEA di una sessione"""
-    output = session_manager.get_session_output(serial)
-    return jsonify({"output": output})
+    """Ottieni l'output (file .pos) di una sessione
+
+    ?lines=N: ultime N righe (default 20); ?after=<offset>: solo le righe
+    successive al cursore restituito dalla richiesta precedente. La
+    risposta ha un ETag: se il file non è cambiato si risponde 304.
+    """
+    try:
+        lines = min(int(request.args.get('lines', 20)), 1000)
+        after = request.args.get('after')
+        after = int(after) if after is not None else None
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    if lines < 0 or (after is not None and after < 0):
+        return jsonify({"error": "Parametri non validi"}), 400
+
+    # L'ETag dipende solo dallo stato del file e dalla richiesta: il 304 non legge il file
+    sessions = _sessions_for(serial)
+    version = sessions.get_session_output_version(serial)
+    etag = f"{version}-{lines}-{after}" if version else None
+    if etag and etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    response = jsonify(sessions.get_session_output(serial, lines, after))
+    if etag:
+        response.set_etag(etag)
+    return response
+
+@app.route('/api/sessions/<serial>/timeline', methods=['GET'])
+def get_session_timeline(serial):
+    """Transizioni single → float → fix della sessione, in secondi dall'avvio"""
+    timeline = _sessions_for(serial).get_session_timeline(serial)
+    if timeline is None:
+        return jsonify({"error": "Nessuna sessione per questo rover"}), 404
+    return jsonify(timeline)
+
+@app.route('/api/schedule', methods=['POST'])
+def schedule_sessions():
+    """Mette in coda le sessioni di più rover: avvio nell'ordine e nei limiti stimati dallo storico"""
+    if SCHEDULER is None:
+        return jsonify({"error": "Pianificazione delle sessioni non attiva"}), 404
+    data = request.json or {}
+    serials = _requested_serials(data)
+    if serials is None:
+        return jsonify({"error": "Specificare 'serials' (lista) oppure 'all': true"}), 400
+    try:
+        criteria = _requested_criteria(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    pairs, results = _requested_pairs(serials)
+    if pairs is None:
+        return jsonify({"error": "Master non configurato"}), 400
+    results.update(SCHEDULER.submit(pairs, criteria))
+    return jsonify({"results": results})
+
+@app.route('/api/schedule', methods=['GET'])
+def get_schedule():
+    """Coda del pianificatore, sessioni in corso e ultime concluse"""
+    if SCHEDULER is None:
+        return jsonify({"error": "Pianificazione delle sessioni non attiva"}), 404
+    return jsonify(SCHEDULER.status())
+
+@app.route('/api/schedule', methods=['PUT'])
+def configure_schedule():
+    """Aggiorna i limiti del pianificatore (max_sessions, timeout_factor, max_retries)"""
+    if SCHEDULER is None:
+        return jsonify({"error": "Pianificazione delle sessioni non attiva"}), 404
+    data = request.json or {}
+    try:
+        SCHEDULER.configure(**{key: data[key] for key in ('max_sessions', 'timeout_factor', 'max_retries')
+                               if key in data})
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(SCHEDULER.status())
+
+@app.route('/api/schedule/cancel', methods=['POST'])
+def cancel_schedule():
+    """Toglie dalla coda i rover indicati ('serials') o tutti; le sessioni in corso restano attive"""
+    if SCHEDULER is None:
+        return jsonify({"error": "Pianificazione delle sessioni non attiva"}), 404
+    serials = (request.get_json(silent=True) or {}).get('serials')
+    if serials is not None and not isinstance(serials, list):
+        return jsonify({"error": "'serials' deve essere una lista"}), 400
+    return jsonify({"cancelled": SCHEDULER.cancel(serials)})
+
+@app.route('/api/sessions/<serial>/process', methods=['GET'])
+def get_session_process(serial):
+    """Stato del processo rtkrcv (pid, riavvii, codice di uscita) e ultime righe di stderr"""
+    info = _sessions_for(serial).get_process_info(serial)
+    if info is None:
+        return jsonify({"error": "Nessuna sessione per questo rover"}), 404
+    return jsonify(info)
+
+@app.route('/api/agents', methods=['GET'])
+def get_agents():
+    """Agenti remoti: raggiungibilità, sessioni e carico"""
+    if coordinator is None:
+        return jsonify({"enabled": False, "agents": []})
+    return jsonify({"enabled": True, "agents": coordinator.agents_status()})
+
+@app.route('/api/relay', methods=['GET'])
+def get_relay_stats():
+    """Contatori del relay delle correzioni (traffico, client, ritardo)"""
+    if services.relay is None:
+        return jsonify({"enabled": False, "masters": []})
+    return jsonify({"enabled": True, "masters": services.relay.stats()})
+
+def _history_filters():
+    """Filtri comuni delle query sullo storico (serial, master, source, since, until in secondi epoch)."""
+    filters = {'serial': request.args.get('serial'), 'master': request.args.get('master'),
+               'source': request.args.get('source')}
+    for key in ('since', 'until'):
+        value = request.args.get(key)
+        filters[key] = float(value) if value is not None else None
+    return filters
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Sessioni registrate nello storico, dalla più recente"""
+    if HISTORY is None:
+        return jsonify({"error": "Storico delle sessioni non attivo"}), 404
+    try:
+        filters = _history_filters()
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    sessions = HISTORY.query_sessions(status=request.args.get('status'), limit=limit, offset=offset, **filters)
+    return jsonify({"sessions": sessions})
+
+@app.route('/api/history/<int:session_id>', methods=['GET'])
+def get_history_session(session_id):
+    """Una sessione dello storico con le sue epoche (sottocampionate)"""
+    if HISTORY is None:
+        return jsonify({"error": "Storico delle sessioni non attivo"}), 404
+    session = HISTORY.get_session(session_id)
+    if session is None:
+        return jsonify({"error": "Sessione non trovata"}), 404
+    session['epochs'] = HISTORY.session_epochs(session_id)
+    return jsonify(session)
+
+@app.route('/api/history/ttf', methods=['GET'])
+def get_history_ttf():
+    """Statistiche dei tempi al fix per rover, per sito (?by=master) o di tutta la flotta (?by=all)"""
+    if HISTORY is None:
+        return jsonify({"error": "Storico delle sessioni non attivo"}), 404
+    by = request.args.get('by', 'serial')
+    try:
+        stats = HISTORY.ttf_stats(by=by, **_history_filters())
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    if by == 'master':
+        return jsonify({"sites": stats})
+    if by == 'all':
+        return jsonify({"fleet": stats.get('*')})
+    return jsonify({"rovers": stats})
+
+@app.route('/api/history/ttf/distribution', methods=['GET'])
+def get_history_ttf_distribution():
+    """Distribuzione di un tempo al fix (?metric=time_to_float|time_to_first_fix|time_to_fix):
+    istogramma per classi (?buckets=10,30,60) e quota cumulativa delle sessioni"""
+    if HISTORY is None:
+        return jsonify({"error": "Storico delle sessioni non attivo"}), 404
+    try:
+        options = {'metric': request.args.get('metric', 'time_to_fix')}
+        if request.args.get('buckets'):
+            options['buckets'] = [float(bound) for bound in request.args['buckets'].split(',')]
+        distribution = HISTORY.ttf_distribution(**options, **_history_filters())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(distribution)
+
+@app.route('/api/archive', methods=['GET'])
+def get_archive():
+    """Archivi delle sessioni chiuse, dal più recente, con l'occupazione del disco"""
+    if ARCHIVE is None:
+        return jsonify({"error": "Archiviazione delle sessioni non attiva"}), 404
+    try:
+        limit = min(int(request.args.get('limit', 100)), 1000)
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    return jsonify({"stats": ARCHIVE.stats(), "archives": ARCHIVE.entries(serial=request.args.get('serial'), limit=limit)})
+
+@app.route('/api/archive/<path:name>', methods=['GET'])
+def download_archive(name):
+    """Scarica un archivio (percorso relativo come nel campo 'file' dell'indice)"""
+    if ARCHIVE is None:
+        return jsonify({"error": "Archiviazione delle sessioni non attiva"}), 404
+    # Solo i file presenti nell'indice: nessun accesso ad altri percorsi
+    path = ARCHIVE.archive_path(name)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "Archivio non trovato"}), 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+@app.route('/api/replay', methods=['POST'])
+def submit_replay():
+    """Rielabora in parallelo sessioni registrate (file del rover e della base per ogni lavoro)"""
+    if REPLAY is None:
+        return jsonify({"error": "Rielaborazione offline non attiva"}), 404
+    data = request.get_json(silent=True) or {}
+    jobs = data.get('jobs')
+    if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+        return jsonify({"error": "Indicare i lavori in 'jobs'"}), 400
+    try:
+        batch = REPLAY.submit(jobs, criteria=data.get('criteria'), profile=data.get('profile'),
+                              options=data.get('options'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(batch)
+
+@app.route('/api/replay', methods=['GET'])
+def get_replay_batches():
+    """Lotti di rielaborazione, dal più recente"""
+    if REPLAY is None:
+        return jsonify({"error": "Rielaborazione offline non attiva"}), 404
+    return jsonify({"batches": REPLAY.batches()})
+
+@app.route('/api/replay/<batch_id>', methods=['GET'])
+def get_replay_batch(batch_id):
+    """Un lotto con esito, tempi al fix e velocità di elaborazione di ogni lavoro"""
+    if REPLAY is None:
+        return jsonify({"error": "Rielaborazione offline non attiva"}), 404
+    batch = REPLAY.get_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Lotto non trovato"}), 404
+    return jsonify(batch)
+
+@app.route('/api/replay/<batch_id>/cancel', methods=['POST'])
+def cancel_replay_batch(batch_id):
+    """Annulla i lavori del lotto non ancora avviati"""
+    if REPLAY is None:
+        return jsonify({"error": "Rielaborazione offline non attiva"}), 404
+    cancelled = REPLAY.cancel(batch_id)
+    if cancelled is None:
+        return jsonify({"error": "Lotto non trovato"}), 404
+    return jsonify({"cancelled": cancelled})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metriche del manager e dell'API nel formato di Prometheus"""
+    return Response(services.metrics.render() + API_METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Stream Server-Sent Events con le variazioni di stato, coordinate e output"""
+    return Response(events.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
     # Crea la cartella per i file di output se non esiste
     os.makedirs('output', exist_ok=True)
     os.makedirs('config', exist_ok=True)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Niente reloader: un secondo processo avvierebbe un altro manager con le stesse sessioni.
+    # In produzione usare manager_server.py e un server WSGI (vedi wsgi.py)
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False, threaded=True)
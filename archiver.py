@@ -0,0 +1,323 @@
+"""Archiviazione compressa delle uscite delle sessioni, con retention e quota disco.
+
+A fine sessione il file .pos viene spostato (rename, istantaneo) in una
+cartella di appoggio insieme a una copia della configurazione rtkrcv; i
+segmenti scritti prima di un riavvio vi finiscono allo stesso modo. Un
+thread in background, a priorità di I/O 'idle', comprime la cartella in
+un archivio datato:
+
+    archive/2026-10-18/ROVER01-20261018T083012.tar.zst   (o .tar.gz)
+
+e lo registra in archive/index.jsonl. Dopo ogni archivio e ogni ora
+vengono applicate le politiche di conservazione: età massima, spazio
+massimo occupato dagli archivi e spazio libero minimo sul disco.
+"""
+import ctypes
+import ctypes.util
+import gzip
+import json
+import os
+import platform
+import queue
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # Facoltativo: senza, gli archivi sono .tar.gz
+    zstandard = None
+
+STAGING_DIR = '.staging'
+INDEX_FILE = 'index.jsonl'
+
+# ioprio_set(2): numero della syscall per architettura e classe 'idle'
+_IOPRIO_SYSCALLS = {'x86_64': 251, 'aarch64': 30, 'armv7l': 314, 'i686': 289}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
+
+def lower_thread_priority():
+    """Porta il thread chiamante a niceness 19 e classe di I/O idle (solo Linux)."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (OSError, AttributeError) as e:
+        print(f"Archiviazione: impossibile ridurre la priorità di CPU: {e}")
+    syscall = _IOPRIO_SYSCALLS.get(platform.machine())
+    if syscall is None:
+        return
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    # who = 0: il thread chiamante
+    if libc.syscall(syscall, _IOPRIO_WHO_PROCESS, 0, _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT) != 0:
+        print(f"Archiviazione: impossibile impostare la priorità di I/O: errno {ctypes.get_errno()}")
+
+
+class SessionArchiver:
+    """Pipeline di archiviazione delle sessioni terminate.
+
+    stage() e seal() sono veloci (rename e copia della configurazione) e
+    si possono chiamare dal SessionManager; compressione e pulizia
+    avvengono nel thread dell'archiviatore.
+
+    - compression: 'zstd' (richiede il pacchetto zstandard) o 'gzip'
+    - retention_days: età massima degli archivi (None = illimitata)
+    - max_bytes: spazio massimo occupato dagli archivi (None = illimitato)
+    - min_free_bytes: spazio libero da garantire sul disco, eliminando gli
+      archivi più vecchi (None = nessun controllo)
+    """
+
+    def __init__(self, path, compression='zstd', retention_days=90, max_bytes=None, min_free_bytes=None,
+                 sweep_interval=3600.0):
+        if compression not in ('zstd', 'gzip'):
+            raise ValueError(f"Compressione non valida: {compression}")
+        if compression == 'zstd' and zstandard is None:
+            print("Archiviazione: pacchetto zstandard non installato, uso gzip")
+            compression = 'gzip'
+        self.path = os.path.abspath(path)
+        self.compression = compression
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.sweep_interval = sweep_interval
+        self.sweepers = []  # Funzioni chiamate ad ogni pulizia, es. per file di configurazione orfani
+        self._lock = threading.Lock()
+        self._entries = []  # Voci dell'indice, dalla più vecchia
+        self._queue = queue.Queue()
+        os.makedirs(os.path.join(self.path, STAGING_DIR), exist_ok=True)
+        self._load_index()
+        self._thread = threading.Thread(target=self._run, name='archiver', daemon=True)
+        self._thread.start()
+        # Sessioni rimaste in appoggio da un'esecuzione precedente
+        for name in sorted(os.listdir(os.path.join(self.path, STAGING_DIR))):
+            self._queue.put((name, {'key': name.split('@', 1)[0], 'status': None}))
+
+    # --- Dal SessionManager -------------------------------------------------
+
+    def stage(self, key, path, copy=False):
+        """Sposta (o copia) un file nella cartella di appoggio della sessione key.
+
+        I file vuoti o inesistenti vengono ignorati. Restituisce True se il
+        file è stato preso in carico.
+        """
+        try:
+            if os.path.getsize(path) == 0:
+                return False
+        except OSError:
+            return False
+        staging = os.path.join(self.path, STAGING_DIR, key)
+        os.makedirs(staging, exist_ok=True)
+        name = os.path.basename(path)
+        target = os.path.join(staging, name)
+        # Segmenti successivi (riavvii): ROVER01.pos, ROVER01.pos.1, ...
+        counter = 0
+        while os.path.exists(target):
+            counter += 1
+            target = os.path.join(staging, f"{name}.{counter}")
+        if copy:
+            shutil.copy2(path, target)
+        else:
+            os.replace(path, target)
+        return True
+
+    def seal(self, key, meta):
+        """Chiude la sessione key: verrà compressa e registrata nell'indice con meta."""
+        staging = os.path.join(self.path, STAGING_DIR, key)
+        if not os.path.isdir(staging):
+            return False
+        # Nome univoco: una nuova sessione con la stessa chiave ricomincia da una cartella vuota
+        sealed = f"{key}@{time.time_ns()}"
+        os.replace(staging, os.path.join(self.path, STAGING_DIR, sealed))
+        self._queue.put((sealed, dict(meta, key=key)))
+        return True
+
+    def flush(self, timeout=None):
+        """Attende che gli archivi richiesti finora siano completati."""
+        done = threading.Event()
+        self._queue.put((None, done))
+        return done.wait(timeout)
+
+    # --- Consultazione ------------------------------------------------------
+
+    def entries(self, serial=None, limit=100):
+        """Voci dell'indice, dalla più recente."""
+        with self._lock:
+            entries = [dict(e) for e in reversed(self._entries) if serial is None or e.get('serial') == serial]
+        return entries[:limit]
+
+    def stats(self):
+        with self._lock:
+            total = sum(e['size'] for e in self._entries)
+            original = sum(e['original_size'] for e in self._entries)
+            count = len(self._entries)
+        usage = shutil.disk_usage(self.path)
+        return {
+            'archives': count,
+            'bytes': total,
+            'original_bytes': original,
+            'compression': self.compression,
+            'pending': self._queue.qsize(),
+            'disk_free': usage.free,
+            'retention_days': self.retention_days,
+            'max_bytes': self.max_bytes,
+            'min_free_bytes': self.min_free_bytes,
+        }
+
+    def archive_path(self, name):
+        """Percorso assoluto di un archivio presente nell'indice (name relativo), o None."""
+        with self._lock:
+            if not any(e['file'] == name for e in self._entries):
+                return None
+        return os.path.join(self.path, name)
+
+    # --- Thread dell'archiviatore ---------------------------------------------
+
+    def _run(self):
+        lower_thread_priority()
+        # Prima pulizia poco dopo l'avvio, quando il manager ha registrato i propri sweeper
+        next_sweep = time.monotonic() + 60
+        while True:
+            try:
+                key, job = self._queue.get(timeout=max(0.0, next_sweep - time.monotonic()))
+            except queue.Empty:
+                key, job = None, None
+            if key is not None:
+                try:
+                    self._archive(key, job)
+                except Exception as e:
+                    print(f"Archiviazione di {key} fallita: {e}")
+            elif job is not None:
+                job.set()  # flush()
+                continue
+            if key is not None or time.monotonic() >= next_sweep:
+                try:
+                    self._enforce_policies()
+                    for sweeper in self.sweepers:
+                        sweeper()
+                except Exception as e:
+                    print(f"Errore nella pulizia degli archivi: {e}")
+                next_sweep = time.monotonic() + self.sweep_interval
+
+    def _archive(self, sealed, meta):
+        staging = os.path.join(self.path, STAGING_DIR, sealed)
+        files = sorted(os.listdir(staging)) if os.path.isdir(staging) else []
+        if not files:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        now = datetime.now()
+        extension = '.tar.zst' if self.compression == 'zstd' else '.tar.gz'
+        name = os.path.join(now.strftime('%Y-%m-%d'), meta['key'] + extension)
+        counter = 0
+        while os.path.exists(os.path.join(self.path, name)):
+            counter += 1
+            name = os.path.join(now.strftime('%Y-%m-%d'), f"{meta['key']}.{counter}{extension}")
+        target = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        original_size = sum(os.path.getsize(os.path.join(staging, f)) for f in files)
+        fd, tmp_path = tempfile.mkstemp(prefix='.archive.', dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, 'wb') as raw:
+                if self.compression == 'zstd':
+                    stream = zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=False)
+                else:
+                    stream = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6)
+                with stream, tarfile.open(fileobj=stream, mode='w|') as tar:
+                    for f in files:
+                        tar.add(os.path.join(staging, f), arcname=f)
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp_path, target)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        entry = dict(meta, file=name, files=files, size=os.path.getsize(target), original_size=original_size,
+                     archived_at=time.time())
+        with self._lock:
+            self._entries.append(entry)
+            with open(os.path.join(self.path, INDEX_FILE), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        shutil.rmtree(staging, ignore_errors=True)
+        print(f"Archiviata la sessione {meta['key']}: {original_size} -> {entry['size']} byte ({name})")
+
+    def _enforce_policies(self):
+        removed = []
+        with self._lock:
+            # Copia: le eliminazioni continuano fuori dal lock, self._entries si aggiorna solo alla fine
+            entries = list(self._entries)
+            if self.retention_days is not None:
+                cutoff = time.time() - self.retention_days * 86400
+                removed += [e for e in entries if e['archived_at'] < cutoff]
+                entries = [e for e in entries if e['archived_at'] >= cutoff]
+            if self.max_bytes is not None:
+                total = sum(e['size'] for e in entries)
+                while entries and total > self.max_bytes:
+                    total -= entries[0]['size']
+                    removed.append(entries.pop(0))
+        if self.min_free_bytes is not None:
+            # Lo spazio liberato si vede solo dopo la cancellazione: un archivio alla volta
+            self._delete(removed)
+            while entries and shutil.disk_usage(self.path).free < self.min_free_bytes:
+                oldest = entries.pop(0)
+                self._delete([oldest])
+                removed.append(oldest)
+        else:
+            self._delete(removed)
+        if removed:
+            with self._lock:
+                gone = {id(e) for e in removed}
+                self._entries = [e for e in self._entries if id(e) not in gone]
+                self._write_index()
+            print(f"Archiviazione: eliminati {len(removed)} archivi (politiche di conservazione)")
+
+    def _delete(self, entries):
+        for entry in entries:
+            path = os.path.join(self.path, entry['file'])
+            try:
+                os.unlink(path)
+                os.rmdir(os.path.dirname(path))  # Solo se la cartella del giorno è vuota
+            except OSError:
+                pass
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.path, INDEX_FILE)) as f:
+                for line in f:
+                    try:
+                        self._entries.append(json.loads(line))
+                    except ValueError:
+                        pass  # Riga troncata da un arresto improvviso
+        except FileNotFoundError:
+            pass
+
+    def _write_index(self):
+        # Chiamata con self._lock acquisito: riscrittura atomica dopo le eliminazioni
+        fd, tmp_path = tempfile.mkstemp(prefix='.index.', dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+
+
+def sweep_stale_files(directory, max_age_days, keep):
+    """Elimina da directory i file non modificati da max_age_days giorni, tranne quelli dei seriali in keep."""
+    cutoff = time.time() - max_age_days * 86400
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        serial = name.split('.', 1)[0]
+        try:
+            if serial not in keep and os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
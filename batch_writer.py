@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+import time
+
+
+class BatchFileWriter:
+    """Scrittura asincrona e a blocchi di righe su file.
+
+    Le righe vengono accodate senza bloccare il chiamante e scritte da un
+    unico thread in background, raggruppate per file, al più ogni
+    flush_interval secondi o quando si accumulano max_batch righe.
+    Riduce il numero di scritture su dischi lenti (es. schede SD).
+    on_write(path), se indicata, viene chiamata dal thread di scrittura
+    dopo ogni scrittura riuscita su path.
+    """
+
+    def __init__(self, flush_interval=5.0, max_batch=500, on_write=None):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.on_write = on_write
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def append(self, path, lines):
+        """Accoda righe (senza terminatore) da aggiungere in fondo a path."""
+        if not lines:
+            return
+        self._ensure_started()
+        self._queue.put((path, lines, None))
+
+    def flush(self, timeout=None):
+        """Attende che tutte le righe accodate finora siano su disco."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put((None, None, done))
+        return done.wait(timeout)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        pending = {}  # path -> righe in attesa
+        count = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                path, lines, done = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                path, lines, done = None, None, None
+
+            if path is not None:
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.setdefault(path, []).extend(lines)
+                count += len(lines)
+                if count < self.max_batch:
+                    continue
+
+            self._write(pending)
+            pending = {}
+            count = 0
+            deadline = None
+            if done is not None:
+                done.set()
+
+    def _write(self, pending):
+        for path, lines in pending.items():
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                with open(path, 'a') as f:
+                    f.write('\n'.join(lines) + '\n')
+            except OSError as e:
+                print(f"Errore nella scrittura di {path}: {e}")
+                continue
+            if self.on_write is not None:
+                try:
+                    self.on_write(path)
+                except Exception as e:
+                    print(f"Errore nella notifica della scrittura di {path}: {e}")
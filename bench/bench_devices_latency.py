@@ -0,0 +1,100 @@
+"""Benchmark della latenza di GET /api/devices durante l'arresto delle sessioni.
+
+Avvia N sessioni con un finto rtkrcv che ignora SIGTERM (quindi ogni stop
+attende il timeout di 5 secondi prima del kill) e misura la latenza di
+/api/devices prima e durante l'arresto in blocco. Con le letture basate
+su snapshot il p99 deve restare stabile.
+
+Uso:
+    python bench/bench_devices_latency.py --sessions 20 --duration 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FAKE_RTKRCV = textwrap.dedent("""\
+    #!/usr/bin/env python3
+    import signal, time
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while True:
+        time.sleep(1)
+""")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(client, duration):
+    latencies = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        t0 = time.perf_counter()
+        response = client.get('/api/devices')
+        latencies.append((time.perf_counter() - t0) * 1000)
+        assert response.status_code == 200
+    return latencies
+
+
+def check_results(label, response, expected):
+    """Verifica che l'operazione in blocco sia riuscita per tutte le sessioni."""
+    assert response.status_code == 200, f"{label}: HTTP {response.status_code}"
+    results = response.get_json()['results']
+    failed = {serial: result['message'] for serial, result in results.items() if not result['success']}
+    assert not failed, f"{label} non riuscito: {failed}"
+    assert len(results) == expected, f"{label}: {len(results)} sessioni su {expected}"
+
+
+def report(label, latencies):
+    print(f"{label:<22} n={len(latencies):<6} p50={statistics.median(latencies):7.2f} ms"
+          f"  p99={percentile(latencies, 99):7.2f} ms  max={max(latencies):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=3.0, help="secondi di misura per fase")
+    args = parser.parse_args()
+
+    # I dispositivi del benchmark non esistono: niente verifica prima dell'avvio
+    os.environ['RTKRCV_HEALTH_CHECK'] = '0'
+    workdir = tempfile.mkdtemp(prefix='bench-devices-')
+    os.chdir(workdir)
+    fake = os.path.join(workdir, 'rtkrcv')
+    with open(fake, 'w') as f:
+        f.write(FAKE_RTKRCV)
+    os.chmod(fake, 0o755)
+
+    import app
+    app.session_manager.rtkrcv_path = fake
+    client = app.app.test_client()
+
+    client.post('/api/devices', json={'name': 'master', 'serial': 'M0', 'ip': '127.0.0.1', 'port': 2222, 'role': 'Master',
+                                      'lat': 45.0641, 'lon': 7.6697, 'alt': 239.0})
+    for i in range(args.sessions):
+        client.post('/api/devices', json={'name': f'rover{i}', 'serial': f'R{i}', 'ip': '127.0.0.1', 'port': 2222, 'role': 'Rover'})
+    # Senza sessioni attive il benchmark misurerebbe un manager inattivo
+    check_results('avvio', client.post('/api/sessions/start', json={'all': True}), args.sessions)
+
+    report('baseline', measure(client, args.duration))
+
+    stopped = []
+    stopper = threading.Thread(target=lambda: stopped.append(client.post('/api/sessions/stop', json={'all': True})))
+    stopper.start()
+    report('durante lo stop', measure(client, args.duration))
+    stopper.join()
+    check_results('arresto', stopped[0], args.sessions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark del parser colonnare dei file .pos (pos_reader.iter_pos_columns).
+
+Genera un file .pos sintetico in formato llh della dimensione richiesta
+(per default 2 GB) e confronta il parser a blocchi con il parsing riga
+per riga (split() + conversione, come parse_pos_line) su un campione.
+
+Uso:
+    python bench/bench_pos_parser.py --size-mb 2048
+    python bench/bench_pos_parser.py --file output/ROVER1.pos
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pos_reader  # noqa: E402
+
+HEADER = ("% program   : RTKLIB\n"
+          "%  GPST                  latitude(deg) longitude(deg)  height(m)   Q  ns   sdn(m)   sde(m)   sdu(m)"
+          "  sdne(m)  sdeu(m)  sdun(m) age(s)  ratio\n")
+
+
+def generate(path, size_mb):
+    """Scrive un giorno di epoche a 1 Hz, ripetuto fino alla dimensione richiesta."""
+    rng = np.random.default_rng(0)
+    lines = []
+    for i in range(86400):
+        hh, rem = divmod(i, 3600)
+        mm, ss = divmod(rem, 60)
+        lines.append(
+            f"2024/01/01 {hh:02d}:{mm:02d}:{ss:02d}.000   {45.0641 + rng.normal(0, 1e-6):.9f}"
+            f"    {7.6697 + rng.normal(0, 1e-6):.9f}   {239 + rng.normal(0, 0.01):8.4f}"
+            f"   {1 if i > 600 else 2}  {rng.integers(6, 14):2d}   0.0042   0.0038   0.0101"
+            f"   0.0010  -0.0020   0.0030   1.00  {rng.uniform(3, 40):5.1f}\n")
+    block = ''.join(lines).encode()
+    target = size_mb * 1024 * 1024
+    with open(path, 'wb') as f:
+        f.write(HEADER.encode())
+        written = 0
+        while written < target:
+            f.write(block)
+            written += len(block)
+
+
+def parse_per_line(path, max_bytes):
+    """Parsing di riferimento: split() e conversione riga per riga (pos_reader.parse_pos_line)."""
+    epochs = []
+    with open(path, 'r') as f:
+        read = 0
+        for line in f:
+            read += len(line)
+            if read > max_bytes:
+                break
+            epoch = pos_reader.parse_pos_line(line)
+            if epoch is not None:
+                epochs.append(epoch)
+    return len(epochs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=2048)
+    parser.add_argument('--file', help="usa un file .pos esistente invece di generarlo")
+    parser.add_argument('--sample-mb', type=int, default=64, help="dimensione del campione per il confronto riga per riga")
+    args = parser.parse_args()
+
+    path = args.file
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='bench-pos-'), 'synthetic.pos')
+        t0 = time.perf_counter()
+        generate(path, args.size_mb)
+        print(f"file generato in {time.perf_counter() - t0:.1f} s: {path}")
+
+    size = os.path.getsize(path)
+    t0 = time.perf_counter()
+    # Lettura a blocchi: la memoria resta limitata anche su file di più GB
+    n = sum(len(columns['time']) for columns in pos_reader.iter_pos_columns(path))
+    elapsed = time.perf_counter() - t0
+    print(f"colonnare: {n} epoche, {size / 2**20:.0f} MB in {elapsed:.2f} s"
+          f" -> {size / 2**20 / elapsed:.0f} MB/s, {n / elapsed / 1e6:.2f} M epoche/s")
+
+    sample = args.sample_mb * 1024 * 1024
+    t0 = time.perf_counter()
+    m = parse_per_line(path, sample)
+    elapsed_split = time.perf_counter() - t0
+    print(f"per riga:  {m} epoche in {elapsed_split:.2f} s -> {m / elapsed_split / 1e6:.2f} M epoche/s"
+          f" (speedup {(n / elapsed) / (m / elapsed_split):.1f}x)")
+
+    if args.file is None:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
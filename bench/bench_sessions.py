@@ -0,0 +1,193 @@
+"""Benchmark end-to-end: N sessioni avviate tramite l'API con il simulatore di rtkrcv.
+
+Per ogni dimensione richiesta avvia N sessioni con POST /api/sessions/start
+(tools/fake_rtkrcv.py al posto di rtkrcv) e misura:
+- latenza di avvio: dalla richiesta allo stato 'running' di ogni sessione
+- tempo al fix rilevato: dalla richiesta allo stato 'fix' (convergenza)
+- latenza di GET /api/devices (p50/p99) durante l'esecuzione
+- CPU e RSS del processo del manager (i rtkrcv simulati sono esclusi)
+
+Con --json ogni esecuzione produce una riga JSON, da confrontare fra
+versioni per individuare regressioni.
+
+Uso:
+    python bench/bench_sessions.py --sessions 10 100 500
+    python bench/bench_sessions.py --sessions 100 --float 5 --json >> bench_sessions.jsonl
+"""
+import argparse
+import json
+import os
+import queue
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FAKE_RTKRCV = os.path.join(ROOT, 'tools', 'fake_rtkrcv.py')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summary(values):
+    if not values:
+        return None
+    return {'n': len(values), 'p50': round(statistics.median(values), 2),
+            'p99': round(percentile(values, 99), 2), 'max': round(max(values), 2)}
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def poll_devices(client, stop, latencies, interval):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        response = client.get('/api/devices')
+        latencies.append((time.perf_counter() - t0) * 1000)
+        assert response.status_code == 200
+        stop.wait(interval)
+
+
+def collect_status(events, wall0, running, fixed, stop):
+    """Istante (dall'avvio) del primo stato 'running' e 'fix' di ogni sessione."""
+    while not stop.is_set():
+        try:
+            event = events.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if event['type'] != 'status':
+            continue
+        elapsed = time.perf_counter() - wall0
+        serial, status = event['data']['serial'], event['data']['status']
+        if status == 'running':
+            running.setdefault(serial, elapsed)
+        elif status == 'fix':
+            fixed.setdefault(serial, elapsed)
+
+
+def run(app, client, serials, args):
+    events = app.session_manager.events.subscribe()
+    latencies = []
+    running, fixed = {}, {}
+    stop = threading.Event()
+    cpu0, wall0 = cpu_seconds(), time.perf_counter()
+    threads = [
+        threading.Thread(target=poll_devices, args=(client, stop, latencies, args.poll_interval)),
+        threading.Thread(target=collect_status, args=(events, wall0, running, fixed, stop)),
+    ]
+    for thread in threads:
+        thread.start()
+
+    response = client.post('/api/sessions/start', json={'serials': serials, 'criteria': {'min_fixes': args.min_fixes}})
+    request_time = time.perf_counter() - wall0
+    failed = [serial for serial, result in response.json['results'].items() if not result['success']]
+
+    wanted = len(serials) - len(failed)
+    deadline = time.perf_counter() + args.timeout
+    while len(fixed) < wanted and time.perf_counter() < deadline:
+        time.sleep(0.2)
+
+    wall = time.perf_counter() - wall0
+    cpu = cpu_seconds() - cpu0
+    stop.set()
+    for thread in threads:
+        thread.join()
+    app.session_manager.events.unsubscribe(events)
+
+    client.post('/api/sessions/stop', json={'serials': serials})
+    app.session_manager.cleanup_stopped_sessions()
+
+    return {
+        'sessions': len(serials),
+        'start_failures': len(failed),
+        'start_request_s': round(request_time, 2),
+        'start_latency_s': summary(list(running.values())),
+        'time_to_fix_s': summary(list(fixed.values())),
+        'fixed': len(fixed),
+        'api_devices_ms': summary(latencies),
+        'manager_cpu_pct': round(100 * cpu / wall, 1),
+        'manager_rss_mb': current_rss_mb(),
+        'manager_max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def report(result):
+    def fmt(stats, unit):
+        if stats is None:
+            return "n/d"
+        return f"p50={stats['p50']}{unit} p99={stats['p99']}{unit} max={stats['max']}{unit}"
+
+    print(f"--- {result['sessions']} sessioni ---")
+    print(f"avvio (richiesta)      {result['start_request_s']} s, falliti: {result['start_failures']}")
+    print(f"avvio -> running       {fmt(result['start_latency_s'], ' s')}")
+    print(f"avvio -> fix           {fmt(result['time_to_fix_s'], ' s')} ({result['fixed']} con fix)")
+    print(f"GET /api/devices       {fmt(result['api_devices_ms'], ' ms')}")
+    print(f"manager                CPU {result['manager_cpu_pct']}%  RSS {result['manager_rss_mb']} MB"
+          f" (picco {result['manager_max_rss_mb']} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--single', type=float, default=1.0, help="secondi in SINGLE del simulatore")
+    parser.add_argument('--float', type=float, default=3.0, help="secondi in FLOAT del simulatore")
+    parser.add_argument('--rate', type=float, default=1.0, help="epoche al secondo del simulatore")
+    parser.add_argument('--min-fixes', type=int, default=10, help="epoche FIX richieste per la convergenza")
+    parser.add_argument('--timeout', type=float, default=120.0, help="attesa massima dei fix (s)")
+    parser.add_argument('--poll-interval', type=float, default=0.05, help="pausa fra due GET /api/devices (s)")
+    parser.add_argument('--json', action='store_true', help="una riga JSON per esecuzione")
+    args = parser.parse_args()
+
+    # Ogni sessione usa alcuni descrittori (stderr, pidfd, socket, file .pos)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    os.environ.update({
+        'FAKE_RTKRCV_SINGLE': str(args.single),
+        'FAKE_RTKRCV_FLOAT': str(args.float),
+        'FAKE_RTKRCV_RATE': str(args.rate),
+        # I dispositivi del benchmark non esistono: niente verifica prima dell'avvio
+        'RTKRCV_HEALTH_CHECK': '0',
+    })
+    os.chdir(tempfile.mkdtemp(prefix='bench-sessions-'))
+
+    import app
+    app.session_manager.rtkrcv_path = FAKE_RTKRCV
+    client = app.app.test_client()
+
+    client.post('/api/devices', json={'name': 'master', 'serial': 'M0', 'ip': '127.0.0.1', 'port': 1, 'role': 'Master',
+                                      'lat': 45.0641, 'lon': 7.6697, 'alt': 239.0})
+    for i in range(max(args.sessions)):
+        client.post('/api/devices', json={'name': f'rover{i}', 'serial': f'R{i}', 'ip': '127.0.0.1', 'port': 1, 'role': 'Rover'})
+
+    for count in args.sessions:
+        result = run(app, client, [f'R{i}' for i in range(count)], args)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""Convergenza statistica della posizione del rover.
+
+Invece di fermare rtkrcv alla prima epoca con Q=1, il motore accumula le
+epoche fixed in media e covarianza incrementali (algoritmo di Welford, in
+ECEF), scarta gli outlier e dichiara la convergenza quando sono soddisfatti
+i criteri di arresto configurati.
+"""
+import math
+
+from geodesy import ecef_to_enu, ecef_to_llh, enu_rotation, llh_to_ecef
+from pos_reader import Q_DGPS, Q_FIX, Q_FLOAT, Q_PPP, Q_SBAS, Q_SINGLE
+
+# Nomi degli stati di soluzione (colonna Q del .pos) nella timeline delle sessioni
+Q_NAMES = {Q_FIX: 'fix', Q_FLOAT: 'float', Q_SBAS: 'sbas', Q_DGPS: 'dgps', Q_SINGLE: 'single', Q_PPP: 'ppp'}
+
+
+class StopCriteria:
+    """Criteri di arresto di una sessione.
+
+    - min_fixes: numero di epoche fixed consecutive (e accettate) richieste
+    - min_ratio: ratio minimo perché un'epoca fixed sia considerata valida
+    - max_sigma: deviazione standard 3D massima (m) delle epoche accettate
+    - max_duration: durata massima della sessione (s), fatta rispettare dal
+      SessionManager con un timer del watcher; None = nessun limite
+    - outlier_k: soglia di rigetto in deviazioni standard per asse
+    - outlier_min_sigma: deviazione standard minima (m) usata nel test di
+      rigetto, per non scartare tutto quando la dispersione è quasi nulla
+    """
+
+    FIELDS = ('min_fixes', 'min_ratio', 'max_sigma', 'max_duration', 'outlier_k', 'outlier_min_sigma')
+
+    def __init__(self, min_fixes=30, min_ratio=3.0, max_sigma=0.02, max_duration=None,
+                 outlier_k=4.0, outlier_min_sigma=0.005):
+        self.min_fixes = int(min_fixes)
+        self.min_ratio = min_ratio
+        self.max_sigma = max_sigma
+        self.max_duration = max_duration
+        self.outlier_k = outlier_k
+        self.outlier_min_sigma = outlier_min_sigma
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        """Crea i criteri da un dizionario (es. JSON della richiesta), partendo da base."""
+        values = base.to_dict() if base else {}
+        for key, value in (data or {}).items():
+            if key not in cls.FIELDS:
+                raise ValueError(f"Criterio di arresto sconosciuto: {key}")
+            values[key] = None if value is None else float(value)
+        return cls(**values)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+
+class ConvergenceEngine:
+    """Statistiche incrementali sulle epoche fixed di una sessione.
+
+    add_epoch() costa O(1) per epoca e non conserva lo storico. Le
+    coordinate sono accumulate come scarti dalla prima epoca accettata,
+    così la varianza non perde precisione sui valori ECEF (~6e6 m).
+
+    Media e covarianza descrivono solo l'ultima serie di epoche fixed:
+    quando la serie si interrompe (fix perso o ratio basso) ripartono
+    dalla serie successiva, e ripartono anche dopo troppi outlier
+    consecutivi. Un fix errato iniziale non resta così il riferimento
+    con cui scartare per sempre le epoche corrette.
+    """
+
+    def __init__(self, criteria=None):
+        self.criteria = criteria or StopCriteria()
+        self.consecutive = 0    # Epoche fixed consecutive accettate
+        self.rejected = 0       # Outlier scartati
+        self.converged = False
+        self._run_broken = False  # Serie interrotta: le statistiche ripartono dal prossimo fix
+        self._reset()
+
+    def _reset(self):
+        self.count = 0          # Epoche accettate (dell'ultima serie)
+        self._origin = None
+        self._mean = [0.0, 0.0, 0.0]
+        self._m2 = [[0.0] * 3 for _ in range(3)]  # Somma dei prodotti degli scarti (Welford)
+        self._rejected_run = 0  # Outlier consecutivi
+
+    def add_epoch(self, epoch):
+        """Aggiunge un'epoca; restituisce True quando i criteri sono soddisfatti."""
+        if self.converged:
+            return True
+        ratio = epoch.get('ratio')
+        if epoch['q'] != Q_FIX or (self.criteria.min_ratio and ratio is not None and ratio < self.criteria.min_ratio):
+            # Fix perso (o non affidabile): la serie consecutiva riparte. Le statistiche
+            # vengono azzerate solo al prossimo fix, così result() resta la media dell'ultima serie
+            self.consecutive = 0
+            self._run_broken = self.count > 0
+            return False
+
+        if self._run_broken:
+            self._run_broken = False
+            self._reset()
+        xyz = llh_to_ecef(epoch['lat'], epoch['lon'], epoch['alt'])
+        if self._origin is None:
+            self._origin = xyz
+        d = [xyz[i] - self._origin[i] for i in range(3)]
+
+        if self._is_outlier(d):
+            self.rejected += 1
+            self.consecutive = 0
+            self._rejected_run += 1
+            if self._rejected_run < self._min_count():
+                return False
+            # Troppi outlier di fila: è la media a essere sbagliata, si riparte da questa epoca
+            self._reset()
+            self._origin = xyz
+            d = [0.0, 0.0, 0.0]
+        self._rejected_run = 0
+
+        # Aggiornamento di Welford di media e covarianza
+        self.count += 1
+        delta = [d[i] - self._mean[i] for i in range(3)]
+        for i in range(3):
+            self._mean[i] += delta[i] / self.count
+        for i in range(3):
+            for j in range(3):
+                self._m2[i][j] += delta[i] * (d[j] - self._mean[j])
+        self.consecutive += 1
+
+        self.converged = self._criteria_met()
+        return self.converged
+
+    def covariance(self):
+        """Covarianza campionaria ECEF (3x3) delle epoche accettate."""
+        if self.count < 2:
+            return None
+        return [[self._m2[i][j] / (self.count - 1) for j in range(3)] for i in range(3)]
+
+    def sigma_3d(self):
+        cov = self.covariance()
+        return math.sqrt(max(0.0, cov[0][0] + cov[1][1] + cov[2][2])) if cov else None
+
+    def result(self):
+        """Coordinata media con incertezza, o None se non ci sono epoche accettate.
+
+        Le deviazioni standard sono riportate nel sistema locale ENU del
+        punto medio (sigma_e, sigma_n, sigma_u), più leggibili di quelle ECEF.
+        """
+        if self.count == 0:
+            return None
+        x, y, z = (self._origin[i] + self._mean[i] for i in range(3))
+        lat, lon, alt = ecef_to_llh(x, y, z)
+        result = {
+            'x': x, 'y': y, 'z': z,
+            'lat': lat, 'lon': lon, 'alt': alt,
+            'fixes': self.count,
+            'rejected': self.rejected,
+            'converged': self.converged,
+        }
+        cov = self.covariance()
+        if cov:
+            # Covarianza ENU = R * C * R^T
+            rot = enu_rotation(lat, lon)
+            for name, row in zip(('sigma_e', 'sigma_n', 'sigma_u'), rot):
+                var = sum(row[i] * cov[i][j] * row[j] for i in range(3) for j in range(3))
+                result[name] = math.sqrt(max(0.0, var))
+            result['sigma_3d'] = self.sigma_3d()
+        return result
+
+    def _is_outlier(self, d):
+        # Servono alcune epoche prima che la dispersione sia significativa
+        if self.count < self._min_count():
+            return False
+        k = self.criteria.outlier_k
+        for i in range(3):
+            sigma = max(math.sqrt(self._m2[i][i] / (self.count - 1)), self.criteria.outlier_min_sigma)
+            if abs(d[i] - self._mean[i]) > k * sigma:
+                return True
+        return False
+
+    def _min_count(self):
+        return max(5, self.criteria.min_fixes // 3)
+
+    def _criteria_met(self):
+        if self.consecutive < self.criteria.min_fixes:
+            return False
+        if self.criteria.max_sigma is not None and self.count >= 2:
+            return self.sigma_3d() <= self.criteria.max_sigma
+        return True
+
+
+class StateTimeline:
+    """Transizioni dello stato di soluzione di una sessione (single → float → fix).
+
+    Registra solo i cambi di Q, come coppie (secondi dall'avvio, Q). Una
+    soluzione che oscilla fra float e fix non la fa crescere oltre
+    max_transitions: le transizioni successive vengono solo contate.
+    """
+
+    def __init__(self, max_transitions=100):
+        self.max_transitions = max_transitions
+        self.transitions = []
+        self.dropped = 0
+        self.state = None  # Q dell'ultima epoca
+
+    def add(self, elapsed, q):
+        """Registra lo stato di un'epoca; restituisce True se è cambiato."""
+        if q == self.state:
+            return False
+        self.state = q
+        if len(self.transitions) < self.max_transitions:
+            self.transitions.append((round(elapsed, 1), q))
+        else:
+            self.dropped += 1
+        return True
+
+    def to_list(self):
+        return [{'t': t, 'state': Q_NAMES.get(q, str(q))} for t, q in self.transitions]
+
+    def encode(self):
+        """Forma compatta per lo storico: 't:Q' separati da virgole (es. '0:5,12.4:2,61:1')."""
+        # Tempi arrotondati al decimo: '.10g' li conserva anche oltre le 6 cifre di ':g'
+        return ','.join(f"{t:.10g}:{q}" for t, q in self.transitions)
+
+    @staticmethod
+    def decode(text):
+        """Timeline (come to_list) dalla forma compatta di encode."""
+        timeline = []
+        for item in (text or '').split(','):
+            if item:
+                t, q = item.split(':')
+                timeline.append({'t': float(t), 'state': Q_NAMES.get(int(q), q)})
+        return timeline
+
+
+def format_result(result, master_coords=None):
+    """Coordinata finale da pubblicare: ECEF e sigma arrotondati al decimo di mm, baseline ENU dal master."""
+    if result is None:
+        return None
+    coords = {key: round(value, 4) if key in ('x', 'y', 'z') or key.startswith('sigma') else value
+              for key, value in result.items()}
+    if master_coords:
+        e, n, u = ecef_to_enu(result['x'], result['y'], result['z'],
+                              master_coords['lat'], master_coords['lon'], master_coords['alt'])
+        coords.update({'e': round(e, 4), 'n': round(n, 4), 'u': round(u, 4)})
+    return coords
@@ -0,0 +1,317 @@
+"""Coordinamento delle sessioni su più host (agenti, vedi agent.py).
+
+Il coordinatore interroga periodicamente gli agenti (carico e sessioni),
+assegna ogni nuova sessione all'agente meno carico e mantiene una vista
+aggregata dello stato, con la stessa forma degli snapshot del
+SessionManager locale. Le variazioni osservate vengono pubblicate
+sull'EventBus come eventi 'status' e 'coordinates'.
+"""
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Vista di una sessione remota: come SessionSnapshot, più l'agente che la esegue
+RemoteSnapshot = namedtuple('RemoteSnapshot', ['serial', 'status', 'rover_coords', 'active', 'agent'])
+
+
+class AgentClient:
+    """Client HTTP (JSON) di un agente, con l'ultimo stato noto."""
+
+    def __init__(self, url, token=None, timeout=5.0):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.reachable = False
+        self.load = None  # Ultima risposta di /agent/load
+        self.sessions = {}  # Ultima risposta di /agent/sessions
+        self.last_seen = None
+        self.pending = 0  # Avvii in corso verso questo agente
+
+    def request(self, method, path, data=None, timeout=None):
+        """Esegue una richiesta; restituisce (codice HTTP, corpo JSON).
+
+        Solleva OSError se l'agente non è raggiungibile.
+        """
+        body = json.dumps(data).encode() if data is not None else None
+        req = urllib.request.Request(self.url + path, data=body, method=method)
+        req.add_header('Content-Type', 'application/json')
+        if self.token:
+            req.add_header('X-Agent-Token', self.token)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout or self.timeout) as response:
+                return response.status, json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            try:
+                payload = json.loads(e.read() or b'{}')
+            except ValueError:
+                payload = {"error": f"HTTP {e.code}"}
+            return e.code, payload
+
+    def refresh(self):
+        """Aggiorna carico e sessioni; restituisce True se l'agente ha risposto."""
+        started = time.time()
+        try:
+            _, load = self.request('GET', '/agent/load')
+            _, sessions = self.request('GET', '/agent/sessions')
+        except (OSError, ValueError) as e:
+            if self.reachable:
+                print(f"Agente {self.url} non raggiungibile: {e}")
+            self.reachable = False
+            return False
+        if not self.reachable:
+            print(f"Agente {self.url} raggiungibile ({load.get('sessions')} sessioni)")
+        self.reachable = True
+        self.load = load
+        self.sessions = sessions.get('sessions', {})
+        self.last_seen = started  # Lo stato riportato è successivo a questo istante
+        return True
+
+    def score(self):
+        """Carico relativo (più basso = preferito), None se l'agente è pieno o irraggiungibile."""
+        if not self.reachable or not self.load:
+            return None
+        sessions = self.load['sessions'] + self.pending
+        if sessions >= self.load['max_sessions']:
+            return None
+        return sessions / self.load['max_sessions'] + self.load['load']
+
+    def info(self):
+        return {
+            'url': self.url,
+            'reachable': self.reachable,
+            'sessions': self.load['sessions'] if self.load else None,
+            'max_sessions': self.load['max_sessions'] if self.load else None,
+            'load': self.load['load'] if self.load else None,
+            'cpu_count': self.load['cpu_count'] if self.load else None,
+            'pending': self.pending,
+            'last_seen': self.last_seen,
+        }
+
+
+class SessionCoordinator:
+    """Distribuisce le sessioni sugli agenti in base al carico.
+
+    L'assegnazione serial -> agente viene ricostruita dalle sessioni
+    riportate dagli agenti, quindi sopravvive al riavvio del coordinatore.
+    """
+
+    def __init__(self, agent_urls, events=None, token=None, poll_interval=2.0, max_parallel_starts=8):
+        self.agents = [AgentClient(url, token) for url in agent_urls]
+        self.events = events
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self._assignments = {}  # serial -> AgentClient
+        self._snapshots = {}  # serial -> RemoteSnapshot (copy-on-write, come nel SessionManager)
+        self._started = {}  # serial -> istante dell'avvio eseguito da questo coordinatore
+        self._poller = ThreadPoolExecutor(max_workers=max(1, len(self.agents)), thread_name_prefix='coordinator-poll')
+        self._launcher = ThreadPoolExecutor(max_workers=max_parallel_starts, thread_name_prefix='coordinator')
+        self.refresh()
+        self._thread = threading.Thread(target=self._poll, name='coordinator-poll', daemon=True)
+        self._thread.start()
+
+    # --- Stato aggregato ----------------------------------------------------
+
+    def refresh(self):
+        """Interroga tutti gli agenti in parallelo e aggiorna la vista aggregata."""
+        list(self._poller.map(AgentClient.refresh, self.agents))
+        with self.lock:
+            snapshots = {}
+            for agent in self.agents:
+                if not agent.reachable:
+                    # Ultimo stato noto, finché l'agente non torna raggiungibile
+                    for serial, snap in self._snapshots.items():
+                        if snap.agent == agent.url:
+                            snapshots[serial] = snap._replace(status='unreachable')
+                    continue
+                for serial, session in agent.sessions.items():
+                    snapshots[serial] = RemoteSnapshot(serial, session['status'], session['coordinates'],
+                                                       session['active'], agent.url)
+                    self._assignments[serial] = agent
+            for serial, agent in list(self._assignments.items()):
+                if serial in snapshots:
+                    continue
+                if serial in self._snapshots and self._started.get(serial, 0) >= (agent.last_seen or 0):
+                    # Avviata dopo l'interrogazione dell'agente: non ancora nel suo elenco
+                    snapshots[serial] = self._snapshots[serial]
+                    continue
+                del self._assignments[serial]
+                self._started.pop(serial, None)
+            self._publish_changes(snapshots)
+
+    def _publish_changes(self, snapshots):
+        # Da chiamare con self.lock acquisito
+        previous = self._snapshots
+        self._snapshots = snapshots
+        if self.events is None:
+            return
+        for serial, snap in snapshots.items():
+            old = previous.get(serial)
+            if old is None or old.status != snap.status:
+                self.events.publish('status', {'serial': serial, 'status': snap.status})
+            if snap.rover_coords and (old is None or old.rover_coords != snap.rover_coords):
+                self.events.publish('coordinates', {'serial': serial, 'coordinates': snap.rover_coords})
+        for serial in previous.keys() - snapshots.keys():
+            self.events.publish('status', {'serial': serial, 'status': 'stopped'})
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Errore nell'aggiornamento dello stato degli agenti: {e}")
+
+    def get_snapshots(self):
+        return self._snapshots
+
+    def has_session(self, serial):
+        return serial in self._snapshots
+
+    def is_session_running(self, serial):
+        snap = self._snapshots.get(serial)
+        return snap is not None and snap.active
+
+    def get_active_serials(self):
+        return [serial for serial, snap in self._snapshots.items() if snap.active]
+
+    def get_session_status(self, serial):
+        snap = self._snapshots.get(serial)
+        return snap.status if snap else 'stopped'
+
+    def agents_status(self):
+        return [agent.info() for agent in self.agents]
+
+    # --- Comandi ------------------------------------------------------------
+
+    def _choose_agent(self):
+        # Da chiamare con self.lock acquisito
+        scored = [(score, agent) for agent in self.agents if (score := agent.score()) is not None]
+        if not scored:
+            return None
+        return min(scored, key=lambda item: item[0])[1]
+
+    def start_session(self, rover, master, criteria=None, campaign=None):
+        """Avvia la sessione sull'agente meno carico. Restituisce (success, message)."""
+        serial = rover['serial']
+        with self.lock:
+            if self.is_session_running(serial):
+                return False, "Sessione già attiva per questo rover"
+            agent = self._choose_agent()
+            if agent is None:
+                return False, "Nessun agente disponibile"
+            # Conteggiato subito: gli avvii in blocco si distribuiscono fra gli agenti
+            agent.pending += 1
+
+        data = {'rover': rover, 'master': master}
+        if criteria is not None:
+            data['criteria'] = criteria.to_dict()
+        if campaign is not None:
+            data['campaign'] = campaign
+        try:
+            # L'avvio attende la posizione del master (fino a 10 s)
+            status, payload = agent.request('POST', f'/agent/sessions/{serial}/start', data, timeout=30)
+        except OSError as e:
+            agent.reachable = False
+            return False, f"Agente {agent.url} non raggiungibile: {e}"
+        finally:
+            with self.lock:
+                agent.pending -= 1
+
+        if status != 200:
+            return False, f"{payload.get('error', f'HTTP {status}')} (agente {agent.url})"
+        with self.lock:
+            if agent.load:
+                agent.load['sessions'] += 1
+            self._assignments[serial] = agent
+            self._started[serial] = time.time()
+            snapshots = dict(self._snapshots)
+            snapshots[serial] = RemoteSnapshot(serial, 'running', None, True, agent.url)
+            self._publish_changes(snapshots)
+        return True, f"{payload.get('message', 'Sessione avviata')} (agente {agent.url})"
+
+    def stop_session(self, serial):
+        with self.lock:
+            agent = self._assignments.get(serial)
+        if agent is None:
+            return False, "Nessuna sessione attiva per questo rover"
+        try:
+            status, payload = agent.request('POST', f'/agent/sessions/{serial}/stop')
+        except OSError as e:
+            return False, f"Agente {agent.url} non raggiungibile: {e}"
+        if status != 200:
+            return False, payload.get('error', f"HTTP {status}")
+        with self.lock:
+            self._assignments.pop(serial, None)
+            self._started.pop(serial, None)
+            snapshots = dict(self._snapshots)
+            snapshots.pop(serial, None)
+            self._publish_changes(snapshots)
+        return True, payload.get('message', f"Sessione fermata per rover {serial}")
+
+    def start_sessions(self, pairs, criteria=None, campaign=None):
+        futures = {rover['serial']: self._launcher.submit(self.start_session, rover, master, criteria, campaign)
+                   for rover, master in pairs}
+        return self._collect_results(futures)
+
+    def stop_sessions(self, serials):
+        futures = {serial: self._launcher.submit(self.stop_session, serial) for serial in serials}
+        return self._collect_results(futures)
+
+    def _collect_results(self, futures):
+        results = {}
+        for serial, future in futures.items():
+            try:
+                success, message = future.result()
+            except Exception as e:
+                success, message = False, str(e)
+            results[serial] = {'success': success, 'message': message}
+        return results
+
+    def _agent_get(self, serial, path):
+        """GET sull'agente che esegue la sessione; (agente, risposta JSON), o (agente, None) se non disponibile."""
+        with self.lock:
+            agent = self._assignments.get(serial)
+        if agent is None:
+            return None, None
+        try:
+            status, payload = agent.request('GET', f'/agent/sessions/{serial}{path}')
+        except (OSError, ValueError):
+            return agent, None
+        if status != 200:
+            return agent, None
+        return agent, payload
+
+    def get_process_info(self, serial):
+        agent, payload = self._agent_get(serial, '/process')
+        if payload is None:
+            return None
+        payload['agent'] = agent.url
+        return payload
+
+    def get_session_timeline(self, serial):
+        agent, payload = self._agent_get(serial, '/timeline')
+        if payload is None:
+            return None
+        payload['agent'] = agent.url
+        return payload
+
+    def get_session_output(self, serial, lines=20, after=None):
+        """Righe del .pos letto dall'agente, nella forma di SessionManager.get_session_output."""
+        query = f'/output?lines={int(lines)}' + (f'&after={int(after)}' if after is not None else '')
+        agent, payload = self._agent_get(serial, query)
+        if payload is None:
+            reason = f"l'agente {agent.url} non ha risposto" if agent else "sessione non assegnata ad alcun agente"
+            return {'output': [f"Output non disponibile: {reason}"], 'offset': after or 0, 'reset': False}
+        return payload
+
+    def get_session_output_version(self, serial):
+        agent, payload = self._agent_get(serial, '/output/version')
+        if payload is None or not payload.get('version'):
+            return None
+        # Il prefisso dell'agente evita collisioni fra file di host diversi
+        return f"{zlib.crc32(agent.url.encode()):x}-{payload['version']}"
@@ -0,0 +1,61 @@
+import json
+import queue
+import threading
+
+
+class EventBus:
+    """Distribuisce gli eventi delle sessioni ai client connessi (SSE).
+
+    Ogni sottoscrittore ha una coda limitata: se un client è troppo lento
+    e la coda si riempie, gli eventi vengono scartati e il client riceve un
+    evento 'resync' che gli chiede di ricaricare lo stato completo.
+    """
+
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    def publish(self, event_type, data):
+        """Invia un evento a tutti i sottoscrittori senza mai bloccare."""
+        event = {'type': event_type, 'data': data}
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Client lento: svuota la coda e chiedi una risincronizzazione
+                try:
+                    while True:
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait({'type': 'resync', 'data': {}})
+
+    def stream(self, keepalive=15):
+        """Generatore di messaggi in formato Server-Sent Events."""
+        q = self.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = q.get(timeout=keepalive)
+                except queue.Empty:
+                    # Commento SSE per mantenere viva la connessione
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            self.unsubscribe(q)
@@ -0,0 +1,172 @@
+"""Conversioni di coordinate sull'ellissoide WGS84.
+
+Le funzioni scalari (math) sono usate nel percorso in tempo reale, una
+epoca alla volta. Le versioni *_batch (NumPy) convertono interi storici
+di epoche in un'unica operazione vettoriale.
+
+Latitudine e longitudine sono in gradi, altezze e coordinate in metri.
+"""
+import math
+
+import numpy as np
+
+
+# Parametri dell'ellissoide WGS84
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+WGS84_E2 = WGS84_F * (2 - WGS84_F)  # eccentricità al quadrato
+WGS84_EP2 = (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2  # seconda eccentricità al quadrato
+
+
+# --- Percorso scalare ---------------------------------------------------
+
+def llh_to_ecef(lat, lon, h):
+    """Converte latitudine, longitudine, altezza ellissoidica in ECEF (x, y, z)."""
+    lat_r = math.radians(lat)
+    lon_r = math.radians(lon)
+    sin_lat = math.sin(lat_r)
+    cos_lat = math.cos(lat_r)
+    n = WGS84_A / math.sqrt(1 - WGS84_E2 * sin_lat * sin_lat)
+    x = (n + h) * cos_lat * math.cos(lon_r)
+    y = (n + h) * cos_lat * math.sin(lon_r)
+    z = (n * (1 - WGS84_E2) + h) * sin_lat
+    return x, y, z
+
+
+def ecef_to_llh(x, y, z):
+    """Converte ECEF in (lat, lon, h) con la soluzione in forma chiusa di Heikkinen."""
+    a2 = WGS84_A * WGS84_A
+    b2 = WGS84_B * WGS84_B
+    e4 = WGS84_E2 * WGS84_E2
+    p2 = x * x + y * y
+    p = math.sqrt(p2)
+    z2 = z * z
+
+    f = 54 * b2 * z2
+    g = p2 + (1 - WGS84_E2) * z2 - WGS84_E2 * (a2 - b2)
+    c = e4 * f * p2 / (g * g * g)
+    s = (1 + c + math.sqrt(c * c + 2 * c)) ** (1 / 3)
+    k = s + 1 + 1 / s
+    pp = f / (3 * k * k * g * g)
+    q = math.sqrt(1 + 2 * e4 * pp)
+    r0 = (-(pp * WGS84_E2 * p) / (1 + q)
+          + math.sqrt(max(0.0, a2 / 2 * (1 + 1 / q) - pp * (1 - WGS84_E2) * z2 / (q * (1 + q)) - pp * p2 / 2)))
+    t = p - WGS84_E2 * r0
+    u = math.sqrt(t * t + z2)
+    v = math.sqrt(t * t + (1 - WGS84_E2) * z2)
+    z0 = b2 * z / (WGS84_A * v)
+
+    h = u * (1 - b2 / (WGS84_A * v))
+    lat = math.degrees(math.atan2(z + WGS84_EP2 * z0, p))
+    lon = math.degrees(math.atan2(y, x))
+    return lat, lon, h
+
+
+def enu_rotation(ref_lat, ref_lon):
+    """Matrice di rotazione ECEF -> ENU (righe: est, nord, alto) nel punto di riferimento."""
+    lat_r = math.radians(ref_lat)
+    lon_r = math.radians(ref_lon)
+    sin_lat, cos_lat = math.sin(lat_r), math.cos(lat_r)
+    sin_lon, cos_lon = math.sin(lon_r), math.cos(lon_r)
+    return (
+        (-sin_lon, cos_lon, 0.0),
+        (-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat),
+        (cos_lat * cos_lon, cos_lat * sin_lon, sin_lat),
+    )
+
+
+def ecef_to_enu(x, y, z, ref_lat, ref_lon, ref_h):
+    """Coordinate locali (e, n, u) di un punto ECEF rispetto a un riferimento LLH (es. il master)."""
+    ref = llh_to_ecef(ref_lat, ref_lon, ref_h)
+    d = (x - ref[0], y - ref[1], z - ref[2])
+    rot = enu_rotation(ref_lat, ref_lon)
+    return tuple(row[0] * d[0] + row[1] * d[1] + row[2] * d[2] for row in rot)
+
+
+def enu_to_ecef(e, n, u, ref_lat, ref_lon, ref_h):
+    """Inversa di ecef_to_enu."""
+    ref = llh_to_ecef(ref_lat, ref_lon, ref_h)
+    rot = enu_rotation(ref_lat, ref_lon)
+    enu = (e, n, u)
+    # La matrice di rotazione è ortogonale: l'inversa è la trasposta
+    return tuple(ref[i] + sum(rot[j][i] * enu[j] for j in range(3)) for i in range(3))
+
+
+def llh_to_enu(lat, lon, h, ref_lat, ref_lon, ref_h):
+    return ecef_to_enu(*llh_to_ecef(lat, lon, h), ref_lat, ref_lon, ref_h)
+
+
+def enu_to_llh(e, n, u, ref_lat, ref_lon, ref_h):
+    return ecef_to_llh(*enu_to_ecef(e, n, u, ref_lat, ref_lon, ref_h))
+
+
+# --- Percorso vettoriale (NumPy) ----------------------------------------
+
+def llh_to_ecef_batch(lat, lon, h):
+    """Versione vettoriale di llh_to_ecef. Restituisce un array (N, 3)."""
+    lat_r = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_r = np.radians(np.asarray(lon, dtype=np.float64))
+    h = np.asarray(h, dtype=np.float64)
+    sin_lat = np.sin(lat_r)
+    cos_lat = np.cos(lat_r)
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_lat * sin_lat)
+    out = np.empty(lat_r.shape + (3,))
+    nh_cos = (n + h) * cos_lat
+    out[..., 0] = nh_cos * np.cos(lon_r)
+    out[..., 1] = nh_cos * np.sin(lon_r)
+    out[..., 2] = (n * (1 - WGS84_E2) + h) * sin_lat
+    return out
+
+
+def ecef_to_llh_batch(xyz):
+    """Versione vettoriale di ecef_to_llh. xyz è un array (N, 3); restituisce (N, 3) lat, lon, h."""
+    xyz = np.asarray(xyz, dtype=np.float64)
+    x, y, z = xyz[..., 0], xyz[..., 1], xyz[..., 2]
+    a2 = WGS84_A * WGS84_A
+    b2 = WGS84_B * WGS84_B
+    e4 = WGS84_E2 * WGS84_E2
+    p2 = x * x + y * y
+    p = np.sqrt(p2)
+    z2 = z * z
+
+    f = 54 * b2 * z2
+    g = p2 + (1 - WGS84_E2) * z2 - WGS84_E2 * (a2 - b2)
+    c = e4 * f * p2 / (g * g * g)
+    s = np.cbrt(1 + c + np.sqrt(c * c + 2 * c))
+    k = s + 1 + 1 / s
+    pp = f / (3 * k * k * g * g)
+    q = np.sqrt(1 + 2 * e4 * pp)
+    r0 = (-(pp * WGS84_E2 * p) / (1 + q)
+          + np.sqrt(np.maximum(0.0, a2 / 2 * (1 + 1 / q) - pp * (1 - WGS84_E2) * z2 / (q * (1 + q)) - pp * p2 / 2)))
+    t = p - WGS84_E2 * r0
+    t2 = t * t
+    u = np.sqrt(t2 + z2)
+    v = np.sqrt(t2 + (1 - WGS84_E2) * z2)
+    z0 = b2 * z / (WGS84_A * v)
+
+    out = np.empty(xyz.shape)
+    out[..., 0] = np.degrees(np.arctan2(z + WGS84_EP2 * z0, p))
+    out[..., 1] = np.degrees(np.arctan2(y, x))
+    out[..., 2] = u * (1 - b2 / (WGS84_A * v))
+    return out
+
+
+def _enu_rotation_matrix(ref_lat, ref_lon):
+    return np.array(enu_rotation(ref_lat, ref_lon))
+
+
+def ecef_to_enu_batch(xyz, ref_lat, ref_lon, ref_h):
+    """Versione vettoriale di ecef_to_enu. xyz è (N, 3); restituisce (N, 3) e, n, u."""
+    ref = np.array(llh_to_ecef(ref_lat, ref_lon, ref_h))
+    return (np.asarray(xyz, dtype=np.float64) - ref) @ _enu_rotation_matrix(ref_lat, ref_lon).T
+
+
+def enu_to_ecef_batch(enu, ref_lat, ref_lon, ref_h):
+    """Versione vettoriale di enu_to_ecef."""
+    ref = np.array(llh_to_ecef(ref_lat, ref_lon, ref_h))
+    return np.asarray(enu, dtype=np.float64) @ _enu_rotation_matrix(ref_lat, ref_lon) + ref
+
+
+def llh_to_enu_batch(lat, lon, h, ref_lat, ref_lon, ref_h):
+    return ecef_to_enu_batch(llh_to_ecef_batch(lat, lon, h), ref_lat, ref_lon, ref_h)
@@ -0,0 +1,206 @@
+"""Verifica dello stato dei ricevitori (rover e master) prima dell'avvio delle sessioni.
+
+Per ogni dispositivo il prober si collega a ip:porta e attende alcuni
+frame RTCM3 validi: un ricevitore che accetta la connessione ma non
+trasmette viene segnalato come 'silent'. Le verifiche girano in un loop
+asyncio dedicato, tutte in parallelo: N dispositivi richiedono al più un
+timeout, non N.
+
+I risultati restano in cache (ttl per quelli positivi, retry_after per
+gli errori) e non si apre una seconda connessione verso un ricevitore
+già in uso: la funzione busy(device) può fornire lo stato da una
+sessione attiva o dal relay delle correzioni.
+"""
+import asyncio
+import threading
+import time
+
+from rtcm import RtcmFrameReader, message_type
+
+# Stati di una verifica
+OK = 'ok'  # Connessione riuscita e frame RTCM ricevuti
+SILENT = 'silent'  # Connessione riuscita, nessun frame RTCM entro il timeout
+UNREACHABLE = 'unreachable'  # Connessione rifiutata o scaduta
+IN_USE = 'in_use'  # Ricevitore già collegato a una sessione: non verificato
+
+
+def endpoint_of(device):
+    return device['ip'], int(device['port'])
+
+
+def make_result(device, status, error=None, **fields):
+    result = {
+        'status': status,
+        'endpoint': f"{device['ip']}:{device['port']}",
+        'error': error,
+        'checked_at': time.time(),
+    }
+    result.update(fields)
+    return result
+
+
+class HealthProber:
+    """Verifiche concorrenti, con cache, degli endpoint TCP dei dispositivi.
+
+    Il loop asyncio gira in un thread dedicato, avviato al primo utilizzo;
+    i metodi pubblici sono thread-safe e bloccano al più per un timeout.
+    """
+
+    def __init__(self, timeout=3.0, ttl=30.0, retry_after=5.0, min_frames=2, max_concurrency=256, busy=None):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.min_frames = min_frames
+        self.max_concurrency = max_concurrency
+        # busy(device) -> risultato (es. IN_USE) se il ricevitore è già collegato, altrimenti None
+        self.busy = busy
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._results = {}  # (host, port) -> ultimo risultato
+        self._inflight = {}  # (host, port) -> asyncio.Task, solo dal thread del loop
+        self._semaphore = None
+        self._watch_thread = None
+
+    def probe_devices(self, devices, refresh=False):
+        """Stato di ogni dispositivo (serial -> risultato); verifica solo quelli senza risultato valido."""
+        results = {}
+        pending = {}  # (host, port) -> dispositivi con quell'endpoint
+        for device in devices:
+            result = self.busy(device) if self.busy is not None else None
+            if result is None and not refresh:
+                result = self._fresh(endpoint_of(device))
+            if result is not None:
+                results[device['serial']] = result
+            else:
+                pending.setdefault(endpoint_of(device), []).append(device)
+
+        if pending:
+            future = asyncio.run_coroutine_threadsafe(self._probe_many(pending), self._ensure_loop())
+            probed = future.result(timeout=self.timeout + 5)
+            for endpoint, endpoint_devices in pending.items():
+                for device in endpoint_devices:
+                    results[device['serial']] = probed[endpoint]
+        return results
+
+    def check(self, *devices):
+        """Messaggio d'errore se uno dei dispositivi non è utilizzabile, altrimenti None."""
+        results = self.probe_devices(devices)
+        for device in devices:
+            result = results[device['serial']]
+            if result['status'] == UNREACHABLE:
+                return f"{device['role']} {device['serial']} ({result['endpoint']}) non raggiungibile: {result['error']}"
+            if result['status'] == SILENT:
+                return (f"{device['role']} {device['serial']} ({result['endpoint']}) non trasmette dati RTCM"
+                        f" ({result['error']})")
+        return None
+
+    def last_results(self, devices):
+        """Ultimo risultato noto di ogni dispositivo (serial -> risultato o None), senza verificarli."""
+        results = {}
+        for device in devices:
+            result = self.busy(device) if self.busy is not None else None
+            if result is None:
+                with self._lock:
+                    result = self._results.get(endpoint_of(device))
+            results[device['serial']] = result
+        return results
+
+    def watch(self, devices, interval=60.0):
+        """Verifica periodicamente tutti i dispositivi restituiti da devices()."""
+        def run():
+            while True:
+                try:
+                    self.probe_devices(devices(), refresh=True)
+                except Exception as e:
+                    print(f"Errore nella verifica dei dispositivi: {e}")
+                time.sleep(interval)
+
+        self._watch_thread = threading.Thread(target=run, name='health-watch', daemon=True)
+        self._watch_thread.start()
+
+    def _fresh(self, endpoint):
+        with self._lock:
+            result = self._results.get(endpoint)
+        if result is None:
+            return None
+        max_age = self.ttl if result['status'] == OK else self.retry_after
+        return result if time.time() - result['checked_at'] < max_age else None
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='health-probe', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    # --- Dal thread del loop ----------------------------------------------
+
+    async def _probe_many(self, pending):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = {}
+        for endpoint, devices in pending.items():
+            # Una sola connessione per endpoint, anche fra richieste concorrenti
+            task = self._inflight.get(endpoint)
+            if task is None:
+                task = self._inflight[endpoint] = asyncio.ensure_future(self._probe(endpoint, devices[0]))
+                task.add_done_callback(lambda _task, endpoint=endpoint: self._inflight.pop(endpoint, None))
+            tasks[endpoint] = task
+        results = await asyncio.gather(*tasks.values())
+        return dict(zip(tasks.keys(), results))
+
+    async def _probe(self, endpoint, device):
+        async with self._semaphore:
+            try:
+                result = await self._sniff(endpoint, device)
+            except asyncio.TimeoutError:
+                result = make_result(device, UNREACHABLE, f"nessuna connessione entro {self.timeout} s")
+            except OSError as e:
+                result = make_result(device, UNREACHABLE, e.strerror or str(e))
+        with self._lock:
+            self._results[endpoint] = result
+        return result
+
+    async def _sniff(self, endpoint, device):
+        """Si collega e attende min_frames frame RTCM, tutto entro un solo timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*endpoint), self.timeout)
+        connect_ms = round((self.timeout - (deadline - loop.time())) * 1000, 1)
+        frames = RtcmFrameReader()
+        messages = set()
+        received = 0
+        count = 0
+        closed = False
+        try:
+            while count < self.min_frames:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    data = await asyncio.wait_for(reader.read(4096), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    closed = True
+                    break
+                received += len(data)
+                for payload in frames.feed(data):
+                    count += 1
+                    messages.add(message_type(payload))
+        finally:
+            writer.close()
+
+        fields = {'connect_ms': connect_ms, 'bytes': received, 'frames': count, 'messages': sorted(messages)}
+        if count:
+            return make_result(device, OK, **fields)
+        if closed:
+            error = "connessione chiusa dal ricevitore"
+        elif received:
+            error = f"{received} byte ricevuti, nessun frame RTCM valido"
+        else:
+            error = f"nessun dato entro {self.timeout} s"
+        return make_result(device, SILENT, error, **fields)
@@ -0,0 +1,373 @@
+"""Storico persistente delle sessioni (SQLite).
+
+Ogni sessione viene registrata con inizio, fine, tempi al fix, timeline
+degli stati (single → float → fix), coordinata finale e incertezza;
+opzionalmente anche un sottoinsieme delle epoche
+(una ogni epoch_interval secondi). Le scritture sono accodate e
+raggruppate in transazioni da un unico thread, come in BatchFileWriter;
+solo l'inserimento di una sessione è immediato, perché l'id assegnato da
+SQLite serve subito. Il database è in modalità WAL, quindi le letture non
+bloccano il writer.
+"""
+import queue
+import sqlite3
+import statistics
+import threading
+import time
+
+from convergence import StateTimeline
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serial TEXT NOT NULL,
+    rover_name TEXT,
+    master_serial TEXT,
+    profile TEXT,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    status TEXT,
+    time_to_float REAL,
+    time_to_first_fix REAL,
+    time_to_fix REAL,
+    x REAL, y REAL, z REAL,
+    lat REAL, lon REAL, alt REAL,
+    sigma_e REAL, sigma_n REAL, sigma_u REAL, sigma_3d REAL,
+    fixes INTEGER,
+    restarts INTEGER,
+    source TEXT DEFAULT 'live',
+    timeline TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_serial_time ON sessions (serial, start_time);
+CREATE INDEX IF NOT EXISTS sessions_time ON sessions (start_time);
+
+CREATE TABLE IF NOT EXISTS epochs (
+    session_id INTEGER NOT NULL,
+    time REAL NOT NULL,
+    gpst TEXT,
+    lat REAL, lon REAL, alt REAL,
+    q INTEGER, ns INTEGER, ratio REAL
+);
+CREATE INDEX IF NOT EXISTS epochs_session_time ON epochs (session_id, time);
+"""
+
+# Colonne aggiunte dopo la prima versione dello schema (database esistenti)
+_ADDED_COLUMNS = {
+    'source': "TEXT DEFAULT 'live'",  # Sessioni precedenti alla rielaborazione offline: tutte dal vivo
+    'time_to_float': "REAL",
+    'timeline': "TEXT",
+}
+_SESSION_COLUMNS = ('id', 'serial', 'rover_name', 'master_serial', 'profile', 'start_time', 'end_time',
+                    'status', 'time_to_float', 'time_to_first_fix', 'time_to_fix', 'x', 'y', 'z', 'lat', 'lon',
+                    'alt', 'sigma_e', 'sigma_n', 'sigma_u', 'sigma_3d', 'fixes', 'restarts', 'source', 'timeline')
+_RESULT_COLUMNS = ('x', 'y', 'z', 'lat', 'lon', 'alt', 'sigma_e', 'sigma_n', 'sigma_u', 'sigma_3d', 'fixes')
+# Tempi analizzabili in ttf_stats e ttf_distribution
+TTF_METRICS = ('time_to_float', 'time_to_first_fix', 'time_to_fix')
+# Estremi superiori (s) delle classi delle distribuzioni dei tempi al fix
+TTF_BUCKETS = (10, 30, 60, 120, 300, 600, 900, 1200, 1800, 3600)
+# Esiti di sessioni concluse dal manager: quelle fermate dall'operatore non contano nel tasso di fix
+_FINISHED = ('fix', 'timeout', 'error')
+
+
+class HistoryStore:
+    """Archivio SQLite delle sessioni e delle epoche (sottocampionate).
+
+    I metodi di scrittura non bloccano il chiamante: accodano l'operazione
+    per il thread di scrittura, che esegue una transazione al più ogni
+    flush_interval secondi o ogni max_batch operazioni.
+    """
+
+    def __init__(self, path='history.db', epoch_interval=10.0, flush_interval=1.0, max_batch=500):
+        self.path = path
+        self.epoch_interval = epoch_interval  # None: epoche non registrate
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._local = threading.local()  # Connessione di lettura per thread
+        self._last_epoch = {}  # session_id -> istante dell'ultima epoca registrata
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if existing:
+            for column, declaration in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} {declaration}")
+            conn.commit()
+        conn.executescript(SCHEMA)
+        # Sessioni rimaste 'running' da un'esecuzione precedente (arresto del
+        # manager o crash): chiuse come 'interrupted' all'ultima epoca registrata
+        with conn:
+            interrupted = conn.execute(
+                "UPDATE sessions SET status = 'interrupted', "
+                "end_time = (SELECT MAX(time) FROM epochs WHERE session_id = sessions.id) "
+                "WHERE status = 'running'").rowcount
+        if interrupted:
+            print(f"Storico: {interrupted} sessioni non concluse segnate come interrotte")
+        conn.close()
+        # Connessione per gli inserimenti delle sessioni (da qualunque thread, sotto _insert_lock)
+        self._insert_conn = self._connect(check_same_thread=False)
+        self._insert_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def _connect(self, check_same_thread=True):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Scrittura (asincrona) ----------------------------------------------
+
+    def start_session(self, serial, rover_name=None, master_serial=None, profile=None, start_time=None,
+                      source='live'):
+        """Registra l'inizio di una sessione e ne restituisce l'id (None se la scrittura non riesce).
+
+        source distingue le sessioni dal vivo ('live') da quelle rielaborate
+        da file registrati ('replay').
+        """
+        try:
+            with self._insert_lock, self._insert_conn:
+                cursor = self._insert_conn.execute(
+                    "INSERT INTO sessions (serial, rover_name, master_serial, profile, start_time, status, source) "
+                    "VALUES (?, ?, ?, ?, ?, 'running', ?)",
+                    (serial, rover_name, master_serial, profile, start_time or time.time(), source))
+        except sqlite3.Error as e:
+            print(f"Errore nella registrazione della sessione {serial} nello storico: {e}")
+            return None
+        return cursor.lastrowid
+
+    def record_epoch(self, session_id, epoch, now=None):
+        """Registra un'epoca, se è passato almeno epoch_interval dall'ultima."""
+        if self.epoch_interval is None:
+            return
+        now = now or time.time()
+        with self._lock:
+            last = self._last_epoch.get(session_id)
+            if last is not None and now - last < self.epoch_interval:
+                return
+            self._last_epoch[session_id] = now
+        self._queue.put(("INSERT INTO epochs (session_id, time, gpst, lat, lon, alt, q, ns, ratio) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (session_id, now, epoch.get('time'), epoch['lat'], epoch['lon'], epoch['alt'],
+                          epoch['q'], epoch.get('ns'), epoch.get('ratio'))))
+
+    def record_first_fix(self, session_id, time_to_first_fix):
+        self._queue.put(("UPDATE sessions SET time_to_first_fix = ? WHERE id = ?",
+                         (time_to_first_fix, session_id)))
+
+    def end_session(self, session_id, status, coordinates=None, time_to_fix=None, restarts=0, end_time=None,
+                    time_to_float=None, timeline=None):
+        """Registra la fine della sessione con la coordinata finale (se presente).
+
+        timeline è la forma compatta di StateTimeline (StateTimeline.encode).
+        """
+        with self._lock:
+            self._last_epoch.pop(session_id, None)
+        coordinates = coordinates or {}
+        values = [coordinates.get(column) for column in _RESULT_COLUMNS]
+        self._queue.put((f"UPDATE sessions SET end_time = ?, status = ?, time_to_fix = ?, restarts = ?, "
+                         f"time_to_float = ?, timeline = ?, "
+                         f"{', '.join(f'{column} = ?' for column in _RESULT_COLUMNS)} WHERE id = ?",
+                         (end_time or time.time(), status, time_to_fix, restarts, time_to_float, timeline,
+                          *values, session_id)))
+
+    def flush(self, timeout=None):
+        """Attende che tutte le operazioni accodate finora siano scritte."""
+        done = threading.Event()
+        self._queue.put((None, done))
+        return done.wait(timeout)
+
+    def _run(self):
+        conn = self._connect()
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                sql, params = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                sql, params = None, None
+
+            if sql is not None:
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                pending.append((sql, params))
+                if len(pending) < self.max_batch:
+                    continue
+
+            self._write(conn, pending)
+            pending = []
+            deadline = None
+            if sql is None and params is not None:
+                params.set()  # Richiesta di flush
+
+    def _write(self, conn, pending):
+        if not pending:
+            return
+        try:
+            with conn:  # Una sola transazione per tutto il blocco
+                for sql, params in pending:
+                    conn.execute(sql, params)
+            return
+        except sqlite3.Error as e:
+            print(f"Errore nella scrittura dello storico, nuovo tentativo operazione per operazione: {e}")
+        # Il blocco è stato annullato: un'istruzione non valida non deve far perdere le altre
+        for sql, params in pending:
+            try:
+                with conn:
+                    conn.execute(sql, params)
+            except sqlite3.Error as e:
+                print(f"Operazione sullo storico scartata ({' '.join(sql.split()[:3])}): {e}")
+
+    # --- Lettura ------------------------------------------------------------
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def query_sessions(self, serial=None, since=None, until=None, status=None, limit=100, offset=0, source=None,
+                       master=None):
+        """Sessioni più recenti per prime, filtrate per rover, master, intervallo, stato e origine."""
+        where, params = self._filters(serial, since, until, status, source, master)
+        rows = self._reader().execute(
+            f"SELECT {', '.join(_SESSION_COLUMNS)} FROM sessions {where} "
+            "ORDER BY start_time DESC LIMIT ? OFFSET ?", (*params, limit, offset)).fetchall()
+        return [_session_row(row) for row in rows]
+
+    def get_session(self, session_id):
+        row = self._reader().execute(
+            f"SELECT {', '.join(_SESSION_COLUMNS)} FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return _session_row(row) if row else None
+
+    def session_epochs(self, session_id, limit=10000):
+        rows = self._reader().execute(
+            "SELECT time, gpst, lat, lon, alt, q, ns, ratio FROM epochs WHERE session_id = ? "
+            "ORDER BY time LIMIT ?", (session_id, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def ttf_stats(self, serial=None, since=None, until=None, source=None, by='serial', master=None):
+        """Statistiche dei tempi al fix (primo FLOAT, primo FIX e convergenza).
+
+        by raggruppa per rover ('serial'), per sito, cioè per master di
+        riferimento ('master'), oppure tutte le sessioni insieme ('all',
+        chiave '*'). Per ogni gruppo: sessioni, esiti, tasso di fix sulle
+        sessioni concluse dal manager (fix, timeout, error) e riepilogo di
+        ogni tempo.
+        """
+        if by not in ('serial', 'master', 'all'):
+            raise ValueError(f"Raggruppamento non valido: {by}")
+        column = {'serial': 'serial', 'master': 'master_serial', 'all': "'*'"}[by]
+        where, params = self._filters(serial, since, until, None, source, master)
+        rows = self._reader().execute(
+            f"SELECT {column} AS key, status, {', '.join(TTF_METRICS)} FROM sessions {where}", params).fetchall()
+        groups = {}
+        for row in rows:
+            groups.setdefault(row['key'], []).append(row)
+        stats = {}
+        for key, rows in groups.items():
+            outcomes = _outcomes(rows)
+            stats[key] = {
+                'sessions': len(rows),
+                'fixed': outcomes.get('fix', 0),
+                'outcomes': outcomes,
+                'fix_rate': _fix_rate(outcomes),
+                **{metric: _summary([row[metric] for row in rows]) for metric in TTF_METRICS},
+            }
+        return stats
+
+    def ttf_distribution(self, metric='time_to_fix', serial=None, master=None, since=None, until=None, source=None,
+                         buckets=TTF_BUCKETS):
+        """Distribuzione di un tempo al fix: riepilogo, istogramma per classi e curva cumulativa.
+
+        La curva 'cumulative' riporta, per ogni estremo di classe, la quota
+        delle sessioni concluse (anche senza fix) che aveva raggiunto lo
+        stato entro quel tempo: a differenza dell'istogramma, tiene conto
+        delle sessioni andate in timeout.
+        """
+        if metric not in TTF_METRICS:
+            raise ValueError(f"Tempo non valido: {metric} (ammessi: {', '.join(TTF_METRICS)})")
+        buckets = sorted(float(bound) for bound in buckets)
+        where, params = self._filters(serial, since, until, None, source, master)
+        rows = self._reader().execute(f"SELECT status, {metric} AS value FROM sessions {where}", params).fetchall()
+        outcomes = _outcomes(rows)
+        values = sorted(row['value'] for row in rows if row['value'] is not None)
+        finished = sum(1 for row in rows if row['status'] in _FINISHED or row['value'] is not None)
+        counts, cumulative, index = [], [], 0
+        for bound in buckets:
+            start = index
+            while index < len(values) and values[index] <= bound:
+                index += 1
+            counts.append({'le': bound, 'count': index - start})
+            cumulative.append({'le': bound, 'ratio': round(index / finished, 3) if finished else None})
+        counts.append({'le': None, 'count': len(values) - index})  # Oltre l'ultima classe
+        return {
+            'metric': metric,
+            'sessions': len(rows),
+            'outcomes': outcomes,
+            'fix_rate': _fix_rate(outcomes),
+            'summary': _summary(values),
+            'histogram': counts,
+            'cumulative': cumulative,
+        }
+
+    @staticmethod
+    def _filters(serial, since, until, status, source=None, master=None):
+        clauses, params = [], []
+        if serial is not None:
+            clauses.append("serial = ?")
+            params.append(serial)
+        if master is not None:
+            clauses.append("master_serial = ?")
+            params.append(master)
+        if since is not None:
+            clauses.append("start_time >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("start_time < ?")
+            params.append(until)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _session_row(row):
+    session = dict(row)
+    session['timeline'] = StateTimeline.decode(session['timeline'])
+    return session
+
+
+def _outcomes(rows):
+    outcomes = {}
+    for row in rows:
+        status = row['status'] or 'unknown'
+        outcomes[status] = outcomes.get(status, 0) + 1
+    return outcomes
+
+
+def _fix_rate(outcomes):
+    finished = sum(outcomes.get(status, 0) for status in _FINISHED)
+    return round(outcomes.get('fix', 0) / finished, 3) if finished else None
+
+
+def _summary(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'min': round(values[0], 1),
+        'median': round(statistics.median(values), 1),
+        'p90': round(values[min(len(values) - 1, int(0.9 * (len(values) - 1) + 0.5))], 1),
+        'max': round(values[-1], 1),
+        'mean': round(statistics.fmean(values), 1),
+    }
@@ -0,0 +1,297 @@
+"""Stato condiviso del manager: costruzione dei servizi e accesso tramite socket Unix.
+
+Tutto lo stato (sessioni e processi rtkrcv, registro dei dispositivi,
+storico, coordinatore degli agenti) deve esistere in un solo processo.
+In sviluppo `python app.py` lo costruisce al proprio interno; in
+produzione lo possiede un processo dedicato:
+
+    python manager_server.py --socket /run/rtkrcv/manager.sock
+
+e i worker dell'API (gunicorn, vedi wsgi.py) vi accedono tramite proxy
+(multiprocessing.managers) con RTKRCV_MANAGER_SOCKET impostata. Il socket
+e la chiave di autenticazione (<socket>.key) sono leggibili solo
+dall'utente che avvia il server.
+"""
+import argparse
+import os
+import queue
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import BaseManager, IteratorProxy
+
+from archiver import SessionArchiver
+from coordinator import SessionCoordinator
+from health import IN_USE, HealthProber, make_result
+from history import HistoryStore
+from metrics import REGISTRY
+from registry import DeviceRegistry
+from replay import ReplayRunner
+from scheduler import SessionScheduler
+from sessions import SessionManager
+from supervisor import ProcessLimits, RestartPolicy
+
+# File di configurazione del pool dispositivi
+POOL_CONFIG_FILE = 'pool_list.json'
+
+# Servizi esposti ai worker e metodi invocabili da remoto
+EXPOSED = {
+    'sessions': ('start_session', 'stop_session', 'start_sessions', 'stop_sessions', 'get_snapshots',
+                 'get_active_serials', 'is_session_running', 'get_session_status', 'get_rover_coordinates',
+                 'get_process_info', 'get_session_output', 'get_session_output_version', 'get_session_timeline'),
+    'config_engine': ('set_campaign', 'get_campaign', 'profile_names', 'validate_device'),
+    'events': ('publish', 'stream'),
+    'registry': ('list_devices', 'get', 'get_rover', 'get_master', 'get_masters_for', 'get_rovers', 'get_setting',
+                 'set_setting', 'set_position', 'add', 'update', 'remove'),
+    'history': ('query_sessions', 'get_session', 'session_epochs', 'ttf_stats', 'ttf_distribution'),
+    'relay': ('stats',),
+    'health': ('probe_devices', 'last_results'),
+    'metrics': ('render',),
+    'archive': ('entries', 'stats', 'archive_path'),
+    'replay': ('submit', 'batches', 'get_batch', 'cancel'),
+    'scheduler': ('submit', 'status', 'cancel', 'configure'),
+    'coordinator': ('has_session', 'start_session', 'stop_session', 'start_sessions', 'stop_sessions',
+                    'get_snapshots', 'get_active_serials', 'is_session_running', 'get_session_status',
+                    'get_process_info', 'get_session_output', 'get_session_output_version',
+                    'get_session_timeline', 'agents_status'),
+}
+
+
+class Services:
+    """Oggetti con lo stato del manager (locali oppure proxy verso il processo proprietario).
+
+    history, relay, health, archive, replay, scheduler e coordinator sono None se disattivati.
+    """
+
+    def __init__(self, sessions, registry, history=None, coordinator=None, config_engine=None, events=None,
+                 relay=None, stop_criteria=None, metrics=None, health=None, archive=None,
+                 replay=None, scheduler=None):
+        self.sessions = sessions
+        self.registry = registry
+        self.history = history
+        self.coordinator = coordinator
+        self.config_engine = config_engine
+        self.events = events
+        self.relay = relay
+        self.stop_criteria = stop_criteria
+        self.metrics = metrics
+        self.health = health
+        self.archive = archive
+        self.replay = replay
+        self.scheduler = scheduler
+
+
+def build_services():
+    """Costruisce manager, registro, storico e coordinatore dalle variabili d'ambiente."""
+    # Modalità di ricezione delle soluzioni: 'file' (default) o 'stream'
+    solution_mode = os.environ.get('RTKRCV_SOLUTION_MODE', 'file')
+
+    # Relay locale delle correzioni RTCM (RTKRCV_CORRECTION_RELAY=0 per disattivarlo)
+    correction_relay = os.environ.get('RTKRCV_CORRECTION_RELAY', '1') != '0'
+
+    # Limiti di risorse e politica di riavvio dei processi rtkrcv
+    # RTKRCV_CPU_AFFINITY: 'spread' (una CPU a rotazione) oppure elenco di CPU, es. '2,3'
+    cpu_affinity = os.environ.get('RTKRCV_CPU_AFFINITY') or None
+    if cpu_affinity and cpu_affinity != 'spread':
+        cpu_affinity = [int(cpu) for cpu in cpu_affinity.split(',')]
+    max_memory_mb = os.environ.get('RTKRCV_MAX_MEMORY_MB')
+    process_limits = ProcessLimits(
+        nice=int(os.environ.get('RTKRCV_NICE', '0')) or None,
+        cpu_affinity=cpu_affinity,
+        rlimits={'RLIMIT_AS': int(max_memory_mb) * 2**20} if max_memory_mb else None,
+    )
+    restart_policy = RestartPolicy(mode=os.environ.get('RTKRCV_RESTART', 'on-failure'))
+
+    # Storico delle sessioni (SQLite); RTKRCV_HISTORY_DB vuoto per disattivarlo
+    history_db = os.environ.get('RTKRCV_HISTORY_DB', 'history.db')
+    history = HistoryStore(history_db) if history_db else None
+
+    # Verifica di rover e master prima dell'avvio (RTKRCV_HEALTH_CHECK=0 per disattivarla)
+    health = None
+    if os.environ.get('RTKRCV_HEALTH_CHECK', '1') != '0':
+        health = HealthProber(timeout=float(os.environ.get('RTKRCV_HEALTH_TIMEOUT', '3')))
+
+    # Archiviazione compressa delle sessioni chiuse (RTKRCV_ARCHIVE=0 per disattivarla)
+    archive = None
+    if os.environ.get('RTKRCV_ARCHIVE', '1') != '0':
+        retention_days = float(os.environ.get('RTKRCV_ARCHIVE_RETENTION_DAYS', '90'))
+        max_mb = os.environ.get('RTKRCV_ARCHIVE_MAX_MB')
+        min_free_mb = os.environ.get('RTKRCV_ARCHIVE_MIN_FREE_MB', '1024')
+        archive = SessionArchiver(os.environ.get('RTKRCV_ARCHIVE_DIR', 'archive'),
+                                  compression=os.environ.get('RTKRCV_ARCHIVE_COMPRESSION', 'zstd'),
+                                  retention_days=retention_days or None,
+                                  max_bytes=int(max_mb) * 2**20 if max_mb else None,
+                                  min_free_bytes=int(min_free_mb) * 2**20 if min_free_mb else None)
+
+    rtkrcv_path = os.environ.get('RTKRCV_PATH', 'rtkrcv')
+    session_manager = SessionManager(rtkrcv_path=rtkrcv_path, solution_mode=solution_mode,
+                                     correction_relay=correction_relay, process_limits=process_limits,
+                                     restart_policy=restart_policy, history=history, health=health,
+                                     archiver=archive)
+
+    # Agenti remoti (agent.py) su cui distribuire le sessioni, es.
+    # RTKRCV_AGENTS=http://host1:5101,http://host2:5101; senza agenti le sessioni sono locali
+    agents = [url.strip() for url in os.environ.get('RTKRCV_AGENTS', '').split(',') if url.strip()]
+    coordinator = (SessionCoordinator(agents, events=session_manager.events, token=os.environ.get('RTKRCV_AGENT_TOKEN'))
+                   if agents else None)
+
+    # Registro dei dispositivi: caricato una sola volta, salvato in background
+    registry = DeviceRegistry(POOL_CONFIG_FILE)
+    threading.Thread(target=track_positions, args=(session_manager, registry), name='positions', daemon=True).start()
+
+    if health is not None:
+        if coordinator is not None:
+            # I rover delle sessioni remote sono collegati ai rtkrcv degli agenti
+            def device_in_use(device):
+                if device.get('role') == 'Rover' and coordinator.is_session_running(device['serial']):
+                    return make_result(device, IN_USE, source='agent')
+                return session_manager.device_in_use(device)
+            health.busy = device_in_use
+        health.watch(registry.list_devices, interval=float(os.environ.get('RTKRCV_HEALTH_INTERVAL', '60')))
+
+    # Rielaborazione offline di file registrati (RTKRCV_REPLAY=0 per disattivarla).
+    # RTKRCV_REPLAY_CPUS: numero di processi (default metà delle CPU) oppure elenco di CPU, es. '2,3'
+    replay = None
+    if os.environ.get('RTKRCV_REPLAY', '1') != '0':
+        replay_cpus = os.environ.get('RTKRCV_REPLAY_CPUS') or str(max(1, (os.cpu_count() or 2) // 2))
+        replay_cpus = [int(cpu) for cpu in replay_cpus.split(',')] if ',' in replay_cpus else int(replay_cpus)
+        replay = ReplayRunner(session_manager.config_engine, registry=registry, history=history,
+                              events=session_manager.events, stop_criteria=session_manager.stop_criteria,
+                              cpus=replay_cpus,
+                              data_dir=os.environ.get('RTKRCV_REPLAY_DATA', 'recordings'),
+                              work_dir=os.environ.get('RTKRCV_REPLAY_DIR', 'replay'),
+                              rnx2rtkp_path=os.environ.get('RTKRCV_RNX2RTKP_PATH', 'rnx2rtkp'),
+                              convbin_path=os.environ.get('RTKRCV_CONVBIN_PATH', 'convbin'),
+                              job_timeout=float(os.environ.get('RTKRCV_REPLAY_TIMEOUT', '3600')))
+
+    # Pianificazione degli avvii in base ai tempi al fix storici (RTKRCV_SCHEDULER=0 per disattivarla);
+    # con gli agenti remoti i posti sono gestiti dal coordinatore
+    scheduler = None
+    if os.environ.get('RTKRCV_SCHEDULER', '1') != '0' and coordinator is None:
+        scheduler = SessionScheduler(session_manager, history,
+                                     max_sessions=int(os.environ.get('RTKRCV_SCHEDULER_MAX_SESSIONS') or
+                                                      os.cpu_count() or 4),
+                                     timeout_factor=float(os.environ.get('RTKRCV_SCHEDULER_TIMEOUT_FACTOR', '3')),
+                                     max_retries=int(os.environ.get('RTKRCV_SCHEDULER_RETRIES', '1')))
+
+    # Profilo e opzioni rtkrcv della campagna, salvati in pool_list.json
+    try:
+        session_manager.config_engine.set_campaign(registry.get_setting('rtkrcv'))
+    except ValueError as e:
+        print(f"Impostazioni rtkrcv non valide in {POOL_CONFIG_FILE}: {e}")
+
+    return Services(session_manager, registry, history, coordinator, session_manager.config_engine,
+                    session_manager.events, session_manager.relay, session_manager.stop_criteria, REGISTRY, health,
+                    archive, replay, scheduler)
+
+
+def track_positions(session_manager, registry, interval=300.0):
+    """Registra le posizioni apprese per la scelta del master più vicino.
+
+    Le coordinate dei rover arrivano dagli eventi 'coordinates', quelle dei
+    master dagli eventi 'master_position'. I master senza posizione vengono
+    letti dal loro stream RTCM all'avvio, quando cambiano i dispositivi e
+    comunque ogni interval secondi.
+    """
+    q = session_manager.events.subscribe()
+    pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='locate-masters')
+    locating = set()
+
+    def locate_masters():
+        for master in registry.list_devices():
+            if master['role'] != 'Master' or master['serial'] in locating or DeviceRegistry.position(master):
+                continue
+            locating.add(master['serial'])
+            # extract_master_coordinates pubblica 'master_position' se lo stream trasmette 1005/1006
+            future = pool.submit(session_manager.extract_master_coordinates, master)
+            future.add_done_callback(lambda _future, serial=master['serial']: locating.discard(serial))
+
+    locate_masters()
+    located_at = time.monotonic()
+    while True:
+        try:
+            event = q.get(timeout=interval)
+        except queue.Empty:
+            event = {'type': None, 'data': {}}
+        data = event['data']
+        try:
+            if event['type'] == 'coordinates' and 'lat' in (data['coordinates'] or {}):
+                coords = data['coordinates']
+                registry.set_position(data['serial'], coords['lat'], coords['lon'], coords['alt'], 'fix')
+            elif event['type'] == 'master_position':
+                registry.set_position(data['serial'], data['lat'], data['lon'], data['alt'], 'rtcm')
+            if event['type'] == 'devices' or time.monotonic() - located_at >= interval:
+                locate_masters()
+                located_at = time.monotonic()
+        except Exception as e:
+            print(f"Errore nella registrazione delle posizioni: {e}")
+
+
+class ManagerServer(BaseManager):
+    pass
+
+
+def _register(services=None):
+    """Registra i servizi: con services (lato server) ne fornisce le istanze."""
+    for name, exposed in EXPOSED.items():
+        ManagerServer.register(name, callable=(lambda name=name: getattr(services, name)) if services else None,
+                               exposed=exposed, method_to_typeid={'stream': 'Iterator'} if name == 'events' else None)
+    # Lo stream SSE resta un generatore nel server: il worker lo consuma evento per evento
+    ManagerServer.register('Iterator', proxytype=IteratorProxy, create_method=False)
+    ManagerServer.register('info', callable=(lambda: {
+        'available': [name for name in EXPOSED if getattr(services, name) is not None],
+        'stop_criteria': services.stop_criteria,
+    }) if services else None)
+
+
+def _authkey(socket_path, create=False):
+    key = os.environ.get('RTKRCV_MANAGER_AUTHKEY')
+    if key:
+        return key.encode()
+    key_path = socket_path + '.key'
+    if create:
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    with open(key_path) as f:
+        return f.read().strip().encode()
+
+
+def serve(services, socket_path):
+    """Espone i servizi sul socket Unix indicato (bloccante)."""
+    _register(services)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # Socket rimasto da un'esecuzione precedente
+    old_umask = os.umask(0o077)
+    try:
+        server = ManagerServer(address=socket_path, authkey=_authkey(socket_path, create=True)).get_server()
+    finally:
+        os.umask(old_umask)
+    print(f"Manager in ascolto su {socket_path}")
+    server.serve_forever()
+
+
+def connect_services(socket_path):
+    """Proxy verso i servizi del processo proprietario."""
+    _register()
+    manager = ManagerServer(address=socket_path, authkey=_authkey(socket_path))
+    manager.connect()
+    info = manager.info()._getvalue()
+    proxies = {name: getattr(manager, name)() if name in info['available'] else None for name in EXPOSED}
+    return Services(stop_criteria=info['stop_criteria'], **proxies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=os.environ.get('RTKRCV_MANAGER_SOCKET', 'manager.sock'),
+                        help="percorso del socket Unix")
+    args = parser.parse_args()
+
+    os.makedirs('output', exist_ok=True)
+    os.makedirs('config', exist_ok=True)
+    serve(build_services(), args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+import io
+import os
+
+import numpy as np
+
+
+# Codici di qualità della soluzione RTKLIB (campo Q del file .pos)
+Q_FIX = 1
+Q_FLOAT = 2
+Q_SBAS = 3
+Q_DGPS = 4
+Q_SINGLE = 5
+Q_PPP = 6
+
+
+def parse_pos_line(line):
+    """Converte una riga del file .pos (formato llh) in un dizionario.
+
+    Formato atteso:
+    YYYY/MM/DD HH:MM:SS.sss  lat(deg)  lon(deg)  height(m)  Q  ns  sdn  sde  sdu ...
+    Restituisce None per commenti, righe vuote o righe malformate.
+    """
+    if not line or line.startswith('%') or line.startswith('#'):
+        return None
+    parts = line.split()
+    if len(parts) < 6:
+        return None
+    try:
+        epoch = {
+            'time': f"{parts[0]} {parts[1]}",
+            'lat': float(parts[2]),
+            'lon': float(parts[3]),
+            'alt': float(parts[4]),
+            'q': int(parts[5]),
+            'ns': int(parts[6]) if len(parts) > 6 else 0,
+        }
+        # Deviazioni standard e ratio sono opzionali
+        if len(parts) > 9:
+            epoch['sdn'] = float(parts[7])
+            epoch['sde'] = float(parts[8])
+            epoch['sdu'] = float(parts[9])
+        if len(parts) > 14:
+            epoch['age'] = float(parts[13])
+            epoch['ratio'] = float(parts[14])
+    except ValueError:
+        return None
+    return epoch
+
+
+def _split_lines(partial, data):
+    """Unisce i nuovi byte alla riga incompleta precedente.
+
+    Restituisce (righe complete, nuova riga incompleta).
+    """
+    data = partial + data
+    last_newline = data.rfind(b'\n')
+    if last_newline < 0:
+        return [], data
+    return data[:last_newline].decode('utf-8', errors='replace').splitlines(), data[last_newline + 1:]
+
+
+def _parse_epochs(lines):
+    epochs = []
+    for line in lines:
+        epoch = parse_pos_line(line)
+        if epoch is not None:
+            epochs.append(epoch)
+    return epochs
+
+
+class PosTailReader:
+    """Lettore incrementale (tail -f) di un file .pos.
+
+    Mantiene l'offset in byte dell'ultima lettura e legge solo i byte
+    aggiunti da allora. Le righe incomplete in coda vengono trattenute
+    fino alla lettura successiva. Se il file viene troncato o sostituito
+    (inode diverso) la lettura riparte dall'inizio.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._file = None
+        self._inode = None
+        self._partial = b''
+
+    def _open(self):
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self._file = None
+            return False
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self.offset = 0
+        self._partial = b''
+        return True
+
+    def _reset(self):
+        self.close()
+        return self._open()
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self._inode = None
+
+    def read_lines(self):
+        """Restituisce le righe complete aggiunte dall'ultima chiamata."""
+        if self._file is None and not self._open():
+            return []
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # File rimosso: ripartiamo quando verrà ricreato
+            self.close()
+            return []
+
+        if st.st_ino != self._inode or st.st_size < self.offset:
+            # Rotazione o troncamento del file
+            if not self._reset():
+                return []
+            st = os.fstat(self._file.fileno())
+
+        if st.st_size == self.offset:
+            return []
+
+        self._file.seek(self.offset)
+        data = self._file.read(st.st_size - self.offset)
+        self.offset += len(data)
+
+        lines, self._partial = _split_lines(self._partial, data)
+        return lines
+
+    def read_epochs(self):
+        """Restituisce le epoche valide aggiunte dall'ultima chiamata."""
+        return _parse_epochs(self.read_lines())
+
+    def read_columns(self):
+        """Come read_epochs, ma restituisce le nuove epoche in colonne NumPy."""
+        return parse_pos_lines(self.read_lines())
+
+
+def tail_file(path, lines=20, max_bytes=64 * 1024, block_size=4096):
+    """Ultime `lines` righe complete di un file, leggendo a ritroso.
+
+    Vengono letti al più max_bytes dalla fine del file, indipendentemente
+    dalla sua dimensione. Restituisce (righe, offset): offset è la
+    posizione subito dopo l'ultima riga completa, da usare come cursore
+    per read_file_from. Una riga incompleta in coda viene ignorata.
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        data = b''
+        pos = end
+        # lines + 1 separatori: l'ultimo può chiudere la riga incompleta
+        while pos > 0 and end - pos < max_bytes and data.count(b'\n') <= lines:
+            size = min(block_size, pos, max_bytes - (end - pos))
+            pos -= size
+            f.seek(pos)
+            data = f.read(size) + data
+    last_newline = data.rfind(b'\n')
+    if last_newline < 0:
+        return [], pos
+    complete = data[:last_newline]
+    result = complete.decode('utf-8', errors='replace').splitlines()
+    if pos > 0:
+        result = result[1:]  # La prima riga del blocco può essere tagliata
+    return result[-lines:] if lines else [], pos + last_newline + 1
+
+
+def read_file_from(path, offset, max_bytes=64 * 1024):
+    """Righe complete scritte dopo offset (al più max_bytes).
+
+    Restituisce (righe, nuovo offset, reset): se il file è più corto di
+    offset (troncato o sostituito) reset è True e la lettura riparte
+    dalla coda del file come in tail_file.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset > size:
+            return (*tail_file(path), True)
+        f.seek(offset)
+        data = f.read(min(max_bytes, size - offset))
+    last_newline = data.rfind(b'\n')
+    if last_newline < 0:
+        if len(data) < max_bytes:
+            return [], offset, False
+        last_newline = len(data) - 1  # Riga più lunga di max_bytes: restituita spezzata
+    lines = data[:last_newline + 1].decode('utf-8', errors='replace').splitlines()
+    return lines, offset + last_newline + 1, False
+
+
+class PosStreamReader:
+    """Divide in righe le soluzioni ricevute da un flusso (socket o pipe).
+
+    Come PosTailReader, trattiene la riga incompleta fino al pacchetto
+    successivo.
+    """
+
+    def __init__(self):
+        self._partial = b''
+
+    def feed(self, data):
+        """Restituisce le righe complete contenute nei nuovi byte."""
+        lines, self._partial = _split_lines(self._partial, data)
+        return lines
+
+    def reset(self):
+        """Scarta la riga incompleta (es. dopo una disconnessione)."""
+        self._partial = b''
+
+    @staticmethod
+    def parse(lines):
+        """Converte le righe in epoche, scartando commenti e righe malformate."""
+        return _parse_epochs(lines)
+
+
+# --- Parser colonnare per analisi offline -------------------------------
+
+# Secondi tra l'epoca Unix e l'epoca GPS (1980-01-06)
+GPS_EPOCH_OFFSET = 315964800
+
+_TIME_SEPARATORS = bytes.maketrans(b'/:', b'  ')
+
+
+
+def detect_pos_format(header_lines):
+    """Riconosce il formato (llh/xyz/enu) dalle righe di intestazione '%'."""
+    for line in header_lines:
+        lower = line.lower()
+        if 'latitude' in lower:
+            return 'llh'
+        if 'x-ecef' in lower:
+            return 'xyz'
+        if 'e-baseline' in lower:
+            return 'enu'
+    return None
+
+
+def _days_from_civil(y, m, d):
+    """Giorni dal 1970-01-01 (algoritmo di H. Hinnant), vettoriale."""
+    y = y - (m <= 2)
+    era = np.floor_divide(y, 400)
+    yoe = y - era * 400
+    mp = (m + 9) % 12
+    doy = (153 * mp + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _empty_columns():
+    return {
+        'time': np.empty(0), 'pos': np.empty((0, 3)), 'q': np.empty(0, dtype=np.int8),
+        'ns': np.empty(0, dtype=np.int16), 'sd': np.empty((0, 3)), 'sd_cross': np.empty((0, 3)),
+        'age': np.empty(0), 'ratio': np.empty(0),
+    }
+
+
+def _columns_from_matrix(values, time_cols):
+    """Divide la matrice numerica (N, colonne) nelle colonne del file .pos."""
+    n, ncols = values.shape
+    if time_cols == 6:
+        ymd = values[:, 0:3].astype(np.int64)
+        days = _days_from_civil(ymd[:, 0], ymd[:, 1], ymd[:, 2])
+        time = days * 86400.0 + values[:, 3] * 3600 + values[:, 4] * 60 + values[:, 5]
+    else:
+        # Settimana GPS e secondi della settimana
+        time = GPS_EPOCH_OFFSET + values[:, 0] * 604800 + values[:, 1]
+
+    c = time_cols
+    columns = {
+        'time': time,
+        'pos': values[:, c:c + 3],
+        'q': values[:, c + 3].astype(np.int8),
+        'ns': values[:, c + 4].astype(np.int16),
+    }
+    nan3 = np.full((n, 3), np.nan)
+    nan1 = np.full(n, np.nan)
+    c += 5
+    columns['sd'] = values[:, c:c + 3] if ncols >= c + 3 else nan3
+    columns['sd_cross'] = values[:, c + 3:c + 6] if ncols >= c + 6 else nan3
+    columns['age'] = values[:, c + 6] if ncols >= c + 7 else nan1
+    columns['ratio'] = values[:, c + 7] if ncols >= c + 8 else nan1
+    return columns
+
+
+def _parse_block_slow(lines, ncols):
+    """Percorso lento per blocchi con righe irregolari: scarta le righe malformate."""
+    rows = []
+    for line in lines:
+        parts = line.translate(_TIME_SEPARATORS).split()
+        if len(parts) != ncols:
+            continue
+        try:
+            rows.append([float(p) for p in parts])
+        except ValueError:
+            continue
+    return np.array(rows, dtype=np.float64).reshape(-1, ncols)
+
+
+def _field_layout(first_line):
+    """Colonne (inizio, fine, posizione del punto decimale) di ogni campo della riga.
+
+    RTKLIB scrive i campi allineati a destra con un numero fisso di
+    decimali: la fine di ogni campo e la posizione del punto decimale sono
+    le stesse su tutte le righe. Ogni campo va dalla fine del precedente
+    alla propria fine.
+    """
+    translated = first_line.translate(_TIME_SEPARATORS)
+    layout = []
+    start = 0
+    pos = 0
+    for token in translated.split():
+        begin = translated.index(token, pos)
+        end = begin + len(token)
+        dot = token.find(b'.')
+        layout.append((start, end, begin + dot if dot >= 0 else None))
+        start = pos = end
+    return layout
+
+
+# Cifre per gruppo nel prodotto matriciale: 10^7 - 1 < 2^24, quindi le
+# somme parziali restano esatte anche in float32
+_GROUP_DIGITS = 7
+
+
+def _fixed_width_weights(first_line, layout):
+    """Prepara i pesi per il parsing a larghezza fissa.
+
+    Restituisce:
+    - group_weights (lunghezza riga, gruppi) float32: peso di ogni colonna
+      nel gruppo di al più 7 cifre a cui appartiene;
+    - group_field, group_scale: campo di ogni gruppo e suo moltiplicatore;
+    - col_field, col_weight: campo e peso intero di ogni colonna;
+    - divisor: 10^decimali di ogni campo.
+    """
+    line_len = len(first_line) + 1
+    col_field = np.full(line_len, -1)
+    col_weight = np.zeros(line_len)
+    columns = []  # (colonna, campo, esponente)
+    divisor = np.ones(len(layout))
+    for i, (start, end, dot) in enumerate(layout):
+        col_field[start:end] = i
+        exponent = 0
+        for col in range(end - 1, start - 1, -1):
+            # Punto decimale e separatori della data non sono cifre
+            if col == dot or first_line[col:col + 1] in (b'/', b':'):
+                continue
+            col_weight[col] = 10.0 ** exponent
+            columns.append((col, i, exponent))
+            exponent += 1
+        if dot is not None:
+            divisor[i] = 10.0 ** (end - 1 - dot)
+
+    groups = sorted({(i, exponent // _GROUP_DIGITS) for _col, i, exponent in columns})
+    group_index = {g: k for k, g in enumerate(groups)}
+    group_weights = np.zeros((line_len, len(groups)), dtype=np.float32)
+    for col, i, exponent in columns:
+        group_weights[col, group_index[(i, exponent // _GROUP_DIGITS)]] = 10.0 ** (exponent % _GROUP_DIGITS)
+    group_field = np.array([i for i, _k in groups])
+    group_scale = np.array([10.0 ** (k * _GROUP_DIGITS) for _i, k in groups])
+    return group_weights, group_field, group_scale, col_field, col_weight, divisor
+
+
+def _parse_fixed_width(data, layout):
+    """Parsing vettoriale di righe a larghezza fissa, senza tokenizzazione.
+
+    data deve terminare con '\n'. Le righe vengono viste come una matrice
+    di byte (N, lunghezza riga):
+    le mantisse intere di tutti i campi si ottengono con un unico prodotto
+    matriciale tra le cifre e una matrice di pesi. Restituisce None se le
+    righe non hanno tutte la stessa lunghezza o i punti decimali non sono
+    allineati.
+    """
+    line_len = data.find(b'\n') + 1
+    if line_len <= 0 or len(data) % line_len != 0:
+        return None
+    raw = np.frombuffer(data, dtype=np.uint8)
+    rows = raw.reshape(-1, line_len)
+    if not (rows[:, -1] == 10).all():
+        return None
+    dots = [dot for _start, _end, dot in layout if dot is not None]
+    if dots and not (rows[:, dots] == 46).all():
+        return None
+
+    group_weights, group_field, group_scale, col_field, col_weight, divisor = \
+        _fixed_width_weights(data[:line_len - 1], layout)
+    # '0'..'9' & 15 -> 0..9, spazio -> 0; gli altri simboli hanno peso nullo
+    groups = (rows & np.uint8(15)).astype(np.float32) @ group_weights
+    # Ricompone i gruppi di ogni campo (somme intere < 2^53, esatte in float64)
+    combine = np.zeros((len(group_field), len(layout)))
+    combine[np.arange(len(group_field)), group_field] = group_scale
+    mantissa = groups.astype(np.float64) @ combine
+
+    # I segni meno sono rari: si correggono solo le posizioni in cui compaiono
+    # ('-' & 15 = 13 è stato sommato come se fosse una cifra)
+    minus = np.flatnonzero(raw == 45)
+    if minus.size:
+        cols = minus % line_len
+        fields = col_field[cols]
+        valid = fields >= 0
+        r, c, f = minus[valid] // line_len, cols[valid], fields[valid]
+        mantissa[r, f] -= 13 * col_weight[c]
+        mantissa[r, f] *= -1
+    return mantissa / divisor
+
+
+def parse_pos_block(data, ncols=None):
+    """Converte un blocco di righe complete (bytes) in una matrice (N, colonne).
+
+    Restituisce (matrice, ncols, time_cols). Le date 'YYYY/MM/DD HH:MM:SS'
+    vengono spezzate in 6 colonne numeriche, il formato 'settimana tow' in 2.
+    Le righe a larghezza fissa (il caso normale) usano il percorso
+    vettoriale; altrimenti si usa np.loadtxt e, per righe irregolari, il
+    parsing riga per riga.
+    """
+    if b'%' in data or b'#' in data:
+        data = b''.join(l + b'\n' for l in data.split(b'\n') if l.strip() and l.lstrip()[:1] not in (b'%', b'#'))
+    if data[:1] == b'\n':
+        data = data.lstrip(b'\n')
+    if not data or data.isspace():
+        return np.empty((0, ncols or 0)), ncols, None
+    if not data.endswith(b'\n'):
+        data += b'\n'
+
+    first = data[:data.find(b'\n')] if b'\n' in data else data
+    time_cols = 6 if b'/' in first.split()[0] else 2
+    layout = _field_layout(first)
+    if ncols is None:
+        ncols = len(layout)
+
+    if len(layout) == ncols:
+        values = _parse_fixed_width(data, layout)
+        if values is not None:
+            return values, ncols, time_cols
+
+    translated = data.translate(_TIME_SEPARATORS)
+    try:
+        values = np.loadtxt(io.BytesIO(translated), ndmin=2, comments=None)
+        if values.shape[1] == ncols:
+            return values, ncols, time_cols
+    except ValueError:
+        pass
+    return _parse_block_slow(data.split(b'\n'), ncols), ncols, time_cols
+
+
+def parse_pos_lines(lines):
+    """Converte in colonne NumPy un elenco di righe (es. quelle lette dal tail)."""
+    values, _ncols, time_cols = parse_pos_block(''.join(line + '\n' for line in lines).encode('ascii', errors='replace'))
+    if not len(values):
+        return _empty_columns()
+    return _columns_from_matrix(values, time_cols)
+
+
+def iter_pos_columns(path, chunk_size=4 * 1024 * 1024):
+    """Legge un file .pos a blocchi, restituendo un dizionario di colonne per blocco.
+
+    Ogni dizionario contiene: time (secondi dal 1970 nella scala di tempo
+    del file), pos (N, 3: lat/lon/h, x/y/z o e/n/u), q, ns, sd (N, 3),
+    sd_cross (N, 3), age, ratio. Le colonne assenti nel file sono NaN.
+    """
+    ncols = None
+    remainder = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = remainder + chunk
+            cut = data.rfind(b'\n')
+            if cut < 0:
+                remainder = data
+                continue
+            remainder = data[cut + 1:]
+            values, ncols, time_cols = parse_pos_block(data[:cut + 1], ncols)
+            if len(values):
+                yield _columns_from_matrix(values, time_cols)
+    if remainder.strip():
+        values, ncols, time_cols = parse_pos_block(remainder, ncols)
+        if len(values):
+            yield _columns_from_matrix(values, time_cols)
+
+
+def read_pos_header(path, max_lines=100):
+    """Righe di intestazione ('%') all'inizio di un file .pos."""
+    header = []
+    with open(path, 'r', errors='replace') as f:
+        for _ in range(max_lines):
+            line = f.readline()
+            if not line.startswith('%'):
+                break
+            header.append(line.rstrip('\n'))
+    return header
+
+
+def read_pos_file(path, chunk_size=4 * 1024 * 1024):
+    """Legge un intero file .pos in colonne NumPy.
+
+    Restituisce il dizionario di iter_pos_columns con le colonne di tutti i
+    blocchi concatenate, più 'format' (llh/xyz/enu, None se il file non ha
+    intestazione).
+    """
+    chunks = list(iter_pos_columns(path, chunk_size))
+    if not chunks:
+        columns = _empty_columns()
+    elif len(chunks) == 1:
+        columns = chunks[0]
+    else:
+        columns = {key: np.concatenate([c[key] for c in chunks]) for key in chunks[0]}
+    columns['format'] = detect_pos_format(read_pos_header(path))
+    return columns
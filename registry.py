@@ -0,0 +1,249 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+from spatial import PointIndex
+
+
+class DeviceRegistry:
+    """Registro in memoria dei dispositivi del pool (pool_list.json).
+
+    Il file viene letto una sola volta; i dispositivi sono indicizzati per
+    seriale e per ruolo. Tutti gli accessi sono protetti da un lock. Le
+    modifiche vengono salvate in background (write-behind): più modifiche
+    ravvicinate producono una sola scrittura, eseguita in modo atomico
+    (file temporaneo + rename).
+
+    Con più master, ogni rover usa il più vicino (get_masters_for): le
+    posizioni dei master stanno in un indice spaziale, ricostruito solo
+    quando un master cambia.
+    """
+
+    ROLES = ('Master', 'Rover')
+
+    def __init__(self, path, save_delay=0.5):
+        self.path = path
+        self.save_delay = save_delay
+        self.lock = threading.RLock()
+        self._write_lock = threading.Lock()  # Serializza le scritture su disco
+        self._extra = {}  # Altre chiavi del file, preservate al salvataggio
+        self._by_serial = {}  # serial -> device (in ordine di inserimento)
+        self._by_role = {role: {} for role in self.ROLES}
+        self._save_timer = None
+        self._version = 0  # Incrementata ad ogni modifica
+        self._saved_version = 0
+        self._master_index = None  # PointIndex dei master con posizione nota, None = da ricostruire
+        self.load()
+        atexit.register(self.flush)
+
+    def load(self):
+        """(Ri)carica il registro dal file JSON."""
+        config = {"devices": []}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    config = json.load(f)
+            except json.JSONDecodeError:
+                config = {"devices": []}
+
+        with self.lock:
+            self._extra = {k: v for k, v in config.items() if k != 'devices'}
+            self._by_serial = {}
+            self._by_role = {role: {} for role in self.ROLES}
+            for device in config.get('devices', []):
+                self._index(dict(device))
+            self._master_index = None
+
+    def _index(self, device):
+        self._by_serial[device['serial']] = device
+        self._by_role.setdefault(device['role'], {})[device['serial']] = device
+        if device['role'] == 'Master':
+            self._master_index = None
+
+    def _unindex(self, device):
+        self._by_serial.pop(device['serial'], None)
+        self._by_role.get(device['role'], {}).pop(device['serial'], None)
+        if device['role'] == 'Master':
+            self._master_index = None
+
+    @staticmethod
+    def position(device):
+        """(lat, lon, alt) del dispositivo: ultima posizione nota, altrimenti quella configurata; o None."""
+        known = device.get('position')
+        if known:
+            return known['lat'], known['lon'], known['alt']
+        if all(device.get(key) is not None for key in ('lat', 'lon', 'alt')):
+            return float(device['lat']), float(device['lon']), float(device['alt'])
+        return None
+
+    def list_devices(self):
+        """Restituisce una copia di tutti i dispositivi, in ordine di inserimento."""
+        with self.lock:
+            return [dict(d) for d in self._by_serial.values()]
+
+    def get(self, serial):
+        """Restituisce una copia del dispositivo, o None se non esiste."""
+        with self.lock:
+            device = self._by_serial.get(serial)
+            return dict(device) if device else None
+
+    def get_rover(self, serial):
+        with self.lock:
+            device = self._by_role['Rover'].get(serial)
+            return dict(device) if device else None
+
+    def get_master(self):
+        """Restituisce il master predefinito (l'ultimo configurato, come in pool_list.json)."""
+        with self.lock:
+            masters = self._by_role['Master']
+            if not masters:
+                return None
+            return dict(masters[next(reversed(masters))])
+
+    def get_masters_for(self, serials):
+        """Master assegnato a ogni rover: serial -> {'rover', 'master': copie, 'distance': metri o None}.
+
+        Il master è il più vicino alla posizione del rover; senza posizione
+        del rover, o senza master con posizione nota, si usa il master
+        predefinito (distance None). Restituisce None per i rover
+        sconosciuti e {} se non ci sono master.
+        """
+        with self.lock:
+            default = self.get_master()
+            if default is None:
+                return {}
+            if self._master_index is None:
+                self._master_index = PointIndex(
+                    (position, serial) for serial, master in self._by_role['Master'].items()
+                    if (position := self.position(master)) is not None)
+            assignments = {}
+            for serial in serials:
+                rover = self._by_role['Rover'].get(serial)
+                if rover is None:
+                    assignments[serial] = None
+                    continue
+                position = self.position(rover)
+                nearest = self._master_index.nearest(*position) if position else None
+                if nearest is None:
+                    assignments[serial] = {'rover': dict(rover), 'master': default, 'distance': None}
+                else:
+                    master_serial, distance = nearest
+                    assignments[serial] = {'rover': dict(rover), 'master': dict(self._by_role['Master'][master_serial]),
+                                           'distance': round(distance, 1)}
+            return assignments
+
+    def set_position(self, serial, lat, lon, alt, source):
+        """Registra l'ultima posizione nota di un dispositivo (fix del rover, RTCM del master)."""
+        with self.lock:
+            device = self._by_serial.get(serial)
+            if device is None:
+                return False
+            known = device.get('position')
+            if known and (known['lat'], known['lon'], known['alt']) == (lat, lon, alt):
+                return True
+            device['position'] = {'lat': lat, 'lon': lon, 'alt': alt, 'source': source, 'time': time.time()}
+            if device['role'] == 'Master':
+                self._master_index = None
+            self._mark_dirty()
+            return True
+
+    def get_rovers(self):
+        with self.lock:
+            return [dict(d) for d in self._by_role['Rover'].values()]
+
+    def get_setting(self, key, default=None):
+        """Impostazione globale del pool (chiave di primo livello di pool_list.json)."""
+        with self.lock:
+            return self._extra.get(key, default)
+
+    def set_setting(self, key, value):
+        with self.lock:
+            self._extra[key] = value
+            self._mark_dirty()
+
+    def add(self, device):
+        """Aggiunge un dispositivo. Restituisce False se il seriale esiste già."""
+        with self.lock:
+            if device['serial'] in self._by_serial:
+                return False
+            self._index(dict(device))
+            self._mark_dirty()
+            return True
+
+    def update(self, serial, changes):
+        """Aggiorna i campi di un dispositivo. Restituisce la copia aggiornata o None."""
+        with self.lock:
+            device = self._by_serial.get(serial)
+            if device is None:
+                return None
+            old_role = device['role']
+            if any(key in changes and changes[key] != device.get(key) for key in ('ip', 'port', 'lat', 'lon', 'alt')):
+                # Altro ricevitore o altra posizione configurata: quella appresa non vale più
+                device.pop('position', None)
+            device.update(changes)
+            device['serial'] = serial
+            if device['role'] != old_role:
+                self._by_role.get(old_role, {}).pop(serial, None)
+                self._by_role.setdefault(device['role'], {})[serial] = device
+            if 'Master' in (old_role, device['role']):
+                self._master_index = None
+            self._mark_dirty()
+            return dict(device)
+
+    def remove(self, serial):
+        """Rimuove un dispositivo. Restituisce False se non esiste."""
+        with self.lock:
+            device = self._by_serial.get(serial)
+            if device is None:
+                return False
+            self._unindex(device)
+            self._mark_dirty()
+            return True
+
+    def _mark_dirty(self):
+        # Chiamata con il lock acquisito
+        self._version += 1
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self._save_in_background)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_in_background(self):
+        with self.lock:
+            self._save_timer = None
+        self.flush()
+
+    def flush(self):
+        """Scrive subito su disco le modifiche non ancora salvate."""
+        with self._write_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        with self.lock:
+            if self._saved_version == self._version:
+                return
+            version = self._version
+            config = dict(self._extra)
+            config['devices'] = [dict(d) for d in self._by_serial.values()]
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.pool_list.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(config, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            self._saved_version = max(self._saved_version, version)
@@ -0,0 +1,216 @@
+"""Relay locale delle correzioni RTCM: una connessione al master, N rover.
+
+Per ogni master il relay apre una porta locale (127.0.0.1) a cui si
+collegano i processi rtkrcv (inpstr2-path). Il relay mantiene una sola
+connessione verso il master e ne ridistribuisce i byte a tutti i client.
+
+Ogni client ha un buffer di scrittura limitato: un consumatore che non
+riesce a stare al passo viene disconnesso (rtkrcv si ricollega da solo)
+invece di far crescere la memoria o rallentare gli altri.
+"""
+import asyncio
+import threading
+import time
+
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.peer = writer.get_extra_info('peername')
+        self.bytes_out = 0
+        self.connected_at = time.time()
+
+
+class _Upstream:
+    """Stato del relay per un master."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.ready = None  # Avvio del server locale (asyncio.Future)
+        self.local_port = None
+        self.clients = set()
+        self.task = None  # Connessione verso il master
+        self.idle_handle = None
+        self.connected = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.reconnects = 0
+        self.dropped_clients = 0
+        self.last_data = None
+        self.rate_in = 0.0  # byte/s, sull'ultima finestra di un secondo
+        self._window_bytes = 0
+        self._window_start = time.monotonic()
+
+    def count_in(self, size):
+        now = time.monotonic()
+        self.bytes_in += size
+        self.last_data = now
+        self._window_bytes += size
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.rate_in = self._window_bytes / elapsed
+            self._window_bytes = 0
+            self._window_start = now
+
+
+class CorrectionRelay:
+    """Fan-out asyncio degli stream di correzione dei master.
+
+    Il loop asyncio gira in un thread dedicato, avviato al primo utilizzo.
+    I metodi pubblici sono thread-safe e possono essere chiamati dal
+    SessionManager e dalle richieste Flask.
+    """
+
+    def __init__(self, max_client_buffer=256 * 1024, idle_timeout=30.0, connect_timeout=10.0):
+        self.max_client_buffer = max_client_buffer
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._upstreams = {}  # (host, port) -> _Upstream, solo dal thread del loop
+
+    def endpoint(self, host, port):
+        """Indirizzo locale (host, porta) da usare al posto di host:port del master."""
+        future = asyncio.run_coroutine_threadsafe(self._endpoint(host, int(port)), self._ensure_loop())
+        return future.result(timeout=self.connect_timeout)
+
+    def stats(self):
+        """Contatori di traffico per master e per client."""
+        if self._loop is None:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self._stats(), self._loop)
+        return future.result(timeout=5)
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='rtcm-relay', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    # --- Dal thread del loop ----------------------------------------------
+
+    async def _endpoint(self, host, port):
+        key = (host, port)
+        upstream = self._upstreams.get(key)
+        if upstream is None:
+            # Registrato prima di attendere: le richieste concorrenti per lo stesso master lo condividono
+            upstream = self._upstreams[key] = _Upstream(host, port)
+            upstream.ready = asyncio.ensure_future(asyncio.start_server(
+                lambda r, w: self._handle_client(upstream, r, w), '127.0.0.1', 0))
+            try:
+                upstream.server = await upstream.ready
+            except OSError:
+                del self._upstreams[key]
+                raise
+            upstream.local_port = upstream.server.sockets[0].getsockname()[1]
+            print(f"Relay correzioni {host}:{port} -> 127.0.0.1:{upstream.local_port}")
+        elif upstream.local_port is None:
+            await asyncio.shield(upstream.ready)
+        return '127.0.0.1', upstream.local_port
+
+    async def _handle_client(self, upstream, reader, writer):
+        client = _Client(writer)
+        upstream.clients.add(client)
+        if upstream.idle_handle is not None:
+            upstream.idle_handle.cancel()
+            upstream.idle_handle = None
+        if upstream.task is None or upstream.task.done():
+            upstream.task = asyncio.ensure_future(self._run_upstream(upstream))
+        try:
+            # rtkrcv non invia dati sullo stream di correzione: si attende la chiusura
+            while await reader.read(4096):
+                pass
+        except OSError:
+            pass
+        finally:
+            self._drop_client(upstream, client)
+
+    def _drop_client(self, upstream, client):
+        if client not in upstream.clients:
+            return
+        upstream.clients.discard(client)
+        client.writer.close()
+        if not upstream.clients and upstream.idle_handle is None:
+            # Nessun rover collegato: libera la connessione al master dopo un po'
+            upstream.idle_handle = self._loop.call_later(self.idle_timeout, self._close_idle, upstream)
+
+    def _close_idle(self, upstream):
+        upstream.idle_handle = None
+        if not upstream.clients and upstream.task is not None:
+            upstream.task.cancel()
+            upstream.task = None
+
+    async def _run_upstream(self, upstream):
+        backoff = 1.0
+        while upstream.clients:
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(upstream.host, upstream.port), self.connect_timeout)
+                upstream.connected = True
+                backoff = 1.0
+                print(f"Relay: connesso al master {upstream.host}:{upstream.port}")
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    upstream.count_in(len(data))
+                    for client in list(upstream.clients):
+                        self._send(upstream, client, data)
+            except (OSError, asyncio.TimeoutError) as e:
+                print(f"Relay: errore sulla connessione al master {upstream.host}:{upstream.port}: {e}")
+            finally:
+                upstream.connected = False
+                if writer is not None:
+                    writer.close()
+            if not upstream.clients:
+                break
+            upstream.reconnects += 1
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    def _send(self, upstream, client, data):
+        transport = client.writer.transport
+        if transport.is_closing():
+            self._drop_client(upstream, client)
+            return
+        if transport.get_write_buffer_size() + len(data) > self.max_client_buffer:
+            # Consumatore lento: meglio disconnetterlo che accumulare ritardo
+            upstream.dropped_clients += 1
+            print(f"Relay: client {client.peer} troppo lento, disconnesso")
+            self._drop_client(upstream, client)
+            return
+        client.writer.write(data)
+        client.bytes_out += len(data)
+        upstream.bytes_out += len(data)
+
+    async def _stats(self):
+        now = time.monotonic()
+        result = []
+        for upstream in self._upstreams.values():
+            result.append({
+                'master': f"{upstream.host}:{upstream.port}",
+                'local_port': upstream.local_port,
+                'connected': upstream.connected,
+                'bytes_in': upstream.bytes_in,
+                'bytes_out': upstream.bytes_out,
+                'rate_in': round(upstream.rate_in, 1),
+                'last_data_age': round(now - upstream.last_data, 3) if upstream.last_data else None,
+                'reconnects': upstream.reconnects,
+                'dropped_clients': upstream.dropped_clients,
+                'clients': [{
+                    'peer': f"{client.peer[0]}:{client.peer[1]}" if client.peer else None,
+                    'bytes_out': client.bytes_out,
+                    # Byte in attesa nel buffer del client: il ritardo rispetto al master
+                    'lag_bytes': client.writer.transport.get_write_buffer_size(),
+                    'lag_seconds': (round(client.writer.transport.get_write_buffer_size() / upstream.rate_in, 3)
+                                    if upstream.rate_in else None),
+                    'connected_for': round(time.time() - client.connected_at, 1),
+                } for client in upstream.clients],
+            })
+        return result
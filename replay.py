@@ -0,0 +1,470 @@
+"""Rielaborazione offline di sessioni registrate (file RTCM3 o RINEX).
+
+Ogni lavoro elabora i file registrati di un rover e della sua base con
+rnx2rtkp, il post-processore di RTKLIB, usando la configurazione generata
+per rtkrcv (profili e override della campagna e del rover, più eventuali
+opzioni del lotto). I file RTCM3 vengono prima convertiti in RINEX con
+convbin. Il .pos risultante passa per il motore di convergenza delle
+sessioni dal vivo: i tempi al primo FLOAT, al primo FIX e alla
+convergenza sono misurati sul tempo dei dati, non su quello di calcolo.
+
+I lavori girano su un pool di processi dimensionato sul budget di CPU:
+ogni processo esegue un lavoro alla volta a niceness ridotta, così la
+rielaborazione non toglie CPU alle sessioni dal vivo. I risultati vanno
+nello storico (source 'replay') insieme alla velocità di elaborazione.
+"""
+import itertools
+import multiprocessing
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+import numpy as np
+
+from convergence import ConvergenceEngine, StateTimeline, StopCriteria, format_result
+from metrics import REGISTRY
+from pos_reader import Q_FIX, Q_FLOAT, read_pos_file
+from rtcm import RtcmFrameReader, decode_station
+from rtkrcv_config import DEFAULT_PROFILE
+
+RTCM_EXTENSIONS = ('.rtcm', '.rtcm3', '.rtc')
+
+REPLAY_JOBS = REGISTRY.counter('rtkrcv_replay_jobs_total', "Lavori di rielaborazione completati per esito", ['result'])
+REPLAY_DURATION = REGISTRY.histogram('rtkrcv_replay_job_seconds', "Durata di un lavoro di rielaborazione",
+                                     buckets=(1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+
+
+def read_file_station_position(path, max_bytes=1024 * 1024):
+    """Posizione della stazione dal primo messaggio 1005/1006 di un file RTCM3, o None."""
+    reader = RtcmFrameReader()
+    with open(path, 'rb') as f:
+        while f.tell() < max_bytes:
+            data = f.read(65536)
+            if not data:
+                break
+            for payload in reader.feed(data):
+                station = decode_station(payload)
+                if station is not None:
+                    return station
+    return None
+
+
+# --- Nei processi del pool ------------------------------------------------
+
+def _init_worker(nice, cpus):
+    """Priorità ridotta e CPU del budget, ereditate anche da convbin e rnx2rtkp."""
+    if nice:
+        os.nice(nice)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    # Ctrl+C arriva a tutto il gruppo: l'arresto lo gestisce il manager
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _run_tool(cmd, cwd, timeout):
+    try:
+        result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"{os.path.basename(cmd[0])} non terminato entro {timeout:.0f} s")
+    except OSError as e:
+        raise RuntimeError(f"Impossibile eseguire {cmd[0]}: {e.strerror or e}")
+    if result.returncode != 0:
+        lines = (result.stderr or result.stdout or '').strip().splitlines()
+        raise RuntimeError(f"{os.path.basename(cmd[0])} terminato con codice {result.returncode}"
+                           + (f": {lines[-1]}" if lines else ""))
+
+
+def convert_rtcm(convbin_path, path, prefix, approx_time, timeout):
+    """Converte un file RTCM3 in RINEX; restituisce (osservazioni, [navigazione])."""
+    obs, nav = prefix + '.obs', prefix + '.nav'
+    # I messaggi MSM contengono solo il tempo nella settimana: serve la data approssimativa
+    cmd = [convbin_path, '-r', 'rtcm3', '-tr', *approx_time.split(), '-o', obs, '-n', nav, path]
+    _run_tool(cmd, os.path.dirname(prefix), timeout)
+    if not os.path.exists(obs):
+        raise RuntimeError(f"convbin non ha prodotto osservazioni da {os.path.basename(path)}")
+    return obs, [nav] if os.path.exists(nav) and os.path.getsize(nav) else []
+
+
+def evaluate_solution(columns, criteria, epoch_interval=None):
+    """Applica il motore di convergenza alle epoche di un .pos (colonne di read_pos_file).
+
+    Le epoche sono valutate in ordine fino alla convergenza o a
+    criteria.max_duration secondi di dati. Restituisce un riepilogo con
+    esito, tempi (s dall'inizio dei dati), timeline degli stati (forma
+    compatta di StateTimeline), risultato del motore e le epoche campionate
+    ogni epoch_interval secondi di dati (per lo storico).
+    """
+    times, pos, q, ns, ratio = columns['time'], columns['pos'], columns['q'], columns['ns'], columns['ratio']
+    engine = ConvergenceEngine(criteria)
+    timeline = StateTimeline()
+    summary = {'status': 'timeout', 'first_float_at': None, 'first_fix_at': None, 'fix_at': None,
+               'epochs': 0, 'start_time': None, 'end_time': None, 'samples': [], 'timeline': ''}
+    if not len(times):
+        return summary
+    start = float(times[0])
+    next_sample = start
+    for i in range(len(times)):
+        elapsed = float(times[i]) - start
+        if criteria.max_duration is not None and elapsed >= criteria.max_duration:
+            break
+        epoch = {
+            'time': datetime.fromtimestamp(float(times[i]), timezone.utc).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3],
+            'lat': float(pos[i, 0]), 'lon': float(pos[i, 1]), 'alt': float(pos[i, 2]),
+            'q': int(q[i]), 'ns': int(ns[i]),
+            'ratio': None if np.isnan(ratio[i]) else float(ratio[i]),
+        }
+        summary['epochs'] += 1
+        summary['end_time'] = float(times[i])
+        timeline.add(elapsed, epoch['q'])
+        if epoch['q'] == Q_FLOAT and summary['first_float_at'] is None:
+            summary['first_float_at'] = round(elapsed, 1)
+        elif epoch['q'] == Q_FIX and summary['first_fix_at'] is None:
+            summary['first_fix_at'] = round(elapsed, 1)
+        if epoch_interval is not None and float(times[i]) >= next_sample:
+            summary['samples'].append((float(times[i]), epoch))
+            next_sample = float(times[i]) + epoch_interval
+        if engine.add_epoch(epoch):
+            summary['status'] = 'fix'
+            summary['fix_at'] = round(elapsed, 1)
+            break
+    summary['start_time'] = start
+    summary['timeline'] = timeline.encode()
+    summary['result'] = engine.result()
+    return summary
+
+
+def run_replay_job(job):
+    """Esegue un lavoro (nel processo del pool): conversione, rnx2rtkp e valutazione del .pos."""
+    started = time.monotonic()
+    cpu_start = _cpu_seconds()
+    deadline = started + job['timeout']
+    inputs, navs = [], list(job['nav_files'])
+    for name in ('rover', 'base'):
+        path = job[f'{name}_file']
+        if path.lower().endswith(RTCM_EXTENSIONS):
+            prefix = os.path.join(job['work_dir'], f"{job['serial']}-{name}")
+            obs, nav = convert_rtcm(job['convbin'], path, prefix, job['approx_time'], deadline - time.monotonic())
+            inputs.append(obs)
+            navs.extend(nav)
+        else:
+            inputs.append(path)
+    if not navs:
+        raise RuntimeError("Nessun file di navigazione: indicare nav_files")
+    _run_tool([job['rnx2rtkp'], '-k', job['config'], '-o', job['output'], *inputs, *navs],
+              job['work_dir'], max(1.0, deadline - time.monotonic()))
+    processed = time.monotonic()
+
+    columns = read_pos_file(job['output'])
+    summary = evaluate_solution(columns, StopCriteria.from_dict(job['criteria']), job['epoch_interval'])
+    if not summary['epochs']:
+        raise RuntimeError("rnx2rtkp non ha prodotto soluzioni")
+    elapsed = time.monotonic() - started
+    # Velocità riferita a tutto il file elaborato da rnx2rtkp, non solo alle epoche fino alla convergenza
+    total_epochs = len(columns['time'])
+    data_seconds = float(columns['time'][-1] - columns['time'][0])
+    input_bytes = sum(os.path.getsize(job[f'{name}_file']) for name in ('rover', 'base'))
+    summary['data_seconds'] = round(data_seconds, 1)
+    summary['throughput'] = {
+        'wall_seconds': round(elapsed, 3),
+        'processing_seconds': round(processed - started, 3),  # convbin e rnx2rtkp
+        'cpu_seconds': round(_cpu_seconds() - cpu_start, 3),
+        'epochs': total_epochs,
+        'epochs_per_second': round(total_epochs / elapsed, 1),
+        # Secondi di dati elaborati per secondo di calcolo
+        'realtime_factor': round(data_seconds / elapsed, 1),
+        'input_bytes': input_bytes,
+        'input_bytes_per_second': round(input_bytes / elapsed),
+    }
+    return summary
+
+
+# --- Nel processo del manager ---------------------------------------------
+
+class ReplayRunner:
+    """Lotti di rielaborazione offline su un pool di processi.
+
+    - cpus: numero di processi del pool, oppure elenco di CPU (un processo
+      per CPU, con affinità limitata a quelle CPU)
+    - data_dir: cartella dei file registrati; i percorsi dei lavori sono
+      relativi a questa e non possono uscirne
+    - work_dir: configurazioni, file convertiti e .pos prodotti, per lotto
+    """
+
+    def __init__(self, config_engine, registry=None, history=None, events=None, stop_criteria=None, cpus=1,
+                 data_dir='recordings', work_dir='replay', rnx2rtkp_path='rnx2rtkp', convbin_path='convbin',
+                 nice=10, job_timeout=3600.0, max_batches=50):
+        self.config_engine = config_engine
+        self.registry = registry
+        self.history = history
+        self.events = events
+        self.stop_criteria = stop_criteria or StopCriteria()
+        if isinstance(cpus, int):
+            self.workers, self.cpus = max(1, cpus), None
+        else:
+            self.workers, self.cpus = len(cpus), list(cpus)
+        self.data_dir = os.path.abspath(data_dir)
+        self.work_dir = os.path.abspath(work_dir)
+        self.rnx2rtkp_path = rnx2rtkp_path
+        self.convbin_path = convbin_path
+        self.nice = nice
+        self.job_timeout = job_timeout
+        self.max_batches = max_batches
+        self._lock = threading.Lock()
+        self._pool = None
+        self._ids = itertools.count(1)
+        self._batches = {}  # id -> lotto, in ordine di creazione
+        self._futures = {}  # (id lotto, indice) -> Future
+
+    def submit(self, jobs, criteria=None, profile=None, options=None):
+        """Accoda un lotto di lavori e ne restituisce lo stato iniziale.
+
+        jobs: [{"serial", "rover_file", "base_file", "nav_files": [...],
+        "base_coords": {"lat", "lon", "alt"}, "time": "AAAA/MM/GG hh:mm:ss"}]
+        (nav_files, base_coords e time facoltativi). profile e options
+        sostituiscono quelli della campagna e del rover per tutto il lotto.
+        Solleva ValueError se lotto o lavori non sono validi.
+        """
+        if not jobs:
+            raise ValueError("Nessun lavoro indicato")
+        serials = [spec.get('serial') for spec in jobs]
+        if len(set(serials)) != len(serials):
+            raise ValueError("Ogni rover può comparire una sola volta nel lotto")
+        self.config_engine.validate_device(profile, options)
+        criteria = StopCriteria.from_dict(criteria, base=self.stop_criteria)
+        batch_id = f"{datetime.now():%Y%m%dT%H%M%S}-{next(self._ids)}"
+        batch_dir = os.path.join(self.work_dir, batch_id)
+        prepared = [self._prepare(spec, batch_dir, criteria, profile, options) for spec in jobs]
+
+        batch = {'id': batch_id, 'created': time.time(), 'profile': profile, 'options': options or {},
+                 'criteria': criteria.to_dict(), 'jobs': [record for record, _payload in prepared]}
+        os.makedirs(batch_dir, exist_ok=True)
+        for record, payload in prepared:
+            with open(payload['config'], 'w') as f:
+                f.write(payload.pop('config_content'))
+
+        with self._lock:
+            self._batches[batch_id] = batch
+            for old_id in list(self._batches)[:-self.max_batches]:
+                self._forget(old_id)
+            pool = self._ensure_pool()
+            futures = []
+            for index, (record, payload) in enumerate(prepared):
+                record['submitted_at'] = time.time()
+                futures.append(pool.submit(run_replay_job, payload))
+                self._futures[(batch_id, index)] = futures[-1]
+        # Fuori dal lock: su un Future già completato la callback viene eseguita subito
+        for index, future in enumerate(futures):
+            future.add_done_callback(lambda f, index=index: self._on_done(batch_id, index, pool, f))
+        print(f"Rielaborazione {batch_id}: {len(prepared)} lavori su {self.workers} processi")
+        return self.get_batch(batch_id)
+
+    def batches(self):
+        """Riepilogo dei lotti, dal più recente."""
+        with self._lock:
+            ids = list(reversed(self._batches))
+        return [self._summary(batch) for batch in map(self.get_batch, ids) if batch is not None]
+
+    def get_batch(self, batch_id):
+        """Lotto con lo stato dei singoli lavori, o None."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            jobs = []
+            for index, record in enumerate(batch['jobs']):
+                record = dict(record)
+                future = self._futures.get((batch_id, index))
+                if record['status'] == 'queued' and future is not None and future.running():
+                    record['status'] = 'running'
+                jobs.append(record)
+            return dict(batch, jobs=jobs)
+
+    def cancel(self, batch_id):
+        """Annulla i lavori del lotto non ancora avviati; restituisce quanti, o None se il lotto non esiste."""
+        with self._lock:
+            if batch_id not in self._batches:
+                return None
+            futures = [future for (owner, _index), future in self._futures.items() if owner == batch_id]
+        return sum(1 for future in futures if future.cancel())
+
+    def _summary(self, batch):
+        counts = {}
+        for job in batch['jobs']:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        finished = [job['finished_at'] for job in batch['jobs'] if job.get('finished_at')]
+        done = all(job['status'] not in ('queued', 'running') for job in batch['jobs'])
+        summary = {key: value for key, value in batch.items() if key != 'jobs'}
+        summary.update({
+            'jobs': len(batch['jobs']),
+            'counts': counts,
+            'finished': done,
+            'wall_seconds': round(max(finished) - batch['created'], 1) if done and finished else None,
+        })
+        return summary
+
+    def _resolve(self, path, what):
+        if not path:
+            raise ValueError(f"File {what} non indicato")
+        full = os.path.realpath(os.path.join(self.data_dir, path))
+        if os.path.commonpath([full, self.data_dir]) != self.data_dir:
+            raise ValueError(f"Percorso non valido per il file {what}: {path}")
+        if not os.path.isfile(full):
+            raise ValueError(f"File {what} non trovato: {path}")
+        return full
+
+    def _prepare(self, spec, batch_dir, criteria, profile, options):
+        """Stato iniziale e parametri del lavoro; la configurazione viene generata qui, nel manager."""
+        serial = spec.get('serial')
+        if not serial:
+            raise ValueError("Seriale del rover non indicato")
+        rover = (self.registry.get_rover(serial) if self.registry is not None else None) or {'serial': serial,
+                                                                                               'name': serial}
+        rover_file = self._resolve(spec.get('rover_file'), 'del rover')
+        base_file = self._resolve(spec.get('base_file'), 'della base')
+        nav_files = [self._resolve(path, 'di navigazione') for path in spec.get('nav_files') or []]
+
+        base_coords = spec.get('base_coords')
+        if base_coords is None and base_file.lower().endswith(RTCM_EXTENSIONS):
+            station = read_file_station_position(base_file)
+            if station is not None:
+                base_coords = {key: station[key] for key in ('lat', 'lon', 'alt')}
+        rover_options = dict(rover.get('options') or {})
+        rover_options.update(options or {})
+        rover_options.update({'inpstr1-type': 'file', 'inpstr2-type': 'file'})
+        if base_coords is None:
+            # Posizione della base dall'intestazione RINEX (scritta anche da convbin)
+            rover_options['ant2-postype'] = 'rinexhead'
+        else:
+            base_coords = {key: float(base_coords[key]) for key in ('lat', 'lon', 'alt')}
+        profile = profile or rover.get('profile') or self.config_engine.get_campaign().get('profile') or DEFAULT_PROFILE
+
+        output = os.path.join(batch_dir, f"{serial}.pos")
+        config_content = self.config_engine.render(
+            dict(rover, profile=profile, options=rover_options), None, base_coords or {'lat': 0, 'lon': 0, 'alt': 0},
+            'file', output, input_paths=(rover_file, base_file))
+
+        if spec.get('time'):
+            try:
+                approx_time = datetime.strptime(spec['time'], '%Y/%m/%d %H:%M:%S').strftime('%Y/%m/%d %H:%M:%S')
+            except (TypeError, ValueError):
+                raise ValueError(f"Data approssimativa non valida per {serial} (AAAA/MM/GG hh:mm:ss)")
+        else:
+            approx_time = datetime.fromtimestamp(os.path.getmtime(rover_file), timezone.utc).strftime('%Y/%m/%d %H:%M:%S')
+        record = {
+            'serial': serial,
+            'rover_name': rover.get('name'),
+            'rover_file': os.path.relpath(rover_file, self.data_dir),
+            'base_file': os.path.relpath(base_file, self.data_dir),
+            'base_coords': base_coords,
+            'profile': profile,
+            'status': 'queued',
+            'error': None,
+            'output': output,
+            'history_id': None,
+            'coordinates': None,
+        }
+        payload = {
+            'serial': serial,
+            'rover_file': rover_file,
+            'base_file': base_file,
+            'nav_files': nav_files,
+            'approx_time': approx_time,
+            'config': os.path.join(batch_dir, f"{serial}.conf"),
+            'config_content': config_content,
+            'output': output,
+            'work_dir': batch_dir,
+            'criteria': criteria.to_dict(),
+            'epoch_interval': self.history.epoch_interval if self.history is not None else None,
+            'timeout': self.job_timeout,
+            'rnx2rtkp': self.rnx2rtkp_path,
+            'convbin': self.convbin_path,
+        }
+        return record, payload
+
+    def _ensure_pool(self):
+        # Chiamata con self._lock acquisito. 'fork': con 'spawn' o 'forkserver' i
+        # processi reimporterebbero il modulo principale (app.py costruisce i servizi all'import)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'),
+                                             initializer=_init_worker, initargs=(self.nice, self.cpus))
+        return self._pool
+
+    def _forget(self, batch_id):
+        # Chiamata con self._lock acquisito: i lotti più vecchi escono dalla memoria (restano nello storico)
+        batch = self._batches[batch_id]
+        if any(record['status'] in ('queued', 'running') for record in batch['jobs']):
+            return
+        del self._batches[batch_id]
+        for index in range(len(batch['jobs'])):
+            self._futures.pop((batch_id, index), None)
+
+    def _on_done(self, batch_id, index, pool, future):
+        """Chiamata dal pool al termine di un lavoro: stato, metriche e storico."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            record = batch['jobs'][index] if batch else None
+        if record is None:
+            return
+        if future.cancelled():
+            with self._lock:
+                record.update(status='cancelled', finished_at=time.time())
+            return
+        error = future.exception()
+        if error is not None:
+            with self._lock:
+                if isinstance(error, BrokenProcessPool) and self._pool is pool:
+                    # Un processo del pool è terminato in modo anomalo (es. memoria): il prossimo lotto ne crea uno nuovo
+                    self._pool = None
+                record.update(status='error', error=str(error) or type(error).__name__, finished_at=time.time())
+            REPLAY_JOBS.labels('error').inc()
+            print(f"Rielaborazione {batch_id}, rover {record['serial']}: {record['error']}")
+        else:
+            summary = future.result()
+            coordinates = format_result(summary.get('result'), record['base_coords'])
+            history_id = None
+            if self.history is not None and summary['epochs']:
+                history_id = self._record_history(record, summary, coordinates)
+            with self._lock:
+                record.update({
+                    'status': summary['status'],
+                    'coordinates': coordinates,
+                    'epochs': summary['epochs'],
+                    'data_seconds': summary['data_seconds'],
+                    'first_float_at': summary['first_float_at'],
+                    'first_fix_at': summary['first_fix_at'],
+                    'fix_at': summary['fix_at'],
+                    'timeline': StateTimeline.decode(summary['timeline']),
+                    'throughput': summary['throughput'],
+                    'history_id': history_id,
+                    'finished_at': time.time(),
+                })
+            REPLAY_JOBS.labels(summary['status']).inc()
+            REPLAY_DURATION.observe(summary['throughput']['wall_seconds'])
+        if self.events is not None:
+            self.events.publish('replay', {'batch': batch_id, 'serial': record['serial'], 'status': record['status']})
+
+    def _record_history(self, record, summary, coordinates):
+        history_id = self.history.start_session(record['serial'], record['rover_name'], record['base_file'],
+                                                record['profile'], start_time=summary['start_time'], source='replay')
+        if history_id is None:
+            return None
+        if summary['first_fix_at'] is not None:
+            self.history.record_first_fix(history_id, summary['first_fix_at'])
+        for epoch_time, epoch in summary['samples']:
+            self.history.record_epoch(history_id, epoch, now=epoch_time)
+        self.history.end_session(history_id, summary['status'], coordinates=coordinates,
+                                 time_to_fix=summary['fix_at'], end_time=summary['end_time'],
+                                 time_to_float=summary['first_float_at'], timeline=summary['timeline'])
+        return history_id
@@ -0,0 +1,258 @@
+"""Decodifica dei frame RTCM3 e acquisizione della posizione del master.
+
+Il master trasmette la propria posizione nei messaggi di stazione 1005/1006
+(coordinate ECEF dell'ARP). La posizione viene letta una volta dallo stream
+e condivisa fra tutte le sessioni tramite MasterPositionCache.
+"""
+import socket
+import threading
+import time
+
+from geodesy import ecef_to_llh
+
+RTCM3_PREAMBLE = 0xD3
+STATION_MESSAGES = (1005, 1006)
+
+
+def _crc24q_table():
+    table = []
+    for i in range(256):
+        crc = i << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table.append(crc & 0xFFFFFF)
+    return table
+
+
+_CRC24Q_TABLE = _crc24q_table()
+
+
+def crc24q(data):
+    """CRC-24Q (Qualcomm) usato dai frame RTCM3."""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ _CRC24Q_TABLE[(crc >> 16) ^ byte]
+    return crc
+
+
+def build_frame(payload):
+    """Incapsula un payload in un frame RTCM3 (preambolo, lunghezza, CRC)."""
+    if len(payload) > 1023:
+        raise ValueError("Payload RTCM3 troppo lungo")
+    header = bytes((RTCM3_PREAMBLE, len(payload) >> 8, len(payload) & 0xFF))
+    crc = crc24q(header + payload)
+    return header + payload + crc.to_bytes(3, 'big')
+
+
+def get_bits(data, pos, length):
+    """Legge `length` bit senza segno a partire dal bit `pos` (MSB first)."""
+    value = 0
+    for i in range(pos, pos + length):
+        value = (value << 1) | ((data[i >> 3] >> (7 - (i & 7))) & 1)
+    return value
+
+
+def get_bits_signed(data, pos, length):
+    value = get_bits(data, pos, length)
+    if value & (1 << (length - 1)):
+        value -= 1 << length
+    return value
+
+
+def message_type(payload):
+    return get_bits(payload, 0, 12) if len(payload) >= 2 else None
+
+
+def decode_station(payload):
+    """Decodifica un messaggio 1005/1006 (posizione ARP della stazione).
+
+    Restituisce un dizionario con station_id, x, y, z (m, ECEF), lat, lon,
+    alt (WGS84) e, per il 1006, antenna_height; None se il tipo è diverso.
+    """
+    msg = message_type(payload)
+    if msg not in STATION_MESSAGES or len(payload) < (21 if msg == 1006 else 19):
+        return None
+    pos = 12
+    station_id = get_bits(payload, pos, 12); pos += 12
+    itrf_year = get_bits(payload, pos, 6); pos += 6
+    pos += 4  # Indicatori GPS/GLONASS/Galileo/stazione di riferimento
+    x = round(get_bits_signed(payload, pos, 38) * 0.0001, 4); pos += 38
+    pos += 2  # Oscillatore singolo, riservato
+    y = round(get_bits_signed(payload, pos, 38) * 0.0001, 4); pos += 38
+    pos += 2  # Indicatore quarto di ciclo
+    z = round(get_bits_signed(payload, pos, 38) * 0.0001, 4); pos += 38
+    lat, lon, alt = ecef_to_llh(x, y, z)
+    station = {
+        'message': msg,
+        'station_id': station_id,
+        'itrf_year': itrf_year,
+        'x': x, 'y': y, 'z': z,
+        'lat': lat, 'lon': lon, 'alt': alt,
+    }
+    if msg == 1006:
+        station['antenna_height'] = round(get_bits(payload, pos, 16) * 0.0001, 4)
+    return station
+
+
+def encode_station(station_id, x, y, z, antenna_height=None):
+    """Payload di un messaggio 1005 (o 1006 se antenna_height è indicata)."""
+    fields = [
+        (1006 if antenna_height is not None else 1005, 12),
+        (station_id, 12), (0, 6), (1, 1), (1, 1), (1, 1), (0, 1),
+        (round(x / 0.0001), 38), (0, 2),
+        (round(y / 0.0001), 38), (0, 2),
+        (round(z / 0.0001), 38),
+    ]
+    if antenna_height is not None:
+        fields.append((round(antenna_height / 0.0001), 16))
+    bits = 0
+    nbits = 0
+    for value, length in fields:
+        bits = (bits << length) | (value & ((1 << length) - 1))
+        nbits += length
+    padding = -nbits % 8
+    return (bits << padding).to_bytes((nbits + padding) // 8, 'big')
+
+
+class RtcmFrameReader:
+    """Estrae i frame RTCM3 validi da uno stream di byte.
+
+    I byte vengono accumulati con feed(); i frame con CRC errato vengono
+    scartati risincronizzandosi sul preambolo successivo.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """Aggiunge dati e restituisce la lista dei payload completi."""
+        self._buffer += data
+        buf = self._buffer
+        payloads = []
+        start = 0
+        while True:
+            start = buf.find(RTCM3_PREAMBLE, start)
+            if start < 0:
+                start = len(buf)
+                break
+            if len(buf) - start < 3:
+                break
+            length = ((buf[start + 1] & 0x03) << 8) | buf[start + 2]
+            end = start + 3 + length + 3
+            if len(buf) < end:
+                break
+            frame = bytes(buf[start:end])
+            if crc24q(frame[:-3]) == int.from_bytes(frame[-3:], 'big'):
+                payloads.append(frame[3:-3])
+                start = end
+            else:
+                # Falso preambolo o frame corrotto
+                self.crc_errors += 1
+                start += 1
+        del buf[:start]
+        return payloads
+
+
+def read_station_position(host, port, timeout=10.0):
+    """Si collega allo stream RTCM3 e attende un messaggio 1005/1006.
+
+    Restituisce la posizione decodificata (vedi decode_station) oppure
+    solleva TimeoutError / OSError.
+    """
+    deadline = time.monotonic() + timeout
+    reader = RtcmFrameReader()
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Nessun messaggio 1005/1006 da {host}:{port} entro {timeout} s")
+            sock.settimeout(remaining)
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                continue
+            if not data:
+                raise ConnectionError(f"Stream RTCM chiuso da {host}:{port}")
+            for payload in reader.feed(data):
+                station = decode_station(payload)
+                if station is not None:
+                    return station
+
+
+class MasterPositionCache:
+    """Posizione dei master letta dagli stream RTCM, condivisa fra le sessioni.
+
+    Ogni posizione resta valida per `ttl` secondi. Se più sessioni la
+    chiedono contemporaneamente (avvio in blocco), una sola si collega al
+    master e le altre attendono il risultato. Anche gli errori restano in
+    cache, per `retry_after` secondi: un master irraggiungibile non costa
+    un timeout a ogni avvio.
+    """
+
+    def __init__(self, ttl=300.0, timeout=10.0, retry_after=30.0, reader=read_station_position):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._reader = reader
+        self._lock = threading.Lock()
+        self._entries = {}  # (host, port) -> (posizione, istante di lettura)
+        self._failures = {}  # (host, port) -> istante dell'ultima lettura fallita
+        self._inflight = {}  # (host, port) -> threading.Event
+
+    def get(self, host, port):
+        """Posizione del master in (host, port), o None se non disponibile.
+
+        In caso di errore di lettura (anche recente, entro retry_after)
+        restituisce l'ultima posizione nota, anche se scaduta.
+        """
+        key = (host, int(port))
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[1] < self.ttl:
+                    return entry[0]
+                failed_at = self._failures.get(key)
+                if failed_at is not None and now - failed_at < self.retry_after:
+                    return entry[0] if entry else None
+                event = self._inflight.get(key)
+                if event is None:
+                    # Questo chiamante esegue la lettura
+                    event = self._inflight[key] = threading.Event()
+                    break
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                if key not in self._inflight:
+                    return entry[0] if entry else None
+
+        position = None
+        try:
+            position = self._reader(host, int(port), self.timeout)
+            print(f"Posizione del master {host}:{port} da RTCM {position['message']}: "
+                  f"{position['lat']:.8f}, {position['lon']:.8f}, {position['alt']:.3f}")
+        except (OSError, ValueError) as e:
+            print(f"Impossibile leggere la posizione del master {host}:{port}: {e}")
+        with self._lock:
+            if position is not None:
+                self._entries[key] = (position, time.monotonic())
+                self._failures.pop(key, None)
+            else:
+                self._failures[key] = time.monotonic()
+            entry = self._entries.get(key)
+            del self._inflight[key]
+        event.set()
+        return entry[0] if entry else None
+
+    def invalidate(self, host=None, port=None):
+        """Scarta la posizione di un master (o di tutti)."""
+        with self._lock:
+            if host is None:
+                self._entries.clear()
+                self._failures.clear()
+            else:
+                self._entries.pop((host, int(port)), None)
+                self._failures.pop((host, int(port)), None)
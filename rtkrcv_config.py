@@ -0,0 +1,374 @@
+"""Generazione dei file di configurazione di rtkrcv.
+
+Le opzioni sono organizzate a livelli, dal più generale al più specifico:
+
+1. opzioni di base (BASE_OPTIONS)
+2. profilo con nome (es. 'fast-static', 'kinematic')
+3. opzioni della campagna (impostazioni 'rtkrcv' di pool_list.json)
+4. profilo e opzioni del singolo rover (campi 'profile' e 'options')
+5. valori della sessione (stream di ingresso/uscita, posizione del master)
+
+Le combinazioni dei livelli 1-4 vengono compilate una sola volta in un
+modello; ad ogni avvio si sostituiscono solo i valori della sessione. Il
+file viene riscritto solo se il contenuto è cambiato.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+
+# Opzioni di base, in ordine di sezione come nei file di esempio di RTKLIB
+BASE_OPTIONS = [
+    ('CONSOLE', [
+        ('console-passwd', 'admin'),
+        ('console-timetype', 'utc'),
+        ('console-soltype', 'dms'),
+        ('console-solflag', 'off'),
+    ]),
+    ('OPTIONS 1', [
+        ('pos1-posmode', 'static-start'),
+        ('pos1-frequency', 'l1'),
+        ('pos1-soltype', 'forward'),
+        ('pos1-elmask', '15'),
+        ('pos1-snrmask_r', 'on'),
+        ('pos1-snrmask_b', 'on'),
+        ('pos1-snrmask_L1', '20,20,20,20,20,20,20,20,20'),
+        ('pos1-snrmask_L2', '0,0,0,0,0,0,0,0,0'),
+        ('pos1-snrmask_L5', '0,0,0,0,0,0,0,0,0'),
+        ('pos1-dynamics', 'on'),
+        ('pos1-tidecorr', 'off'),
+        ('pos1-ionoopt', 'brdc'),
+        ('pos1-tropopt', 'saas'),
+        ('pos1-sateph', 'brdc'),
+        ('pos1-posopt1', 'off'),
+        ('pos1-posopt2', 'off'),
+        ('pos1-posopt3', 'off'),
+        ('pos1-posopt4', 'off'),
+        ('pos1-posopt5', 'off'),
+        ('pos1-exclsats', ''),
+        ('pos1-navsys', '13'),
+    ]),
+    ('OPTIONS 2', [
+        ('pos2-armode', 'fix-and-hold'),
+        ('pos2-gloarmode', 'off'),
+        ('pos2-arfilter', 'on'),
+        ('pos2-bdsarmode', 'off'),
+        ('pos2-arlockcnt', '0'),
+        ('pos2-arthres', '3'),
+        ('pos2-arthres1', '0.99'),
+        ('pos2-arthres2', '-0.055'),
+        ('pos2-arthres3', '1E-7'),
+        ('pos2-arthres4', '1E-3'),
+        ('pos2-minfixsats', '4'),
+        ('pos2-minholdsats', '5'),
+        ('pos2-arelmask', '0'),
+        ('pos2-aroutcnt', '5'),
+        ('pos2-arminfix', '0'),
+        ('pos2-armaxiter', '1'),
+        ('pos2-elmaskhold', '0'),
+        ('pos2-slipthres', '0.05'),
+        ('pos2-maxage', '100'),
+        ('pos2-syncsol', 'off'),
+        ('pos2-rejionno', '1000'),
+        ('pos2-rejgdop', '30'),
+        ('pos2-niter', '1'),
+        ('pos2-baselen', '0'),
+        ('pos2-basesig', '0'),
+    ]),
+    ('OUTPUT DETAILS', [
+        ('out-solformat', 'llh'),
+        ('out-outhead', 'on'),
+        ('out-outopt', 'off'),
+        ('out-timesys', 'gpst'),
+        ('out-timeform', 'hms'),
+        ('out-timendec', '3'),
+        ('out-degform', 'deg'),
+        ('out-fieldsep', ''),
+        ('out-height', 'ellipsoidal'),
+        ('out-geoid', 'internal'),
+        ('out-solstatic', 'all'),
+        ('out-nmeaintv1', '1'),
+        ('out-nmeaintv2', '1'),
+        ('out-outstat', 'off'),
+        ('out-outsingle', 'on'),
+    ]),
+    ('STATISTICS', [
+        ('stats-eratio1', '300'),
+        ('stats-eratio2', '100'),
+        ('stats-errphase', '0.003'),
+        ('stats-errphaseel', '0.003'),
+        ('stats-errphasebl', '0'),
+        ('stats-errdoppler', '10'),
+        ('stats-stdbias', '30'),
+        ('stats-stdiono', '0.03'),
+        ('stats-stdtrop', '0.3'),
+        ('stats-prnaccelh', '1'),
+        ('stats-prnaccelv', '1'),
+        ('stats-prnbias', '0.0001'),
+        ('stats-prniono', '0.001'),
+        ('stats-prntrop', '0.0001'),
+        ('stats-clkstab', '5e-12'),
+    ]),
+    ('ROVER DETAILS', [
+        ('ant1-postype', 'single'),
+        ('ant1-pos1', ''),
+        ('ant1-pos2', ''),
+        ('ant1-pos3', ''),
+        ('ant1-anttype', ''),
+        ('ant1-antdele', '0'),
+        ('ant1-antdeln', '0'),
+        ('ant1-antdelu', '0'),
+    ]),
+    ('MASTER DETAILS', [
+        ('ant2-postype', 'llh'),
+        ('ant2-pos1', None),
+        ('ant2-pos2', None),
+        ('ant2-pos3', None),
+        ('ant2-anttype', ''),
+        ('ant2-antdele', '0'),
+        ('ant2-antdeln', '0'),
+        ('ant2-antdelu', '0'),
+    ]),
+    ('INPUT STREAMS', [
+        ('inpstr1-type', 'tcpcli'),
+        ('inpstr1-path', None),
+        ('inpstr1-format', 'rtcm3'),
+        ('inpstr2-type', 'tcpcli'),
+        ('inpstr2-path', None),
+        ('inpstr2-format', 'rtcm3'),
+        ('inpstr3-type', 'off'),
+    ]),
+    ('OUTPUT STREAM', [
+        ('outstr1-type', None),
+        ('outstr1-path', None),
+        ('outstr1-format', 'llh'),
+    ]),
+    ('MISC', [
+        ('misc-timeinterp', 'off'),
+        ('misc-sbasatsel', '0'),
+        ('misc-rnxopt1', ''),
+        ('misc-rnxopt2', ''),
+        ('file-cmdfile1', ''),
+        ('file-cmdfile2', ''),
+        ('file-cmdfile3', ''),
+    ]),
+]
+
+# Opzioni con valore None: dipendono dalla singola sessione e non possono
+# essere sovrascritte da profili o override
+SESSION_KEYS = frozenset(key for _, options in BASE_OPTIONS for key, value in options if value is None)
+
+DEFAULT_PROFILE = 'static'
+
+# Profili con nome: differenze rispetto alle opzioni di base
+PROFILES = {
+    # Rover fermo, inizializzazione statica (configurazione storica)
+    'static': {},
+    # Statico con soglie più permissive per ridurre il tempo al fix;
+    # la validazione è demandata al motore di convergenza
+    'fast-static': {
+        'pos1-elmask': '10',
+        'pos2-gloarmode': 'on',
+        'pos2-arthres': '2.5',
+        'pos2-minfixsats': '5',
+    },
+    # Rover in movimento
+    'kinematic': {
+        'pos1-posmode': 'kinematic',
+        'pos1-dynamics': 'on',
+        'pos2-armode': 'continuous',
+    },
+}
+
+_KEY_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]*$')
+
+
+def _render_line(key, value):
+    return f"{key:<19}={value}\n"
+
+
+class RtkrcvConfigEngine:
+    """Genera i file di configurazione di rtkrcv a partire dai profili.
+
+    I modelli compilati sono memorizzati per combinazione di profilo e
+    override; gli hash dei file scritti evitano riscritture inutili (ad
+    esempio nei riavvii in blocco).
+    """
+
+    def __init__(self, base_options=BASE_OPTIONS, profiles=PROFILES):
+        self.base_options = base_options
+        self.builtin_profiles = dict(profiles)
+        self._lock = threading.Lock()
+        self._campaign = {}
+        self._profiles = dict(profiles)
+        self._templates = {}  # (profilo, override) -> modello compilato
+        self._written = {}  # percorso -> (sha256, mtime_ns, size)
+
+    # --- Impostazioni ---------------------------------------------------
+
+    def set_campaign(self, settings):
+        """Imposta profilo, opzioni e profili personalizzati della campagna.
+
+        settings: {"profile": str, "options": {...}, "profiles": {nome: {...}}}
+        Solleva ValueError se le impostazioni non sono valide.
+        """
+        settings = dict(settings or {})
+        unknown = set(settings) - {'profile', 'options', 'profiles'}
+        if unknown:
+            raise ValueError(f"Impostazioni rtkrcv sconosciute: {', '.join(sorted(unknown))}")
+        profiles = dict(self.builtin_profiles)
+        for name, options in (settings.get('profiles') or {}).items():
+            profiles[name] = self._validate_options(options)
+        profile = settings.get('profile') or DEFAULT_PROFILE
+        if profile not in profiles:
+            raise ValueError(f"Profilo rtkrcv sconosciuto: {profile}")
+        self._validate_options(settings.get('options'))
+        with self._lock:
+            self._campaign = settings
+            self._profiles = profiles
+            self._templates = {}
+
+    def get_campaign(self):
+        with self._lock:
+            return dict(self._campaign)
+
+    def profile_names(self):
+        with self._lock:
+            return list(self._profiles)
+
+    def validate_device(self, profile, options):
+        """Controlla profilo e opzioni di un rover. Solleva ValueError se non validi."""
+        if profile is not None and profile not in self.profile_names():
+            raise ValueError(f"Profilo rtkrcv sconosciuto: {profile}")
+        self._validate_options(options)
+
+    def _validate_options(self, options):
+        if options is None:
+            return {}
+        if not isinstance(options, dict):
+            raise ValueError("Le opzioni rtkrcv devono essere un oggetto chiave/valore")
+        validated = {}
+        for key, value in options.items():
+            if not _KEY_PATTERN.match(str(key)):
+                raise ValueError(f"Nome di opzione rtkrcv non valido: {key}")
+            if key in SESSION_KEYS:
+                raise ValueError(f"L'opzione {key} è gestita dal manager e non può essere modificata")
+            value = '' if value is None else str(value)
+            if '\n' in value or '\r' in value or '#' in value:
+                raise ValueError(f"Valore non valido per l'opzione {key}")
+            validated[key] = value
+        return validated
+
+    # --- Rendering --------------------------------------------------------
+
+    def render(self, rover, master_device_info, master_coords, output_type, output_path, input_paths=None):
+        """Restituisce il contenuto del file di configurazione per una sessione.
+
+        input_paths (rover, master): file registrati da usare al posto degli
+        stream TCP dei dispositivi (rielaborazione offline, vedi replay.py).
+        """
+        if input_paths is None:
+            input_paths = (f"{rover['ip']}:{rover['port']}", f"{master_device_info['ip']}:{master_device_info['port']}")
+        values = {
+            'ant2-pos1': master_coords['lat'],
+            'ant2-pos2': master_coords['lon'],
+            'ant2-pos3': master_coords['alt'],
+            'inpstr1-path': input_paths[0],
+            'inpstr2-path': input_paths[1],
+            'outstr1-type': output_type,
+            'outstr1-path': output_path,
+        }
+        profile, chunks = self._template(rover.get('profile'), rover.get('options'))
+        parts = [f"# RTKRCV configuration for {rover['name']} (profile: {profile})\n", chunks[0]]
+        # Il modello alterna testo fisso e nomi delle opzioni di sessione
+        for i in range(1, len(chunks), 2):
+            parts.append(_render_line(chunks[i], values[chunks[i]]))
+            parts.append(chunks[i + 1])
+        return ''.join(parts)
+
+    def _template(self, rover_profile, rover_options):
+        rover_options = rover_options or {}
+        key = (rover_profile, tuple(sorted((k, str(v)) for k, v in rover_options.items())))
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                template = self._compile(rover_profile, rover_options)
+                self._templates[key] = template
+            return template
+
+    def _compile(self, rover_profile, rover_options):
+        # Chiamata con self._lock acquisito
+        campaign = self._campaign
+        profile = rover_profile or campaign.get('profile') or DEFAULT_PROFILE
+        if profile not in self._profiles:
+            raise ValueError(f"Profilo rtkrcv sconosciuto: {profile}")
+
+        # Il profilo del rover sostituisce quello della campagna; le opzioni
+        # esplicite (campagna, poi rover) prevalgono su quelle del profilo
+        overrides = dict(self._profiles[profile])
+        overrides.update(self._validate_options(campaign.get('options')))
+        overrides.update(self._validate_options(rover_options))
+
+        chunks = []
+        text = []
+        seen = set()
+        for section, options in self.base_options:
+            text.append(f"\n# {section}\n")
+            for option, value in options:
+                seen.add(option)
+                if option in SESSION_KEYS:
+                    chunks.append(''.join(text))
+                    chunks.append(option)
+                    text = []
+                else:
+                    text.append(_render_line(option, overrides.get(option, value)))
+        extra = [option for option in overrides if option not in seen]
+        if extra:
+            text.append("\n# OVERRIDES\n")
+            text.extend(_render_line(option, overrides[option]) for option in extra)
+        chunks.append(''.join(text))
+        return profile, chunks
+
+    # --- Scrittura --------------------------------------------------------
+
+    def write(self, path, content):
+        """Scrive il file solo se il contenuto è diverso. Restituisce True se è stato scritto."""
+        data = content.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+
+        if st is not None:
+            with self._lock:
+                cached = self._written.get(path)
+            if cached == (digest, st.st_mtime_ns, st.st_size):
+                return False
+            if st.st_size == len(data):
+                # File non ancora visto (es. dopo un riavvio): confronta il contenuto
+                with open(path, 'rb') as f:
+                    if hashlib.sha256(f.read()).hexdigest() == digest:
+                        with self._lock:
+                            self._written[path] = (digest, st.st_mtime_ns, st.st_size)
+                        return False
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.rtkrcv.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        st = os.stat(path)
+        with self._lock:
+            self._written[path] = (digest, st.st_mtime_ns, st.st_size)
+        return True
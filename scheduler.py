@@ -0,0 +1,321 @@
+"""Pianificazione adattiva delle sessioni in base ai tempi al fix storici.
+
+Quando l'host non può eseguire tutte le sessioni insieme, i rover vengono
+messi in coda e avviati man mano che si liberano posti: al più
+max_sessions rtkrcv in esecuzione, contando anche le sessioni avviate a
+mano. L'ordine massimizza i fix per ora: prima i rover con il tasso di fix
+per secondo di sessione atteso più alto. Le stime vengono dalle sessioni
+dal vivo registrate nello storico: del rover, altrimenti del suo sito (il
+master di riferimento), altrimenti di tutta la flotta.
+
+Ogni sessione riceve una durata massima pari al tempo al fix atteso per
+timeout_factor. Se la supera viene chiusa ('timeout') e rimessa in coda,
+dopo i primi tentativi degli altri rover, fino a max_retries volte e con
+una durata doppia a ogni tentativo.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from convergence import StopCriteria
+from metrics import REGISTRY, Gauge
+
+SCHEDULED = REGISTRY.counter('rtkrcv_scheduler_sessions_total', "Sessioni pianificate concluse per esito", ['result'])
+
+# Stati che chiudono una sessione avviata dal pianificatore
+_ENDED = ('fix', 'timeout', 'error', 'stopped')
+# Esiti per cui la sessione viene ritentata
+_RETRY = ('timeout', 'error')
+
+
+class SessionScheduler:
+    """Coda delle sessioni con ordine, concorrenza e durata massima stimati dallo storico."""
+
+    def __init__(self, sessions, history=None, max_sessions=8, timeout_factor=3.0, max_retries=1, min_samples=3,
+                 min_timeout=120.0, max_timeout=None, window_days=90, retry_delay=10.0, refresh_interval=60.0):
+        self.sessions = sessions  # SessionManager locale
+        self.history = history
+        self.max_sessions = max_sessions
+        self.timeout_factor = timeout_factor
+        self.max_retries = max_retries
+        self.min_samples = min_samples  # Sessioni con fix necessarie perché una stima sia usata
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.window_days = window_days  # Sessioni considerate nelle stime (None = tutte)
+        self.retry_delay = retry_delay  # Attesa prima di un nuovo tentativo (chiusura di rtkrcv)
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        self._queue = []  # Lavori in attesa
+        self._running = {}  # serial -> lavoro in avvio o in esecuzione
+        self._finished = deque(maxlen=500)
+        self._estimates = {}
+        self._estimated_at = None
+        self._launcher = ThreadPoolExecutor(max_workers=8, thread_name_prefix='scheduler-start')
+        REGISTRY.add_collector(self._collect_metrics)
+        threading.Thread(target=self._follow_sessions, name='scheduler', daemon=True).start()
+
+    # --- API ----------------------------------------------------------------
+
+    def submit(self, pairs, criteria=None):
+        """Mette in coda le sessioni (rover, master); restituisce serial -> {'success', 'message'}.
+
+        criteria (StopCriteria) sostituisce i criteri predefiniti del
+        manager; la durata massima è quella stimata, se più breve.
+        """
+        active = set(self.sessions.get_active_serials())
+        results = {}
+        with self._lock:
+            waiting = {job['serial'] for job in self._queue} | set(self._running) | active
+            for rover, master in pairs:
+                serial = rover['serial']
+                if serial in waiting:
+                    results[serial] = {'success': False, 'message': "Sessione già attiva o in coda per questo rover"}
+                    continue
+                waiting.add(serial)
+                self._queue.append({
+                    'serial': serial,
+                    'rover': rover,
+                    'master': master,
+                    'criteria': criteria,
+                    'seq': next(self._order),
+                    'attempt': 0,
+                    'status': 'queued',
+                    'not_before': 0.0,
+                    'expected': None,
+                    'timeout': None,
+                    'queued_at': time.time(),
+                    'started_at': None,
+                    'finished_at': None,
+                    'message': None,
+                })
+                results[serial] = {'success': True, 'message': "Sessione in coda"}
+        self._dispatch()
+        return results
+
+    def status(self):
+        """Coda (nell'ordine di avvio previsto), sessioni in corso, ultime concluse e fix nell'ultima ora."""
+        hour_ago = time.time() - 3600
+        with self._lock:
+            return {
+                'max_sessions': self.max_sessions,
+                'timeout_factor': self.timeout_factor,
+                'max_retries': self.max_retries,
+                'queued': [self._view(job) for job in sorted(self._queue, key=self._priority)],
+                'running': [self._view(job) for job in self._running.values()],
+                'finished': [self._view(job) for job in reversed(self._finished)],
+                'fixes_last_hour': sum(1 for job in self._finished
+                                       if job['status'] == 'fix' and job['finished_at'] >= hour_ago),
+            }
+
+    def cancel(self, serials=None):
+        """Toglie dalla coda i rover indicati (tutti se None); le sessioni in corso non vengono fermate."""
+        with self._lock:
+            cancelled = [job for job in self._queue if serials is None or job['serial'] in serials]
+            for job in cancelled:
+                self._queue.remove(job)
+                self._finish(job, 'cancelled')
+        return [job['serial'] for job in cancelled]
+
+    def configure(self, max_sessions=None, timeout_factor=None, max_retries=None):
+        """Aggiorna i limiti; valgono per i prossimi avvii."""
+        if max_sessions is not None and int(max_sessions) < 1:
+            raise ValueError("max_sessions deve essere almeno 1")
+        if timeout_factor is not None and float(timeout_factor) <= 1:
+            raise ValueError("timeout_factor deve essere maggiore di 1")
+        if max_retries is not None and int(max_retries) < 0:
+            raise ValueError("max_retries non può essere negativo")
+        with self._lock:
+            if max_sessions is not None:
+                self.max_sessions = int(max_sessions)
+            if timeout_factor is not None:
+                self.timeout_factor = float(timeout_factor)
+            if max_retries is not None:
+                self.max_retries = int(max_retries)
+        self._dispatch()
+
+    # --- Avvii --------------------------------------------------------------
+
+    def _dispatch(self):
+        """Avvia i lavori in coda finché ci sono posti liberi, nell'ordine stimato migliore."""
+        estimates = self._current_estimates()
+        active = self._busy_serials()
+        now = time.monotonic()
+        to_start = []
+        with self._lock:
+            for job in self._queue:
+                job['expected'] = self._expected(job, estimates)
+            self._queue.sort(key=self._priority)
+            free = self.max_sessions - len(active | set(self._running))
+            for job in list(self._queue):
+                if free <= 0:
+                    break
+                if job['not_before'] > now:
+                    continue
+                self._queue.remove(job)
+                job.update(status='starting', timeout=self._timeout(job))
+                self._running[job['serial']] = job
+                to_start.append(job)
+                free -= 1
+        for job in to_start:
+            self._launcher.submit(self._start, job)
+
+    def _start(self, job):
+        criteria = job['criteria'] or self.sessions.stop_criteria
+        if job['timeout'] is not None:
+            max_duration = job['timeout']
+            if criteria.max_duration is not None:
+                max_duration = min(max_duration, criteria.max_duration)
+            criteria = StopCriteria.from_dict({'max_duration': max_duration}, criteria)
+        try:
+            success, message = self.sessions.start_session(job['rover'], job['master'], criteria)
+        except Exception as e:
+            success, message = False, str(e)
+        with self._lock:
+            if self._running.get(job['serial']) is not job:
+                return  # Già conclusa (es. fix arrivato prima della risposta)
+            if success:
+                job.update(status='running', started_at=time.time())
+                return
+            del self._running[job['serial']]
+            self._finish(job, 'failed', message)
+        print(f"[{job['serial']}] Avvio pianificato non riuscito: {message}")
+        self._dispatch()
+
+    def _busy_serials(self):
+        """Rover che occupano un posto: rtkrcv attivo, tranne le sessioni già concluse (fix, timeout)
+        il cui processo sta terminando."""
+        snapshots = self.sessions.get_snapshots()
+        return {serial for serial in self.sessions.get_active_serials()
+                if getattr(snapshots.get(serial), 'status', None) not in ('fix', 'timeout')}
+
+    @staticmethod
+    def _priority(job):
+        # Primi tentativi prima dei nuovi tentativi; poi fix attesi per secondo, decrescenti;
+        # i rover senza stima dopo quelli stimati, nell'ordine di arrivo
+        expected = job['expected'] or {}
+        if expected.get('median'):
+            return job['attempt'], 0, -(expected['fix_rate'] / expected['median']), job['seq']
+        return job['attempt'], 1, 0.0, job['seq']
+
+    def _timeout(self, job):
+        """Durata massima del tentativo: tempo al fix atteso per timeout_factor (None senza stima)."""
+        expected = job['expected'] or {}
+        if not expected.get('median'):
+            return None
+        timeout = max(expected['median'] * self.timeout_factor, expected['p90'] or 0, self.min_timeout)
+        timeout *= 2 ** job['attempt']
+        if self.max_timeout is not None:
+            timeout = min(timeout, self.max_timeout)
+        return round(timeout, 1)
+
+    # --- Stime --------------------------------------------------------------
+
+    def _current_estimates(self):
+        """Statistiche dei tempi al fix per rover, sito e flotta, rilette al più ogni refresh_interval secondi."""
+        if self.history is None:
+            return {}
+        now = time.monotonic()
+        if self._estimated_at is None or now - self._estimated_at >= self.refresh_interval:
+            since = time.time() - self.window_days * 86400 if self.window_days else None
+            try:
+                self._estimates = {by: self.history.ttf_stats(since=since, source='live', by=by)
+                                   for by in ('serial', 'master', 'all')}
+            except Exception as e:
+                print(f"Errore nella lettura delle statistiche dei tempi al fix: {e}")
+            self._estimated_at = now
+        return self._estimates
+
+    def _expected(self, job, estimates):
+        """Tempo al fix atteso (mediana, p90) e tasso di fix, dal gruppo più specifico con abbastanza sessioni."""
+        scopes = (('serial', job['serial']), ('master', job['master'].get('serial')), ('all', '*'))
+        for scope, key in scopes:
+            stats = estimates.get(scope, {}).get(key)
+            ttf = stats['time_to_fix'] if stats else None
+            if ttf and ttf['count'] >= self.min_samples:
+                return {
+                    'source': scope,
+                    'median': ttf['median'],
+                    'p90': ttf['p90'],
+                    'fix_rate': stats['fix_rate'] if stats['fix_rate'] is not None else 1.0,
+                    'samples': ttf['count'],
+                }
+        return {'source': None, 'median': None, 'p90': None, 'fix_rate': None, 'samples': 0}
+
+    # --- Esiti --------------------------------------------------------------
+
+    def _follow_sessions(self):
+        """Segue gli eventi di stato delle sessioni per liberare i posti e ritentare."""
+        q = self.sessions.events.subscribe()
+        while True:
+            event = q.get()
+            try:
+                if event['type'] == 'status':
+                    self._on_status(event['data']['serial'], event['data']['status'])
+                elif event['type'] == 'resync':
+                    # Eventi persi: stato corrente delle sessioni in corso
+                    with self._lock:
+                        running = [job['serial'] for job in self._running.values() if job['status'] == 'running']
+                    for serial in running:
+                        self._on_status(serial, self.sessions.get_session_status(serial))
+            except Exception as e:
+                print(f"Errore nel pianificatore delle sessioni: {e}")
+
+    def _on_status(self, serial, status):
+        if status not in _ENDED:
+            return
+        with self._lock:
+            job = self._running.pop(serial, None)
+            queued = bool(self._queue)
+        if job is None:
+            # Sessione avviata a mano: il posto che occupava può servire alla coda
+            if queued:
+                self._dispatch()
+            return
+        with self._lock:
+            retry = status in _RETRY and job['attempt'] < self.max_retries
+            if retry:
+                job.update(status='queued', attempt=job['attempt'] + 1, message=f"Nuovo tentativo dopo {status}",
+                           not_before=time.monotonic() + self.retry_delay)
+                self._queue.append(job)
+            else:
+                self._finish(job, status)
+        if retry:
+            print(f"[{serial}] Sessione pianificata chiusa per {status}: nuovo tentativo n. {job['attempt']}")
+            timer = threading.Timer(self.retry_delay, self._dispatch)
+            timer.daemon = True
+            timer.start()
+        self._dispatch()
+
+    def _finish(self, job, status, message=None):
+        """Da chiamare con self._lock acquisito."""
+        job.update(status=status, finished_at=time.time(), message=message or job['message'])
+        self._finished.append(job)
+        SCHEDULED.labels(status).inc()
+        self.sessions.events.publish('schedule', {'serial': job['serial'], 'status': status,
+                                                  'attempt': job['attempt']})
+
+    @staticmethod
+    def _view(job):
+        return {
+            'serial': job['serial'],
+            'master': job['master'].get('serial'),
+            'status': job['status'],
+            'attempt': job['attempt'],
+            'expected': job['expected'],
+            'timeout': job['timeout'],
+            'queued_at': job['queued_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'message': job['message'],
+        }
+
+    def _collect_metrics(self):
+        queued = Gauge('rtkrcv_scheduler_queued', "Sessioni in coda nel pianificatore")
+        running = Gauge('rtkrcv_scheduler_running', "Sessioni avviate dal pianificatore ancora in corso")
+        with self._lock:
+            queued.set(len(self._queue))
+            running.set(len(self._running))
+        return [queued, running]
@@ -1,417 +1,802 @@
-import subprocess
 import threading
 import time
+from collections import namedtuple
 import os
 import re
-from datetime import datetime
-import pwd
+import socket
+from datetime import datetime, timedelta
 import os.path
+from concurrent.futures import ThreadPoolExecutor
+
+from archiver import sweep_stale_files
+from batch_writer import BatchFileWriter
+from convergence import ConvergenceEngine, StateTimeline, StopCriteria, format_result
+from events import EventBus
+from health import IN_USE, OK, make_result
+from metrics import REGISTRY, Counter, Gauge, InstrumentedLock
+from pos_reader import Q_FIX, Q_FLOAT, Q_SINGLE, read_file_from, tail_file
+from relay import CorrectionRelay
+from rtcm import MasterPositionCache
+from rtkrcv_config import DEFAULT_PROFILE, RtkrcvConfigEngine
+from supervisor import ProcessSupervisor
+from watcher import SessionWatcher
+
+# Metriche aggregate del manager (per rover: vedi SessionManager._collect_metrics)
+SESSION_STARTS = REGISTRY.counter('rtkrcv_session_starts_total', "Avvii di sessione per esito", ['result'])
+# Secondi: da pochi secondi a mezz'ora
+CONVERGENCE_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800)
+TIME_TO_FLOAT = REGISTRY.histogram('rtkrcv_session_time_to_float_seconds',
+                                   "Tempo dall'avvio alla prima epoca FLOAT", buckets=CONVERGENCE_BUCKETS)
+TIME_TO_FIRST_FIX = REGISTRY.histogram('rtkrcv_session_time_to_first_fix_seconds',
+                                       "Tempo dall'avvio alla prima epoca FIX", buckets=CONVERGENCE_BUCKETS)
+TIME_TO_FIX = REGISTRY.histogram('rtkrcv_session_time_to_fix_seconds',
+                                 "Tempo dall'avvio alla convergenza", buckets=CONVERGENCE_BUCKETS)
+LOCK_WAIT = REGISTRY.histogram('rtkrcv_manager_lock_wait_seconds', "Attesa per acquisire SessionManager.lock")
+LOCK_HOLD = REGISTRY.histogram('rtkrcv_manager_lock_hold_seconds', "Durata del possesso di SessionManager.lock")
+
+class SessionSnapshot(namedtuple('SessionSnapshot', ['serial', 'status', 'rover_coords', 'process', 'start_time'])):
+    """Vista immutabile di una sessione, pubblicata ad ogni modifica.
+
+    Le letture (API) usano solo gli snapshot e non acquisiscono mai il lock.
+    Inviato a un altro processo (worker API, vedi manager_server) lo
+    snapshot perde il riferimento al processo rtkrcv, che non è serializzabile.
+    """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (SessionSnapshot, (self.serial, self.status, self.rover_coords, None, self.start_time))
+
 
 class SessionManager:
-    def __init__(self, rtkrcv_path='rtkrcv'):
+    def __init__(self, rtkrcv_path='rtkrcv', solution_mode='file', archive_solutions=True, max_parallel_starts=8,
+                 stop_criteria=None, config_engine=None, correction_relay=True,
+                 process_limits=None, restart_policy=None, stale_after=600.0, history=None, health=None,
+                 archiver=None):
         self.active_sessions = {}  # serial -> session_info
-        self.lock = threading.Lock()
+        # Lock strumentato: attesa e durata del possesso finiscono in /metrics
+        self.lock = InstrumentedLock(LOCK_WAIT, LOCK_HOLD)
+        # serial -> SessionSnapshot. Il dizionario non viene mai modificato:
+        # ad ogni cambiamento ne viene pubblicata una copia (copy-on-write)
+        self._snapshots = {}
+        self._starting = set()  # Seriali con un avvio in corso
+        # Directory di lavoro di rtkrcv: config/ e output/ sono relative a questa
+        self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        # Pool limitato per gli avvii/arresti in blocco
+        self._launcher = ThreadPoolExecutor(max_workers=max_parallel_starts, thread_name_prefix='rtkrcv-launcher')
+        # Un solo watcher (e un solo thread) per tutte le sessioni
+        self.watcher = SessionWatcher()
+        # 'file': rtkrcv scrive il .pos su disco e il watcher lo rilegge
+        # 'stream': rtkrcv invia le soluzioni a un socket TCP locale del manager
+        if solution_mode not in ('file', 'stream'):
+            raise ValueError(f"Modalità soluzioni non valida: {solution_mode}")
+        self.solution_mode = solution_mode
+        # In streaming le soluzioni possono essere archiviate su disco a blocchi
+        self.solution_writer = BatchFileWriter(on_write=self._on_solution_written) if archive_solutions else None
+        # Eventi di stato, coordinate e output inviati ai client (SSE)
+        self.events = EventBus()
+        # Criteri di convergenza predefiniti (sovrascrivibili per sessione)
+        self.stop_criteria = stop_criteria or StopCriteria()
+        # Profili e override delle configurazioni rtkrcv
+        self.config_engine = config_engine or RtkrcvConfigEngine()
+        # Posizione dei master dagli stream RTCM, condivisa fra le sessioni
+        self.master_positions = MasterPositionCache()
+        # Relay locale: una sola connessione al master condivisa da tutti i rtkrcv
+        self.relay = CorrectionRelay() if correction_relay else None
+        # Avvio dei processi rtkrcv con limiti di risorse, stderr e riavvii
+        self.supervisor = ProcessSupervisor(self.watcher, process_limits, restart_policy)
+        # Le sessioni terminate senza risultato vengono rimosse dopo stale_after secondi
+        self.stale_after = stale_after
+        # Storico persistente delle sessioni (HistoryStore), facoltativo
+        self.history = history
+        # Verifica dei ricevitori prima dell'avvio (HealthProber), facoltativa
+        self.health = health
+        if health is not None and health.busy is None:
+            health.busy = self.device_in_use
+        # Archiviazione compressa delle uscite delle sessioni chiuse (SessionArchiver), facoltativa
+        self.archiver = archiver
+        if archiver is not None:
+            archiver.sweepers.append(self._archive_orphans)
+        self._schedule_cleanup()
+        # Sessioni per stato e metriche dei singoli rover, lette a ogni raccolta
+        REGISTRY.add_collector(self._collect_metrics)
         # Converti in percorso assoluto
         self.rtkrcv_path = os.path.abspath(os.path.expanduser(rtkrcv_path))
-        
-        # Aggiungi debug info
-        print(f"Current working directory: {os.getcwd()}")
-        print(f"Absolute rtkrcv path: {self.rtkrcv_path}")
-        print(f"Path exists: {os.path.exists(self.rtkrcv_path)}")
-        print(f"Is file: {os.path.isfile(self.rtkrcv_path)}")
-        print(f"Has execute permission: {os.access(self.rtkrcv_path, os.X_OK)}")
-        print(f"Effective user: {pwd.getpwuid(os.geteuid()).pw_name}")
     
-    def create_rtkrcv_config(self, rover, master_device_info, master_coords):
-        """Crea il file di configurazione per RTKRCV"""
-        config_content = f"""# RTKRCV Configuration for {rover['name']}
-    # Generated at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-
-    console-passwd     =admin
-    console-timetype   =utc
-    console-soltype    =dms
-    console-solflag    =off
-
-    # OPTIONS 1
-    pos1-posmode       =static-start
-    pos1-frequency     =l1
-    pos1-soltype       =forward
-    pos1-elmask        =15
-    pos1-snrmask_r     =on
-    pos1-snrmask_b     =on
-    pos1-snrmask_L1    =20,20,20,20,20,20,20,20,20
-    pos1-snrmask_L2    =0,0,0,0,0,0,0,0,0
-    pos1-snrmask_L5    =0,0,0,0,0,0,0,0,0
-    pos1-dynamics      =on
-    pos1-tidecorr      =off
-    pos1-ionoopt       =brdc
-    pos1-tropopt       =saas
-    pos1-sateph        =brdc
-    pos1-posopt1       =off
-    pos1-posopt2       =off
-    pos1-posopt3       =off
-    pos1-posopt4       =off
-    pos1-posopt5       =off
-    pos1-exclsats      =
-    pos1-navsys        =13
-
-    # OPTIONS 2
-    pos2-armode        =fix-and-hold
-    pos2-gloarmode     =off
-    pos2-arfilter      =on
-    pos2-bdsarmode     =off
-    pos2-arlockcnt     =0
-    pos2-arthres       =3
-    pos2-arthres1      =0.99
-    pos2-arthres2      =-0.055
-    pos2-arthres3      =1E-7
-    pos2-arthres4      =1E-3
-    pos2-minfixsats    =4
-    pos2-minholdsats   =5
-    pos2-arelmask      =0
-    pos2-aroutcnt      =5
-    pos2-arminfix      =0
-    pos2-armaxiter     =1
-    pos2-elmaskhold    =0
-    pos2-slipthres     =0.05
-    pos2-maxage        =100
-    pos2-syncsol       =off
-    pos2-rejionno      =1000
-    pos2-rejgdop       =30
-    pos2-niter         =1
-    pos2-baselen       =0
-    pos2-basesig       =0
-
-    # OUTPUT DETAILS
-    out-solformat      =llh        # (0:llh,1:xyz,2:enu,3:nmea)
-    out-outhead        =on
-    out-outopt         =off
-    out-timesys        =gpst
-    out-timeform       =hms
-    out-timendec       =3
-    out-degform        =deg
-    out-fieldsep       =
-    out-height         =ellipsoidal
-    out-geoid          =internal
-    out-solstatic      =all
-    out-nmeaintv1      =1
-    out-nmeaintv2      =1
-    out-outstat        =off
-    out-outsingle      =on
-
-    # STATISTICS
-    stats-eratio1      =300
-    stats-eratio2      =100
-    stats-errphase     =0.003
-    stats-errphaseel   =0.003
-    stats-errphasebl   =0
-    stats-errdoppler   =10
-    stats-stdbias      =30
-    stats-stdiono      =0.03
-    stats-stdtrop      =0.3
-    stats-prnaccelh    =1
-    stats-prnaccelv    =1
-    stats-prnbias      =0.0001
-    stats-prniono      =0.001
-    stats-prntrop      =0.0001
-    stats-clkstab      =5e-12
-
-    # ROVER DETAILS
-    ant1-postype       =single
-    ant1-pos1          =
-    ant1-pos2          =
-    ant1-pos3          =
-    ant1-anttype       =
-    ant1-antdele       =0
-    ant1-antdeln       =0
-    ant1-antdelu       =0
-
-    # MASTER DETAILS
-    ant2-postype       =llh # Use LLH for master coordinates
-    ant2-pos1          ={master_coords['lat']}
-    ant2-pos2          ={master_coords['lon']}
-    ant2-pos3          ={master_coords['alt']}
-    ant2-anttype       =
-    ant2-antdele       =0
-    ant2-antdeln       =0
-    ant2-antdelu       =0
-
-    # Input streams
-    inpstr1-type       =tcpcli
-    inpstr2-type       =ntripcli
-    inpstr3-type       =off
-    inpstr1-path       = {rover['ip']}:{rover['port']}
-    inpstr1-format     = rtcm3
-
-    inpstr2-type       =tcpcli
-    inpstr2-path       = {master_device_info['ip']}:{master_device_info['port']} # This should be the master's RTCM stream for corrections
-    inpstr2-format     = rtcm3
-
-    # Output stream
-    outstr1-type       =file
-    outstr1-path       =output/{rover['serial']}.pos
-    outstr1-format     =llh
-
-    misc-timeinterp    =off
-    misc-sbasatsel     =0
-    misc-rnxopt1       =
-    misc-rnxopt2       =
-    file-cmdfile1      =
-    file-cmdfile2      =
-    file-cmdfile3      =
-    """
-        
-        config_path = f"config/{rover['serial']}.conf"
-        with open(config_path, 'w') as f:
-            f.write(config_content)
-        
+    def create_rtkrcv_config(self, rover, master_device_info, master_coords, solution_port=None):
+        """Crea il file di configurazione per RTKRCV
+
+        Le opzioni derivano dal profilo e dagli override della campagna e
+        del rover (vedi rtkrcv_config). Se solution_port è indicata, le soluzioni vengono inviate al socket
+        TCP locale del manager invece che al file output/<serial>.pos.
+        """
+        if solution_port is not None:
+            outstr1_type = 'tcpcli'
+            outstr1_path = f"127.0.0.1:{solution_port}"
+        else:
+            outstr1_type = 'file'
+            outstr1_path = f"output/{rover['serial']}.pos"
+
+        config_content = self.config_engine.render(rover, master_device_info, master_coords, outstr1_type, outstr1_path)
+
+        config_path = os.path.join(self.base_dir, "config", f"{rover['serial']}.conf")
+        # Il file viene riscritto solo se la configurazione è cambiata
+        self.config_engine.write(config_path, config_content)
+
         return config_path
-    
+
     def extract_master_coordinates(self, master):
-        """Estrae le coordinate del master da NMEA (simulato)"""
-        # In un'implementazione reale, qui si connetterebbe al master
-        # e si estrarrebebbero le coordinate reali da NMEA
-        # Per ora simuliamo delle coordinate fisse
-        return {
-            'lat': 45.0641,  # Esempio: Torino
-            'lon': 7.6697,
-            'alt': 239.0
-        }
+        """Coordinate LLH del master dai messaggi RTCM 1005/1006 del suo stream.
+
+        La posizione è letta una sola volta e condivisa fra le sessioni
+        (cache con TTL). Se lo stream non la fornisce si usano le coordinate
+        configurate nel dispositivo (campi facoltativi lat/lon/alt).
+        """
+        position = self.master_positions.get(master['ip'], master['port'])
+        if position is not None:
+            coords = {'lat': position['lat'], 'lon': position['lon'], 'alt': position['alt']}
+            # La posizione appresa entra nella scelta del master più vicino (vedi DeviceRegistry)
+            self.events.publish('master_position', {'serial': master['serial'], **coords})
+            return coords
+        if all(master.get(key) is not None for key in ('lat', 'lon', 'alt')):
+            return {'lat': float(master['lat']), 'lon': float(master['lon']), 'alt': float(master['alt'])}
+        return None
     
-    def start_session(self, rover, master):
-        """Avvia una sessione RTKRCV per un rover"""
+    def start_session(self, rover, master, criteria=None):
+        """Avvia una sessione RTKRCV per un rover
+
+        criteria (StopCriteria) sostituisce i criteri di arresto predefiniti
+        del manager per questa sessione.
+
+        Il lock viene acquisito solo per riservare il seriale e per
+        registrare la sessione: generazione della configurazione e avvio
+        del processo avvengono fuori dal lock, così più avvii possono
+        procedere in parallelo.
+        """
+        serial = rover['serial']
         with self.lock:
-            serial = rover['serial']
-
-            # Controlla se la sessione è già attiva
+            # Controlla se la sessione è già attiva o in avvio
+            if serial in self._starting:
+                return False, "Sessione già in avvio per questo rover"
             if serial in self.active_sessions:
-                if self.active_sessions[serial]['process'].poll() is None:
+                session = self.active_sessions[serial]
+                if session['process'].poll() is None or session['status'] == 'restarting':
                     return False, "Sessione già attiva per questo rover"
+            self._starting.add(serial)
 
-            try:
-                # Crea le directory se non esistono
-                os.makedirs("config", exist_ok=True)
-                os.makedirs("output", exist_ok=True)
-                
-                # Assicurati che il working directory sia quello corretto
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                os.chdir(script_dir)
-
-                # Estrai le coordinate del master (LLH for antenna position)
-                # master_coords are for ant2-pos1, ant2-pos2, ant2-pos3
-                # The RTCM stream for corrections comes from master_device_info['ip']:master_device_info['port'] (inpstr2-path)
-                # However, the requirement is to get master's coordinates from RTCM stream on port 2222.
-                # This implies that the master device itself broadcasts its position via an RTCM message (e.g., type 1005/1006)
-                # For now, extract_master_coordinates will simulate getting these LLH coordinates.
-                # The master_device_info (containing IP/port) is still needed for inpstr2-path which is the correction stream.
-
-                # Let's assume the master device (whose details are in 'master') provides its coordinates
-                # via an RTCM stream accessible on its IP and a specific port (e.g. 2222 as per requirement for master coord acquisition)
-                # For the rtkrcv config, ant2-pos1/2/3 are these coordinates.
-                # inpstr2-path is where rtkrcv connects to get RTCM *correction* messages from the master.
-                # This might be the same IP/port or a different one, depending on the master's setup.
-                # The original code used master['ip']:master['port'] for inpstr2-path.
-                # The requirement says "Use the RTCM stream from port 2222 to obtain the master device’s coordinates."
-                # This is handled by extract_master_coordinates. The result is used for ant2-pos1/2/3.
-                # The inpstr2-path for *corrections* should still point to the master's correction stream output.
-                # We'll keep using master['ip']:master['port'] for inpstr2-path as in the original config logic,
-                # assuming this is where the master outputs RTCM corrections.
-
-                master_llh_coords = self.extract_master_coordinates(master) # master here is master_device_info
-                if not master_llh_coords:
-                    return False, "Impossibile ottenere le coordinate LLH del master."
-
-                # Crea il file di configurazione
-                # Pass rover info, master device info (for IP/port of correction stream), and master LLH coords (for antenna position)
-                config_path = self.create_rtkrcv_config(rover, master, master_llh_coords)
-
-                # Comando per avviare RTKRCV
-                cmd = [self.rtkrcv_path, '-s', '-o', config_path]
-                print(f"Avvio del comando: {' '.join(cmd)}")
-                print(f"Nella directory: {os.getcwd()}")
-
-                # Avvia il processo RTKRCV
-                process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) # stdout e stderr a DEVNULL se non servono
-                output_file_path = os.path.join(script_dir, "output", f"{rover['serial']}.pos")
+        solution_socket = None
+        try:
+            # Rover e master devono rispondere e trasmettere RTCM, altrimenti rtkrcv resterebbe in 'running'
+            if self.health is not None:
+                problem = self.health.check(rover, master)
+                if problem:
+                    SESSION_STARTS.labels('unhealthy').inc()
+                    return False, problem
+
+            # Crea le directory se non esistono
+            os.makedirs(os.path.join(self.base_dir, "config"), exist_ok=True)
+            os.makedirs(os.path.join(self.base_dir, "output"), exist_ok=True)
+
+            # Coordinate del master (ant2-pos*) dai messaggi 1005/1006 del suo stream RTCM;
+            # inpstr2-path continua a puntare allo stesso stream per le correzioni
+            master_llh_coords = self.extract_master_coordinates(master) # master here is master_device_info
+            if not master_llh_coords:
+                SESSION_STARTS.labels('no_master').inc()
+                return False, "Impossibile ottenere le coordinate LLH del master."
+
+            # Le uscite della sessione precedente dello stesso rover vanno in archivio prima di essere sovrascritte
+            with self.lock:
+                previous = self.active_sessions.get(serial)
+                job = self._take_archive(previous, previous['status']) if previous else None
+            self._archive_output(job)
+            self._archive_orphan(serial)
+
+            cmd, solution_socket, output_file_path = self._prepare_launch(rover, master, master_llh_coords)
+
+            # Avvia il processo RTKRCV nella directory del manager (i percorsi nella configurazione sono relativi)
+            handle = self.supervisor.spawn(serial, cmd, cwd=self.base_dir, on_exit=self._on_supervised_exit)
+            process = handle.process
+            convergence = ConvergenceEngine(criteria or self.stop_criteria)
+            history_id = None
+            if self.history is not None:
+                profile = rover.get('profile') or self.config_engine.get_campaign().get('profile') or DEFAULT_PROFILE
+                history_id = self.history.start_session(serial, rover.get('name'), master.get('serial'), profile)
+            start_time = datetime.now()
+            with self.lock:
                 self.active_sessions[serial] = {
+                    'rover': rover,
+                    'master': master,
+                    'master_coords': master_llh_coords,
                     'process': process,
+                    'handle': handle,
+                    'start_time': start_time,
+                    'ended_at': None,
                     'output_file': output_file_path,
                     'rover_coords': None, # Placeholder per le coordinate del rover
-                    'status': 'running' # Stato iniziale
+                    'status': None,
+                    'convergence': convergence,
+                    'timeline': StateTimeline(), # Transizioni single → float → fix
+                    'history_id': history_id,
+                    # Chiave dell'archivio delle uscite; None quando già archiviate
+                    'archive': {'key': f"{serial}-{start_time:%Y%m%dT%H%M%S}", 'history_id': history_id},
+                    'first_float_at': None, # Secondi dall'avvio al primo FLOAT
+                    'first_fix_at': None, # Secondi dall'avvio al primo FIX
+                    'fix_at': None # Secondi dall'avvio alla convergenza
                 }
-                
-                # Avvia un thread per monitorare il file .pos e lo stato del processo
-                threading.Thread(target=self._monitor_pos_file, args=(serial, process, output_file_path), daemon=True).start()
+                self._set_status(serial, 'running') # Stato iniziale (pubblica lo snapshot)
 
-                return True, f"Sessione RTKRCV avviata per {rover['name']}. Monitoraggio del file .pos iniziato."
-            except Exception as e:
-                print(f"Errore durante l'avvio della sessione per {serial}: {e}")
-                return False, f"Errore nell'avvio della sessione: {e}"
+            self._watch_session(serial, process, solution_socket, output_file_path)
+            solution_socket = None  # Ora appartiene al watcher
+            if convergence.criteria.max_duration is not None:
+                self.watcher.call_later(convergence.criteria.max_duration, lambda: self._on_session_timeout(serial, handle))
+
+            SESSION_STARTS.labels('ok').inc()
+            return True, f"Sessione RTKRCV avviata per {rover['name']}. Monitoraggio del file .pos iniziato."
+        except Exception as e:
+            if solution_socket is not None:
+                solution_socket.close()
+            print(f"Errore durante l'avvio della sessione per {serial}: {e}")
+            SESSION_STARTS.labels('error').inc()
+            return False, f"Errore nell'avvio della sessione: {e}"
+        finally:
+            with self.lock:
+                self._starting.discard(serial)
     
+    def _prepare_launch(self, rover, master, master_coords, archive_key=None):
+        """Prepara socket delle soluzioni e configurazione; restituisce (cmd, socket, file .pos).
+
+        Con archive_key (riavvio) il .pos scritto finora viene messo da parte
+        nell'archivio della sessione prima di essere troncato.
+        """
+        solution_socket = None
+        try:
+            # In modalità streaming il manager apre un socket locale su cui rtkrcv invia le soluzioni
+            solution_port = None
+            if self.solution_mode == 'stream':
+                solution_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                solution_socket.bind(('127.0.0.1', 0))
+                solution_socket.listen(1)
+                solution_port = solution_socket.getsockname()[1]
+
+            # Con il relay attivo rtkrcv riceve le correzioni dalla porta locale del relay
+            correction_source = master
+            if self.relay is not None:
+                relay_host, relay_port = self.relay.endpoint(master['ip'], master['port'])
+                correction_source = dict(master, ip=relay_host, port=relay_port)
+
+            # Crea il file di configurazione
+            config_path = self.create_rtkrcv_config(rover, correction_source, master_coords, solution_port)
+        except Exception:
+            if solution_socket is not None:
+                solution_socket.close()
+            raise
+
+        # Comando per avviare RTKRCV
+        cmd = [self.rtkrcv_path, '-s', '-o', config_path]
+        output_file_path = os.path.join(self.base_dir, "output", f"{rover['serial']}.pos")
+        if solution_socket is None:
+            if archive_key is not None and self.archiver is not None:
+                self.archiver.stage(archive_key, output_file_path)
+            # Il watcher legge il file dall'inizio: le epoche di una sessione
+            # precedente verrebbero prese per nuove (rtkrcv lo riscrive comunque)
+            open(output_file_path, 'w').close()
+        return cmd, solution_socket, output_file_path
+
+    def _watch_session(self, serial, process, solution_socket, output_file_path):
+        """Registra la sessione nel watcher condiviso (file .pos o socket, e processo)."""
+        if solution_socket is not None:
+            self.watcher.watch_stream(serial, solution_socket, process, self._handle_epoch, self._on_process_exit, self._on_solution_lines)
+        else:
+            self.watcher.watch(serial, output_file_path, process, self._handle_epoch, self._on_process_exit, self._on_solution_lines)
+
     def stop_session(self, serial):
-        """Ferma una sessione RTKRCV"""
+        """Ferma una sessione RTKRCV
+
+        La sessione viene rimossa dalla tabella sotto lock; l'attesa della
+        terminazione del processo avviene fuori dal lock.
+        """
         with self.lock:
-            if serial not in self.active_sessions:
-                return False, "Nessuna sessione attiva per questo rover"
+            session = self.active_sessions.pop(serial, None)
+            self._publish_snapshot(serial)
+            if session is not None:
+                status = session['status'] if session['status'] in ('fix', 'timeout') else 'stopped'
+                self._record_end(session, status)
+                job = self._take_archive(session, status)
+        if session is None:
+            return False, "Nessuna sessione attiva per questo rover"
+
+        try:
+            self.watcher.unwatch(serial)
             
-            try:
-                session = self.active_sessions[serial]
-                process = session['process']
-                
-                # Termina il processo
-                if process.poll() is None:
-                    process.terminate()
-                    
-                    # Aspetta che il processo termini
-                    try:
-                        process.wait(timeout=5)
-                    except subprocess.TimeoutExpired:
-                        process.kill()
-                        process.wait()
-                
-                # Aggiungi una nota di fine nel file di output
+            # Termina il processo (kill dopo 5 secondi) senza riavviarlo
+            self.supervisor.stop(session['handle'], timeout=5)
+            
+            # Aggiungi una nota di fine nel file di output
+            end_note = f"# Session ended at {datetime.now()}"
+            if self.solution_mode == 'stream':
+                if self.solution_writer:
+                    self.solution_writer.append(session['output_file'], [end_note])
+            else:
                 try:
                     with open(session['output_file'], 'a') as f:
-                        f.write(f"# Session ended at {datetime.now()}\n")
+                        f.write(end_note + "\n")
                 except:
                     pass
-                
-                # Rimuovi la sessione dalla lista
-                del self.active_sessions[serial]
-                
-                return True, f"Sessione fermata per rover {serial}"
-                
+            self._archive_output(job)
+            
+            self.events.publish('status', {'serial': serial, 'status': 'stopped'})
+            return True, f"Sessione fermata per rover {serial}"
+            
+        except Exception as e:
+            return False, f"Errore nel fermare la sessione: {str(e)}"
+
+    def start_sessions(self, pairs, criteria=None):
+        """Avvia più sessioni in parallelo sul pool limitato.
+
+        pairs è una lista di (rover, master). Restituisce un dizionario
+        serial -> {'success': bool, 'message': str}.
+        """
+        if self.health is not None:
+            # Tutti i ricevitori verificati insieme: i singoli avvii trovano il risultato in cache
+            try:
+                self.health.probe_devices([device for pair in pairs for device in pair])
             except Exception as e:
-                return False, f"Errore nel fermare la sessione: {str(e)}"
+                print(f"Errore nella verifica dei dispositivi: {e}")
+        futures = {rover['serial']: self._launcher.submit(self.start_session, rover, master, criteria)
+                   for rover, master in pairs}
+        return self._collect_results(futures)
+
+    def stop_sessions(self, serials):
+        """Ferma più sessioni in parallelo sul pool limitato."""
+        futures = {serial: self._launcher.submit(self.stop_session, serial) for serial in serials}
+        return self._collect_results(futures)
+
+    def _collect_results(self, futures):
+        results = {}
+        for serial, future in futures.items():
+            try:
+                success, message = future.result()
+            except Exception as e:
+                success, message = False, str(e)
+            results[serial] = {'success': success, 'message': message}
+        return results
+
+    def get_active_serials(self):
+        """Seriali delle sessioni con rtkrcv in esecuzione (o in attesa di riavvio)."""
+        return [serial for serial, snap in self._snapshots.items() if self._snapshot_active(snap)]
     
     def is_session_running(self, serial):
         """Controlla se una sessione è in esecuzione"""
-        with self.lock:
-            if serial not in self.active_sessions:
-                return False
-            
-            process = self.active_sessions[serial]['process']
-            return process.poll() is None
+        snap = self._snapshots.get(serial)
+        return snap is not None and self._snapshot_active(snap)
+
+    @staticmethod
+    def _snapshot_active(snap):
+        return snap.process.poll() is None or snap.status == 'restarting'
     
     def get_session_status(self, serial):
         """Ottieni lo stato di una sessione (running/stopped/fix/error)"""
-        with self.lock:
-            if serial in self.active_sessions:
-                return self.active_sessions[serial].get('status', 'stopped')
-            return 'stopped'
+        snap = self._snapshots.get(serial)
+        return snap.status if snap else 'stopped'
 
     def get_rover_coordinates(self, serial):
         """Ottieni le coordinate XYZ del rover se disponibili."""
+        snap = self._snapshots.get(serial)
+        return snap.rover_coords if snap else None
+
+    def get_snapshots(self):
+        """Restituisce la vista corrente (immutabile) di tutte le sessioni."""
+        return self._snapshots
+
+    def _publish_snapshot(self, serial):
+        """Pubblica un nuovo snapshot della sessione (o la sua rimozione).
+
+        Da chiamare con self.lock acquisito. I lettori vedono sempre un
+        dizionario completo e coerente: il riferimento viene sostituito
+        in un'unica assegnazione.
+        """
+        snapshots = dict(self._snapshots)
+        session = self.active_sessions.get(serial)
+        if session is None:
+            snapshots.pop(serial, None)
+        else:
+            snapshots[serial] = SessionSnapshot(
+                serial=serial,
+                status=session['status'],
+                rover_coords=session['rover_coords'],
+                process=session['process'],
+                start_time=session['start_time'],
+            )
+        self._snapshots = snapshots
+
+    def _set_status(self, serial, status):
+        """Aggiorna lo stato della sessione e notifica i client se è cambiato.
+
+        Da chiamare con self.lock acquisito.
+        """
+        session = self.active_sessions.get(serial)
+        if session is None or session['status'] == status:
+            return
+        session['status'] = status
+        self._publish_snapshot(serial)
+        self.events.publish('status', {'serial': serial, 'status': status})
+
+    def _on_solution_lines(self, serial, lines):
+        """Nuove righe di soluzione: in streaming le archivia nel .pos, poi avvisa i client.
+
+        L'evento 'output' indica solo che il .pos della sessione è cresciuto:
+        i client leggono le righe da /output con il proprio cursore, così
+        la console mostra un unico flusso. In streaming l'evento parte a
+        scrittura avvenuta (_on_solution_written).
+        """
+        if self.solution_mode == 'stream' and self.solution_writer:
+            with self.lock:
+                session = self.active_sessions.get(serial)
+                output_file = session['output_file'] if session else None
+            if output_file:
+                self.solution_writer.append(output_file, lines)
+            return
+        self.events.publish('output', {'serial': serial})
+
+    def _on_solution_written(self, path):
+        """Chiamata dal writer dopo aver aggiunto righe a output/<seriale>.pos."""
+        self.events.publish('output', {'serial': os.path.splitext(os.path.basename(path))[0]})
+
+    def _on_process_exit(self, serial):
+        """Chiamata dal watcher quando il processo rtkrcv termina.
+
+        Le ultime soluzioni sono già state lette; lo stato della sessione
+        viene aggiornato da _on_supervised_exit.
+        """
+        print(f"[{serial}] Processo RTKRCV non più attivo. Monitoraggio terminato.")
+
+    def _on_supervised_exit(self, handle, returncode, restart_delay):
+        """Chiamata dal supervisore quando rtkrcv termina (processo già raccolto)."""
+        serial = handle.name
         with self.lock:
-            if serial in self.active_sessions:
-                return self.active_sessions[serial].get('rover_coords')
-            return None
+            session = self.active_sessions.get(serial)
+            if session is None or session['handle'] is not handle:
+                return
+            if restart_delay is not None and session['status'] not in ('fix', 'timeout'):
+                # Terminazione inattesa: riavvio dopo l'attesa decisa dalla politica
+                self._set_status(serial, 'restarting')
+                self.watcher.call_later(restart_delay, lambda: self._launcher.submit(self._restart_session, serial, handle))
+                return
+            session['ended_at'] = time.monotonic()
+            if session['status'] not in ('fix', 'timeout', 'error'):
+                self._set_status(serial, 'stopped' if returncode == 0 or handle.stopping else 'error')
+            self._record_end(session, session['status'])
+
+    def _restart_session(self, serial, handle):
+        """Rigenera configurazione e socket e riavvia rtkrcv per una sessione."""
+        with self.lock:
+            session = self.active_sessions.get(serial)
+            if session is None or session['handle'] is not handle or session['status'] != 'restarting':
+                return
+            rover, master, master_coords = session['rover'], session['master'], session['master_coords']
+            archive_key = session['archive']['key'] if session['archive'] else None
 
-    def _monitor_pos_file(self, serial, process, pos_file_path):
-        """Monitora il file .pos per lo stato 'fix' e estrae le coordinate."""
-        print(f"[{serial}] Monitoraggio del file: {pos_file_path}")
+        solution_socket = None
         try:
-            while process.poll() is None: # Finchè il processo rtkrcv è attivo
-                if not os.path.exists(pos_file_path):
-                    time.sleep(1) # Attendi che il file venga creato
-                    continue
-
-                with open(pos_file_path, 'r') as f:
-                    lines = f.readlines()
-                
-                # Cerca l'ultima riga valida con coordinate e stato
-                # Formato atteso (esempio, può variare): 
-                # YYYY/MM/DD HH:MM:SS.sss    lat(deg)    lon(deg)    height(m) Q=s ...
-                # Q=1 (fix), Q=2 (float), Q=5 (single)
-                # Le coordinate sono solitamente in LLH (lat, lon, height)
-                # Dobbiamo convertirle in XYZ se richiesto dal frontend, ma per ora estraiamo LLH.
-                last_valid_line = None
-                for line in reversed(lines):
-                    if line.startswith('%') or not line.strip(): # Ignora commenti e righe vuote
-                        continue
-                    parts = line.split()
-                    if len(parts) >= 5: # Deve avere almeno data, ora, lat, lon, height, Q
-                        last_valid_line = parts
-                        break
-                
-                if last_valid_line:
-                    try:
-                        # L'indice di Q e delle coordinate dipende dal formato esatto del file .pos
-                        # Questo è un esempio basato su un formato comune.
-                        # Ad esempio, se Q è il 6° elemento (indice 5) e le coordinate sono 2,3,4
-                        q_status = int(last_valid_line[5]) # Assumendo che Q sia il sesto campo
-                        
-                        if q_status == 1: # Stato FIX
-                            lat = float(last_valid_line[2])
-                            lon = float(last_valid_line[3])
-                            alt = float(last_valid_line[4]) # Altezza ellissoidica
-                            
-                            # Qui dovresti convertire LLH in XYZ se necessario.
-                            # Per ora, memorizziamo LLH e simuliamo XYZ.
-                            # La conversione LLH -> XYZ richiede un modello geodetico (es. WGS84)
-                            # e può essere complessa. Usiamo valori fittizi per XYZ.
-                            rover_xyz_coords = {
-                                'x': lon * 100000, # Esempio di trasformazione banale
-                                'y': lat * 100000,
-                                'z': alt * 10
-                            }
-
-                            with self.lock:
-                                if serial in self.active_sessions:
-                                    self.active_sessions[serial]['rover_coords'] = rover_xyz_coords
-                                    self.active_sessions[serial]['status'] = 'fix'
-                            print(f"[{serial}] Stato FIX raggiunto. Coordinate (LLH): {lat}, {lon}, {alt}. XYZ (simulato): {rover_xyz_coords}")
-                            process.terminate() # Termina rtkrcv
-                            try:
-                                process.wait(timeout=5) # Attendi che termini
-                            except subprocess.TimeoutExpired:
-                                process.kill()
-                            print(f"[{serial}] Processo RTKRCV terminato.")
-                            # Pulisci il file .pos dopo aver ottenuto il fix (opzionale)
-                            # if os.path.exists(pos_file_path):
-                            #    os.remove(pos_file_path)
-                            return # Esce dal thread di monitoraggio
-                        elif q_status == 2: # Float
-                             with self.lock:
-                                if serial in self.active_sessions:
-                                    self.active_sessions[serial]['status'] = 'float'
-                        elif q_status == 5: # Single
-                            with self.lock:
-                                if serial in self.active_sessions:
-                                    self.active_sessions[serial]['status'] = 'single'
-                        # Altri stati potrebbero essere gestiti qui
-
-                    except (ValueError, IndexError) as e:
-                        print(f"[{serial}] Errore nel parsing della riga del file .pos: {line.strip()} - {e}")
-                        pass # Ignora righe malformate
-
-                time.sleep(2) # Controlla ogni 2 secondi
-            
-            # Se il loop finisce, il processo rtkrcv si è fermato per qualche motivo
-            with self.lock:
-                if serial in self.active_sessions and self.active_sessions[serial]['status'] not in ['fix', 'error']:
-                    self.active_sessions[serial]['status'] = 'stopped'
-            print(f"[{serial}] Processo RTKRCV non più attivo. Monitoraggio terminato.")
-
+            cmd, solution_socket, output_file_path = self._prepare_launch(rover, master, master_coords, archive_key)
+            if not self.supervisor.respawn(handle, cmd):
+                # Arresto richiesto nel frattempo
+                if solution_socket is not None:
+                    solution_socket.close()
+                return
         except Exception as e:
-            print(f"[{serial}] Errore nel thread di monitoraggio del file .pos: {e}")
+            if solution_socket is not None:
+                solution_socket.close()
+            print(f"[{serial}] Riavvio fallito: {e}")
             with self.lock:
                 if serial in self.active_sessions:
-                    self.active_sessions[serial]['status'] = 'error'
-    
-    def get_session_output(self, serial, lines=20):
-        """Ottieni le ultime righe dell'output NMEA"""
-        output_file = f"output/{serial}.nmea"
-        
-        if not os.path.exists(output_file):
-            return []
+                    self.active_sessions[serial]['ended_at'] = time.monotonic()
+                    self._set_status(serial, 'error')
+                    self._record_end(self.active_sessions[serial], 'error')
+            return
+
+        with self.lock:
+            session = self.active_sessions.get(serial)
+            if session is None or session['handle'] is not handle:
+                # Sessione fermata durante il riavvio
+                self.supervisor.terminate(handle)
+                if solution_socket is not None:
+                    solution_socket.close()
+                return
+            session['process'] = handle.process
+            self._publish_snapshot(serial)
+            self._set_status(serial, 'running')
+        print(f"[{serial}] RTKRCV riavviato (riavvio n. {handle.restarts}).")
+        self._watch_session(serial, handle.process, solution_socket, output_file_path)
+
+    def _handle_epoch(self, serial, epoch):
+        """Aggiorna lo stato della sessione in base a un'epoca del file .pos.
+
+        Chiamata dal watcher per ogni nuova epoca. Le epoche fixed vengono
+        accumulate dal motore di convergenza; restituisce True quando i
+        criteri di arresto sono soddisfatti e l'osservazione può terminare.
+        """
+        q_status = epoch['q']
+
+        with self.lock:
+            session = self.active_sessions.get(serial)
+            if session is None or session['status'] in ('fix', 'timeout'):
+                return True
+            convergence = session['convergence']
+            converged = convergence.add_epoch(epoch)
+            self._record_epoch(session, epoch)
+
+            if converged:
+                session['fix_at'] = self._elapsed(session)
+                TIME_TO_FIX.observe(session['fix_at'])
+                rover_coords = self._final_coordinates(session)
+                self._set_status(serial, 'fix')
+                handle = session['handle']
+            elif q_status == Q_FIX: # Fixed, in attesa dei criteri di arresto
+                self._set_status(serial, 'converging')
+                if convergence.count:
+                    self.events.publish('convergence', {
+                        'serial': serial,
+                        'fixes': convergence.consecutive,
+                        'required': convergence.criteria.min_fixes,
+                        'sigma_3d': convergence.sigma_3d(),
+                    })
+            elif q_status == Q_FLOAT: # Float
+                self._set_status(serial, 'float')
+            elif q_status == Q_SINGLE: # Single
+                self._set_status(serial, 'single')
+            # Altri stati potrebbero essere gestiti qui
+
+        if converged:
+            print(f"[{serial}] Convergenza raggiunta su {rover_coords['fixes']} epoche FIX. "
+                  f"XYZ (ECEF): {rover_coords['x']}, {rover_coords['y']}, {rover_coords['z']}"
+                  f" (sigma 3D {rover_coords.get('sigma_3d')} m)")
+            self.supervisor.terminate(handle)
+            return True
+        return False
+
+    @staticmethod
+    def _elapsed(session):
+        return round((datetime.now() - session['start_time']).total_seconds(), 1)
+
+    def _record_epoch(self, session, epoch):
+        """Registra transizioni di stato, primo FLOAT e primo FIX (metriche, storico) e l'epoca sottocampionata.
+
+        Da chiamare con self.lock acquisito.
+        """
+        history_id = session['history_id']
+        if epoch['q'] != session['timeline'].state:
+            session['timeline'].add(self._elapsed(session), epoch['q'])
+        if epoch['q'] == Q_FLOAT and session['first_float_at'] is None:
+            session['first_float_at'] = self._elapsed(session)
+            TIME_TO_FLOAT.observe(session['first_float_at'])
+        elif epoch['q'] == Q_FIX and session['first_fix_at'] is None:
+            session['first_fix_at'] = self._elapsed(session)
+            TIME_TO_FIRST_FIX.observe(session['first_fix_at'])
+            if history_id is not None:
+                self.history.record_first_fix(history_id, session['first_fix_at'])
+        if history_id is not None:
+            self.history.record_epoch(history_id, epoch)
+
+    def _record_end(self, session, status):
+        """Chiude la sessione nello storico (una sola volta).
+
+        Da chiamare con self.lock acquisito.
+        """
+        history_id = session.get('history_id')
+        if history_id is None:
+            return
+        session['history_id'] = None
+        self.history.end_session(history_id, status, coordinates=session['rover_coords'],
+                                 time_to_fix=session['fix_at'], restarts=session['handle'].restarts,
+                                 time_to_float=session['first_float_at'], timeline=session['timeline'].encode())
+
+    def _take_archive(self, session, status):
+        """Prenota l'archiviazione delle uscite della sessione (una sola volta).
+
+        Da chiamare con self.lock acquisito; restituisce il lavoro da passare
+        a _archive_output fuori dal lock, o None.
+        """
+        archive = session.get('archive')
+        if archive is None or self.archiver is None:
+            return None
+        session['archive'] = None
+        serial = session['rover']['serial']
+        ended_at = datetime.now()
+        if session['ended_at'] is not None:
+            ended_at -= timedelta(seconds=time.monotonic() - session['ended_at'])
+        return {
+            'key': archive['key'],
+            'output_file': session['output_file'],
+            'config_file': os.path.join(self.base_dir, "config", f"{serial}.conf"),
+            'meta': {
+                'serial': serial,
+                'rover': session['rover'].get('name'),
+                'master': session['master'].get('serial'),
+                'status': status,
+                'start_time': session['start_time'].isoformat(),
+                'end_time': ended_at.isoformat(),
+                'history_id': archive['history_id'],
+                'coordinates': session['rover_coords'],
+                'time_to_fix': session['fix_at'],
+            },
+        }
+
+    def _archive_output(self, job):
+        """Sposta .pos e copia della configurazione nell'archivio; la compressione avviene in background."""
+        if job is None:
+            return
+        try:
+            if self.solution_mode == 'stream' and self.solution_writer:
+                self.solution_writer.flush(timeout=10)
+            self.archiver.stage(job['key'], job['output_file'])
+            self.archiver.stage(job['key'], job['config_file'], copy=True)
+            self.archiver.seal(job['key'], job['meta'])
+        except OSError as e:
+            print(f"Errore nell'archiviazione di {job['key']}: {e}")
+
+    def _archive_orphan(self, serial):
+        """Archivia il .pos di serial rimasto senza sessione (es. da un'esecuzione precedente)."""
+        if self.archiver is None:
+            return
+        output_file = os.path.join(self.base_dir, "output", f"{serial}.pos")
+        try:
+            mtime = datetime.fromtimestamp(os.path.getmtime(output_file))
+            key = f"{serial}-{mtime:%Y%m%dT%H%M%S}"
+            if self.archiver.stage(key, output_file):
+                self.archiver.seal(key, {'serial': serial, 'status': None, 'end_time': mtime.isoformat()})
+        except OSError:
+            pass
+
+    def _archive_orphans(self):
+        """Chiamata dall'archiviatore: .pos dei rover senza sessione e configurazioni inutilizzate."""
+        try:
+            names = os.listdir(os.path.join(self.base_dir, "output"))
+        except FileNotFoundError:
+            names = []
+        with self.lock:
+            # Sotto lock: un avvio non può troncare il file mentre viene spostato
+            busy = set(self.active_sessions) | self._starting
+            for name in names:
+                if name.endswith('.pos') and name[:-4] not in busy:
+                    self._archive_orphan(name[:-4])
+            if self.archiver.retention_days is not None:
+                sweep_stale_files(os.path.join(self.base_dir, "config"), self.archiver.retention_days, busy)
+
+    def _on_session_timeout(self, serial, handle):
+        """Durata massima raggiunta senza convergenza: pubblica la media parziale e ferma rtkrcv."""
+        with self.lock:
+            session = self.active_sessions.get(serial)
+            if session is None or session['handle'] is not handle or session['status'] in ('fix', 'timeout'):
+                return
+            rover_coords = self._final_coordinates(session)
+            self._set_status(serial, 'timeout')
+        print(f"[{serial}] Durata massima raggiunta senza convergenza"
+              f" ({rover_coords['fixes'] if rover_coords else 0} epoche FIX accettate).")
+        self.supervisor.terminate(handle)
+
+    def _final_coordinates(self, session):
+        """Pubblica la coordinata media della sessione con la sua incertezza.
+
+        Da chiamare con self.lock acquisito.
+        """
+        # Baseline rispetto al master (ENU)
+        rover_coords = format_result(session['convergence'].result(), session.get('master_coords'))
+        if rover_coords is None:
+            return None
+        serial = session['rover']['serial']
+        session['rover_coords'] = rover_coords
+        self._publish_snapshot(serial)
+        self.events.publish('coordinates', {'serial': serial, 'coordinates': rover_coords})
+        return rover_coords
+
+    def get_process_info(self, serial):
+        """Stato del processo supervisionato (pid, riavvii, codice di uscita) e ultime righe di stderr."""
+        with self.lock:
+            session = self.active_sessions.get(serial)
+            handle = session['handle'] if session else None
+        if handle is None:
+            return None
+        info = handle.info()
+        info['stderr'] = handle.stderr.lines()
+        return info
+
+    def get_session_timeline(self, serial):
+        """Transizioni di stato della sessione (secondi dall'avvio) e tempi al primo FLOAT, primo FIX e fix."""
+        with self.lock:
+            session = self.active_sessions.get(serial)
+            if session is None:
+                return None
+            timeline = session['timeline']
+            return {
+                'serial': serial,
+                'status': session['status'],
+                'elapsed': self._elapsed(session),
+                'first_float_at': session['first_float_at'],
+                'first_fix_at': session['first_fix_at'],
+                'fix_at': session['fix_at'],
+                'transitions': timeline.to_list(),
+                'dropped': timeline.dropped,
+            }
+
+    def get_session_output(self, serial, lines=20, after=None):
+        """Ottieni le righe del file delle soluzioni (.pos) della sessione
+
+        Senza after restituisce le ultime righe (lette a ritroso dalla fine
+        del file); con after (offset restituito dalla chiamata precedente)
+        solo le righe scritte da allora. Restituisce un dizionario con
+        output, offset (cursore per la prossima chiamata) e reset (file
+        troncato o sostituito: il client deve ripartire da capo).
+        """
+        output_file = self._session_output_path(serial)
         
         try:
-            with open(output_file, 'r') as f:
-                all_lines = f.readlines()
-                return [line.strip() for line in all_lines[-lines:]]
+            if after is None:
+                output, offset = tail_file(output_file, lines)
+                reset = False
+            else:
+                output, offset, reset = read_file_from(output_file, after)
+        except FileNotFoundError:
+            return {'output': [], 'offset': 0, 'reset': after is not None and after > 0}
         except Exception as e:
-            return [f"Errore nella lettura del file: {str(e)}"]
+            return {'output': [f"Errore nella lettura del file: {str(e)}"], 'offset': after or 0, 'reset': False}
+        return {'output': output, 'offset': offset, 'reset': reset}
+
+    def get_session_output_version(self, serial):
+        """Identifica il contenuto corrente dell'output (inode, dimensione, mtime), o None."""
+        try:
+            st = os.stat(self._session_output_path(serial))
+        except OSError:
+            return None
+        return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    def device_in_use(self, device):
+        """Stato di un ricevitore già collegato (sessione attiva o relay), senza aprire connessioni; None altrimenti."""
+        if device.get('role') == 'Rover' and self.is_session_running(device['serial']):
+            return make_result(device, IN_USE, source='session')
+        if device.get('role') == 'Master' and self.relay is not None:
+            endpoint = f"{device['ip']}:{int(device['port'])}"
+            for upstream in self.relay.stats():
+                if upstream['master'] != endpoint or not upstream['connected']:
+                    continue
+                age = upstream['last_data_age']
+                if age is not None and age < self.health.timeout:
+                    return make_result(device, OK, source='relay', rate_in=upstream['rate_in'])
+        return None
+
+    def _collect_metrics(self):
+        """Metriche lette al momento della raccolta: sessioni per stato, rover e processi rtkrcv."""
+        by_status = Gauge('rtkrcv_sessions', "Sessioni per stato", ['status'])
+        active = Gauge('rtkrcv_sessions_active', "Sessioni con rtkrcv in esecuzione")
+        time_to_float = Gauge('rtkrcv_rover_time_to_float_seconds', "Tempo dall'avvio al primo FLOAT", ['serial'])
+        time_to_fix = Gauge('rtkrcv_rover_time_to_fix_seconds', "Tempo dall'avvio alla convergenza", ['serial'])
+        fixes = Gauge('rtkrcv_rover_fixes', "Epoche FIX accettate dal motore di convergenza", ['serial'])
+        restarts = Counter('rtkrcv_rover_restarts_total', "Riavvii di rtkrcv nella sessione", ['serial'])
+        cpu = Counter('rtkrcv_process_cpu_seconds_total', "CPU (utente + sistema) del processo rtkrcv", ['serial'])
+        rss = Gauge('rtkrcv_process_resident_memory_bytes', "Memoria residente del processo rtkrcv", ['serial'])
+
+        snapshots = self._snapshots
+        for snap in snapshots.values():
+            by_status.labels(snap.status or 'unknown').inc()
+        active.set(sum(1 for snap in snapshots.values() if self._snapshot_active(snap)))
+
+        with self.lock:
+            sessions = list(self.active_sessions.items())
+        for serial, session in sessions:
+            if session['first_float_at'] is not None:
+                time_to_float.labels(serial).set(session['first_float_at'])
+            if session['fix_at'] is not None:
+                time_to_fix.labels(serial).set(session['fix_at'])
+            fixes.labels(serial).set(session['convergence'].count)
+            restarts.labels(serial).set(session['handle'].restarts)
+            usage = session['handle'].resource_usage()
+            if usage is not None:
+                cpu.labels(serial).set(usage[0])
+                rss.labels(serial).set(usage[1])
+        return [by_status, active, time_to_float, time_to_fix, fixes, restarts, cpu, rss]
+
+    def _session_output_path(self, serial):
+        # Lo stesso file letto dal watcher (o scritto dal writer in streaming)
+        return os.path.join(self.base_dir, "output", f"{serial}.pos")
     
     def get_all_sessions_status(self):
         """Ottieni lo stato di tutte le sessioni attive"""
@@ -426,23 +811,46 @@ class SessionManager:
                 }
             return status
     
-    def cleanup_stopped_sessions(self):
-        """Pulisce le sessioni terminate dalla lista"""
+    def cleanup_stopped_sessions(self, max_age=0, keep_results=False):
+        """Pulisce le sessioni terminate dalla lista
+
+        Vengono rimosse le sessioni terminate da almeno max_age secondi;
+        con keep_results restano quelle con una coordinata (fix, timeout).
+        """
+        now = time.monotonic()
         with self.lock:
             stopped_sessions = []
             for serial, session in self.active_sessions.items():
-                if session['process'].poll() is not None:
+                if session['process'].poll() is None or session['status'] == 'restarting':
+                    continue
+                if keep_results and session['status'] in ('fix', 'timeout'):
+                    continue
+                ended_at = session.get('ended_at')
+                if ended_at is None or now - ended_at >= max_age:
                     stopped_sessions.append(serial)
             
+            jobs = []
             for serial in stopped_sessions:
-                del self.active_sessions[serial]
-
-manager = SessionManager(rtkrcv_path='./rtkrcv')
-
-
-# Ottieni il percorso assoluto dello script corrente
-script_dir = os.path.dirname(os.path.abspath(__file__))
-rtkrcv_path = os.path.join(script_dir, 'rtklib', 'rtkrcv')
-
-# Inizializza il manager con il percorso assoluto
-manager = SessionManager(rtkrcv_path=rtkrcv_path)
+                session = self.active_sessions.pop(serial)
+                jobs.append(self._take_archive(session, session['status']))
+                self._publish_snapshot(serial)
+        for job in jobs:
+            self._archive_output(job)
+        return stopped_sessions
+
+    def _schedule_cleanup(self):
+        # La pulizia (con flush del writer e archiviazione) gira nel pool di
+        # avvio: sul thread del watcher fermerebbe le letture di tutte le sessioni
+        self.watcher.call_later(60, lambda: self._launcher.submit(self._periodic_cleanup))
+
+    def _periodic_cleanup(self):
+        """Rimuove periodicamente le sessioni terminate senza risultato."""
+        try:
+            removed = self.cleanup_stopped_sessions(max_age=self.stale_after, keep_results=True)
+            if removed:
+                print(f"Sessioni terminate rimosse: {', '.join(removed)}")
+                self.events.publish('devices', {})
+        except Exception as e:
+            print(f"Errore nella pulizia delle sessioni terminate: {e}")
+        finally:
+            self._schedule_cleanup()
@@ -0,0 +1,66 @@
+"""Indice spaziale dei punti (master) per la ricerca del più vicino.
+
+I punti sono posizioni WGS84 convertite in ECEF: la distanza euclidea
+fra due punti ECEF (corda) cresce con la distanza sull'ellissoide, quindi
+il più vicino in ECEF è anche il più vicino in superficie. Il k-d tree
+viene costruito una volta e interrogato in O(log n).
+"""
+import math
+
+from geodesy import llh_to_ecef
+
+
+class _Node:
+    __slots__ = ('point', 'item', 'axis', 'left', 'right')
+
+    def __init__(self, point, item, axis, left, right):
+        self.point = point
+        self.item = item
+        self.axis = axis
+        self.left = left
+        self.right = right
+
+
+class PointIndex:
+    """k-d tree statico su posizioni (lat, lon, alt); item è l'oggetto associato al punto."""
+
+    def __init__(self, entries=()):
+        points = [(llh_to_ecef(lat, lon, alt), item) for (lat, lon, alt), item in entries]
+        self.size = len(points)
+        self._root = self._build(points, 0)
+
+    def __len__(self):
+        return self.size
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda entry: entry[0][axis])
+        middle = len(points) // 2
+        point, item = points[middle]
+        return _Node(point, item, axis,
+                     self._build(points[:middle], depth + 1),
+                     self._build(points[middle + 1:], depth + 1))
+
+    def nearest(self, lat, lon, alt=0.0):
+        """(item, distanza in metri) del punto più vicino, o None se l'indice è vuoto."""
+        if self._root is None:
+            return None
+        target = llh_to_ecef(lat, lon, alt)
+        best = [None, math.inf]  # nodo, distanza al quadrato
+        # (nodo, distanza al quadrato dal piano di separazione che lo ha aperto)
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, plane_distance = stack.pop()
+            if node is None or plane_distance >= best[1]:
+                continue
+            distance = sum((a - b) ** 2 for a, b in zip(node.point, target))
+            if distance < best[1]:
+                best = [node, distance]
+            delta = target[node.axis] - node.point[node.axis]
+            near, far = (node.left, node.right) if delta < 0 else (node.right, node.left)
+            # Il ramo lontano serve solo se il piano è più vicino del migliore trovato
+            stack.append((far, delta * delta))
+            stack.append((near, 0.0))
+        return best[0].item, math.sqrt(best[1])
@@ -1,7 +1,19 @@
 // Variabili globali
 let devices = [];
 let isEditing = false;
-let outputUpdateInterval = null;
+let eventSource = null;
+
+// Numero massimo di righe mantenute nella console di output
+const MAX_OUTPUT_LINES = 200;
+
+// Cursore (offset in byte) dell'output già mostrato: { serial, offset }
+let outputCursor = null;
+// Lettura dell'output in corso, e nuova lettura richiesta nel frattempo
+let outputLoading = false;
+let outputReloadPending = false;
+
+// Stati in cui la sessione RTKRCV è attiva
+const ACTIVE_STATUSES = ['running', 'single', 'float', 'converging', 'restarting'];
 
 // Inizializzazione dell'applicazione
 document.addEventListener('DOMContentLoaded', function() {
@@ -10,10 +22,66 @@ document.addEventListener('DOMContentLoaded', function() {
     // Setup form submit
     document.getElementById('deviceForm').addEventListener('submit', handleFormSubmit);
     
-    // Auto-refresh ogni 5 secondi per gli stati delle sessioni
-    setInterval(loadDevices, 5000);
+    // Aggiornamenti in tempo reale dal server (SSE)
+    connectEvents();
 });
 
+// Sessione attiva (rtkrcv in esecuzione)?
+function isSessionActive(status) {
+    return ACTIVE_STATUSES.includes(status);
+}
+
+// Connessione allo stream di eventi del server
+function connectEvents() {
+    if (!window.EventSource) {
+        // Browser senza supporto SSE: torna al polling periodico
+        setInterval(loadDevices, 5000);
+        // Solo le righe nuove dell'output, tramite il cursore
+        setInterval(refreshSessionOutput, 2000);
+        return;
+    }
+    
+    eventSource = new EventSource('/api/events');
+    
+    // Alla (ri)connessione, o se il server lo richiede, ricarica lo stato completo
+    eventSource.addEventListener('open', loadDevices);
+    eventSource.addEventListener('resync', loadDevices);
+    eventSource.addEventListener('devices', loadDevices);
+    
+    eventSource.addEventListener('status', function(e) {
+        const data = JSON.parse(e.data);
+        patchDevice(data.serial, { session_status: data.status });
+    });
+    
+    eventSource.addEventListener('coordinates', function(e) {
+        const data = JSON.parse(e.data);
+        patchDevice(data.serial, { coordinates: data.coordinates });
+    });
+    
+    eventSource.addEventListener('convergence', function(e) {
+        const data = JSON.parse(e.data);
+        patchDevice(data.serial, { convergence: data });
+    });
+    
+    // Il .pos di una sessione è cresciuto: le righe nuove si leggono con il cursore
+    eventSource.addEventListener('output', function(e) {
+        const data = JSON.parse(e.data);
+        if (data.serial === document.getElementById('outputDeviceSelect').value) {
+            refreshSessionOutput();
+        }
+    });
+}
+
+// Applica una variazione ricevuta dal server a un dispositivo
+function patchDevice(serial, changes) {
+    const device = devices.find(d => d.serial === serial);
+    if (!device) return;
+    
+    Object.assign(device, changes);
+    updateDevicesTable();
+    updateOutputDeviceSelect();
+}
+
 // Gestione del submit del form
 function handleFormSubmit(e) {
     e.preventDefault();
@@ -90,10 +158,13 @@ function updateDevicesTable() {
         
         if (device.role === 'Rover') {
             const status = device.session_status || 'stopped';
-            const statusClass = status === 'running' ? 'status-running' : 'status-stopped';
+            const statusClass = isSessionActive(status) ? 'status-running' : 'status-stopped';
             statusBadge = `<span class="status-badge ${statusClass}">${status}</span>`;
+            if (status === 'converging' && device.convergence) {
+                statusBadge += ` <small>${device.convergence.fixes}/${device.convergence.required}</small>`;
+            }
             
-            if (status === 'running') {
+            if (isSessionActive(status)) {
                 sessionActions = `
                     <button class="btn-danger btn-small" onclick="stopSession('${device.serial}')" title="Ferma sessione">
                         ⏹️ Stop
@@ -114,10 +185,10 @@ function updateDevicesTable() {
             <tr>
                 <td>${escapeHtml(device.name)}</td>
                 <td><code>${escapeHtml(device.serial)}</code></td>
-                <td>${escapeHtml(device.ip)}:${device.port}</td>
-                <td><span class="${roleClass}">${device.role}</span></td>
+                <td>${escapeHtml(device.ip)}:${device.port} ${healthIndicator(device.health)}</td>
+                <td><span class="${roleClass}">${device.role}</span>${masterLabel(device.master)}</td>
                 <td>${statusBadge}</td>
-                <td>${escapeHtml(device.coordinates?.x ?? 'N/A')}</td>
+                <td title="${coordinatesTitle(device.coordinates)}">${escapeHtml(device.coordinates?.x ?? 'N/A')}</td>
                 <td>${escapeHtml(device.coordinates?.y ?? 'N/A')}</td>
                 <td>${escapeHtml(device.coordinates?.z ?? 'N/A')}</td>
                 <td>
@@ -134,6 +205,34 @@ function updateDevicesTable() {
     }).join('');
 }
 
+// Master assegnato al rover (il più vicino) con la lunghezza della baseline
+function masterLabel(master) {
+    if (!master) {
+        return '';
+    }
+    const distance = master.distance === null ? '' : ` (${(master.distance / 1000).toFixed(1)} km)`;
+    return `<br><small>→ ${escapeHtml(master.name)}${distance}</small>`;
+}
+
+// Esito dell'ultima verifica del ricevitore (raggiungibilità e dati RTCM)
+function healthIndicator(health) {
+    if (!health) {
+        return '';
+    }
+    const symbols = { ok: '🟢', in_use: '🟢', silent: '🟡', unreachable: '🔴' };
+    const title = health.error ? `${health.status}: ${health.error}` : health.status;
+    return `<span title="${escapeHtml(title).replace(/"/g, '&quot;')}">${symbols[health.status] || '⚪'}</span>`;
+}
+
+// Incertezza della coordinata media (tooltip)
+function coordinatesTitle(coordinates) {
+    if (!coordinates || coordinates.sigma_e === undefined) {
+        return '';
+    }
+    return `Media di ${coordinates.fixes} epoche FIX - sigma E/N/U: ` +
+        `${coordinates.sigma_e} / ${coordinates.sigma_n} / ${coordinates.sigma_u} m`;
+}
+
 // Aggiorna la select per l'output delle sessioni
 function updateOutputDeviceSelect() {
     const select = document.getElementById('outputDeviceSelect');
@@ -148,7 +247,7 @@ function updateOutputDeviceSelect() {
         option.value = rover.serial;
         option.textContent = `${rover.name} (${rover.serial})`;
         
-        if (rover.session_status === 'running') {
+        if (isSessionActive(rover.session_status)) {
             option.textContent += ' - 🟢 Attivo';
         } else {
             option.textContent += ' - 🔴 Fermo';
@@ -335,34 +434,42 @@ async function stopSession(serial) {
 }
 
 // Carica l'output di una sessione
+// Alla prima richiesta per un rover vengono caricate le ultime righe; le
+// successive chiedono solo le righe scritte dopo il cursore
 async function loadSessionOutput() {
     const select = document.getElementById('outputDeviceSelect');
     const serial = select.value;
     const console = document.getElementById('outputConsole');
     
     if (!serial) {
+        outputCursor = null;
         console.innerHTML = `
             <div style="text-align: center; color: #7f8c8d;">
-                Seleziona un rover per visualizzare l'output NMEA
+                Seleziona un rover per visualizzare l'output
             </div>
         `;
-        
-        // Ferma l'auto-refresh se attivo
-        if (outputUpdateInterval) {
-            clearInterval(outputUpdateInterval);
-            outputUpdateInterval = null;
-        }
         return;
     }
     
+    const incremental = outputCursor !== null && outputCursor.serial === serial;
+    const url = incremental
+        ? `/api/sessions/${serial}/output?after=${outputCursor.offset}`
+        : `/api/sessions/${serial}/output`;
+    
     try {
-        const response = await fetch(`/api/sessions/${serial}/output`);
+        // no-cache: il browser rivalida con If-None-Match (304 se il file non è cambiato)
+        const response = await fetch(url, { cache: 'no-cache' });
         const data = await response.json();
         
+        if (select.value !== serial) return; // Rover cambiato nel frattempo
+        
         if (response.ok) {
             const output = data.output || [];
+            outputCursor = { serial: serial, offset: data.offset || 0 };
             
-            if (output.length === 0) {
+            if (incremental && !data.reset) {
+                appendSessionOutput(serial, output);
+            } else if (output.length === 0) {
                 console.innerHTML = `
                     <div style="text-align: center; color: #7f8c8d;">
                         Nessun output disponibile per questo rover
@@ -376,19 +483,7 @@ async function loadSessionOutput() {
                 // Scroll automaticamente in basso
                 console.scrollTop = console.scrollHeight;
             }
-            
-            // Avvia l'auto-refresh se la sessione è attiva
-            const device = devices.find(d => d.serial === serial);
-            if (device && device.session_status === 'running') {
-                if (!outputUpdateInterval) {
-                    outputUpdateInterval = setInterval(loadSessionOutput, 2000);
-                }
-            } else {
-                if (outputUpdateInterval) {
-                    clearInterval(outputUpdateInterval);
-                    outputUpdateInterval = null;
-                }
-            }
+            // Le righe successive si leggono a ogni evento 'output' (o a ogni giro di polling)
             
         } else {
             console.innerHTML = `
@@ -406,6 +501,50 @@ async function loadSessionOutput() {
     }
 }
 
+// Una sola lettura dell'output alla volta: con due richieste dallo stesso
+// cursore le righe comparirebbero due volte. Gli aggiornamenti richiesti
+// nel frattempo si riducono a una sola lettura successiva
+async function refreshSessionOutput() {
+    if (outputLoading) {
+        outputReloadPending = true;
+        return;
+    }
+    outputLoading = true;
+    try {
+        do {
+            outputReloadPending = false;
+            await loadSessionOutput();
+        } while (outputReloadPending);
+    } finally {
+        outputLoading = false;
+    }
+}
+
+// Aggiunge in coda le nuove righe di output ricevute dal server
+function appendSessionOutput(serial, lines) {
+    const select = document.getElementById('outputDeviceSelect');
+    if (select.value !== serial || !lines || lines.length === 0) return;
+    
+    const console = document.getElementById('outputConsole');
+    
+    // Rimuovi il messaggio "nessun output" se presente
+    if (!console.querySelector('.output-line')) {
+        console.innerHTML = '';
+    }
+    
+    console.insertAdjacentHTML('beforeend', lines.map(line =>
+        `<div class="output-line">${escapeHtml(line)}</div>`
+    ).join(''));
+    
+    // Mantieni solo le ultime righe
+    const rendered = console.querySelectorAll('.output-line');
+    for (let i = 0; i < rendered.length - MAX_OUTPUT_LINES; i++) {
+        rendered[i].remove();
+    }
+    
+    console.scrollTop = console.scrollHeight;
+}
+
 // Utility function per escape HTML
 function escapeHtml(text) {
     const div = document.createElement('div');
@@ -415,7 +554,7 @@ function escapeHtml(text) {
 
 // Cleanup quando la pagina viene chiusa
 window.addEventListener('beforeunload', function() {
-    if (outputUpdateInterval) {
-        clearInterval(outputUpdateInterval);
+    if (eventSource) {
+        eventSource.close();
     }
 });
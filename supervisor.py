@@ -0,0 +1,260 @@
+"""Supervisione dei processi figli (rtkrcv).
+
+Il supervisore avvia i processi con limiti di risorse (nice, affinità CPU,
+rlimit), ne cattura lo stderr in un buffer circolare, li raccoglie appena
+terminano (pidfd tramite il SessionWatcher, niente zombie) e decide se e
+dopo quanto riavviarli secondo una RestartPolicy.
+"""
+import collections
+import itertools
+import os
+import resource
+import subprocess
+import threading
+import time
+
+# Unità di /proc/<pid>/stat (tick di CPU) e /proc/<pid>/statm (pagine)
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = resource.getpagesize()
+
+
+class ProcessLimits:
+    """Limiti applicati a ogni processo avviato.
+
+    - nice: incremento di niceness (None = invariato)
+    - cpu_affinity: None, lista di CPU, oppure 'spread' per assegnare a
+      ogni processo una CPU diversa a rotazione
+    - rlimits: dizionario nome -> valore, es. {'RLIMIT_AS': 512 * 2**20}
+      (il valore è usato sia come limite soft che hard)
+
+    I limiti vengono applicati dal processo padre subito dopo l'avvio
+    (setpriority, sched_setaffinity, prlimit), senza preexec_fn, che non
+    è sicura in un processo con più thread.
+    """
+
+    def __init__(self, nice=None, cpu_affinity=None, rlimits=None):
+        self.nice = nice
+        self.cpu_affinity = cpu_affinity
+        self.rlimits = {}
+        for name, value in (rlimits or {}).items():
+            if not hasattr(resource, name):
+                raise ValueError(f"Limite di risorsa sconosciuto: {name}")
+            self.rlimits[name] = int(value)
+        self._next_cpu = itertools.count()
+
+    def apply(self, pid):
+        """Applica i limiti al processo pid. Gli errori vengono solo segnalati."""
+        try:
+            if self.nice:
+                current = os.getpriority(os.PRIO_PROCESS, pid)
+                os.setpriority(os.PRIO_PROCESS, pid, min(19, current + self.nice))
+            cpus = self._cpus_for_next()
+            if cpus:
+                os.sched_setaffinity(pid, cpus)
+            for name, value in self.rlimits.items():
+                resource.prlimit(pid, getattr(resource, name), (value, value))
+        except (OSError, AttributeError, ValueError) as e:
+            print(f"Impossibile applicare i limiti al processo {pid}: {e}")
+
+    def _cpus_for_next(self):
+        if self.cpu_affinity is None or not hasattr(os, 'sched_getaffinity'):
+            return None
+        if self.cpu_affinity == 'spread':
+            available = sorted(os.sched_getaffinity(0))
+            return {available[next(self._next_cpu) % len(available)]}
+        return set(self.cpu_affinity)
+
+
+class RestartPolicy:
+    """Politica di riavvio dei processi terminati inaspettatamente.
+
+    - mode: 'never', 'on-failure' (codice di uscita diverso da 0) o 'always'
+    - max_restarts: riavvii consecutivi oltre i quali il processo è 'failed'
+    - backoff / max_backoff: attesa iniziale e massima (s), raddoppiata ad
+      ogni riavvio consecutivo
+    - reset_after: un processo rimasto attivo almeno questi secondi azzera
+      il conteggio dei riavvii consecutivi
+    """
+
+    MODES = ('never', 'on-failure', 'always')
+
+    def __init__(self, mode='on-failure', max_restarts=5, backoff=1.0, max_backoff=60.0, reset_after=300.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Politica di riavvio non valida: {mode}")
+        self.mode = mode
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reset_after = reset_after
+
+    def restart_delay(self, returncode, consecutive_restarts):
+        """Attesa prima del prossimo riavvio, o None se non va riavviato."""
+        if self.mode == 'never' or (self.mode == 'on-failure' and returncode == 0):
+            return None
+        if consecutive_restarts >= self.max_restarts:
+            return None
+        return min(self.max_backoff, self.backoff * (2 ** consecutive_restarts))
+
+
+class StderrBuffer:
+    """Ultime righe scritte da un processo su stderr (buffer circolare)."""
+
+    def __init__(self, max_lines=200, max_line_length=1024):
+        self.max_line_length = max_line_length
+        self._lines = collections.deque(maxlen=max_lines)
+        self._partial = b''
+        self._lock = threading.Lock()
+
+    def feed(self, data):
+        with self._lock:
+            data = self._partial + data
+            *lines, self._partial = data.split(b'\n')
+            # Una riga senza fine non deve far crescere il buffer
+            self._partial = self._partial[-self.max_line_length:]
+            for line in lines:
+                self._lines.append(line[:self.max_line_length].decode('utf-8', 'replace').rstrip('\r'))
+
+    def lines(self):
+        with self._lock:
+            lines = list(self._lines)
+            if self._partial:
+                lines.append(self._partial.decode('utf-8', 'replace'))
+            return lines
+
+
+class SupervisedProcess:
+    """Processo sotto supervisione. Sopravvive ai riavvii: process cambia."""
+
+    def __init__(self, name, cmd, cwd, on_exit, stderr_lines):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.on_exit = on_exit
+        self.process = None
+        self.started_at = None
+        self.restarts = 0  # Riavvii totali
+        self.consecutive_restarts = 0
+        self.returncode = None
+        self.stopping = False  # Arresto richiesto: niente riavvio
+        self.state = 'starting'  # running, backoff, exited, failed, stopped
+        self.stderr = StderrBuffer(stderr_lines)
+
+    def info(self):
+        return {
+            'name': self.name,
+            'pid': self.process.pid if self.process else None,
+            'state': self.state,
+            'restarts': self.restarts,
+            'returncode': self.returncode,
+            'uptime': round(time.monotonic() - self.started_at, 1) if self.started_at and self.state == 'running' else None,
+        }
+
+    def resource_usage(self):
+        """(secondi di CPU, RSS in byte) del processo attivo, da /proc; None se non disponibile."""
+        if self.process is None or self.process.returncode is not None:
+            return None
+        try:
+            with open(f'/proc/{self.process.pid}/stat') as f:
+                # Il nome del processo (campo 2) può contenere spazi: si parte dopo ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{self.process.pid}/statm') as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+        # utime e stime sono i campi 14 e 15 di stat (11 e 12 dopo il nome)
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+        return cpu_seconds, resident_pages * _PAGE_SIZE
+
+
+class ProcessSupervisor:
+    """Avvia e sorveglia i processi figli.
+
+    on_exit(handle, returncode, restart_delay) viene chiamata (nel thread
+    del watcher) quando il processo termina: restart_delay è l'attesa
+    decisa dalla politica prima del riavvio, oppure None se il processo
+    non verrà riavviato. Il riavvio vero e proprio è eseguito da chi ha
+    avviato il processo con respawn(), che può rigenerare comando e
+    configurazione.
+    """
+
+    def __init__(self, watcher, limits=None, policy=None, stderr_lines=200):
+        self.watcher = watcher
+        self.limits = limits or ProcessLimits()
+        self.policy = policy or RestartPolicy()
+        self.stderr_lines = stderr_lines
+
+    def spawn(self, name, cmd, cwd=None, on_exit=None):
+        """Avvia un nuovo processo supervisionato e ne restituisce l'handle."""
+        handle = SupervisedProcess(name, cmd, cwd, on_exit, self.stderr_lines)
+        self._start(handle)
+        return handle
+
+    def respawn(self, handle, cmd=None):
+        """Riavvia il processo di un handle (dopo l'attesa indicata in on_exit)."""
+        if handle.stopping:
+            return False
+        if cmd is not None:
+            handle.cmd = cmd
+        handle.restarts += 1
+        handle.consecutive_restarts += 1
+        self._start(handle)
+        return True
+
+    def terminate(self, handle, kill_after=5.0):
+        """Termina il processo senza bloccare; kill dopo kill_after secondi se necessario."""
+        handle.stopping = True
+        process = handle.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+
+        def _kill_if_alive():
+            if process.poll() is None:
+                print(f"[{handle.name}] Il processo non ha risposto a SIGTERM, kill.")
+                process.kill()
+
+        self.watcher.call_later(kill_after, _kill_if_alive)
+
+    def stop(self, handle, timeout=5.0):
+        """Termina il processo e attende la sua uscita (kill dopo timeout)."""
+        handle.stopping = True
+        process = handle.process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _start(self, handle):
+        process = subprocess.Popen(handle.cmd, cwd=handle.cwd, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self.limits.apply(process.pid)
+        handle.process = process
+        handle.started_at = time.monotonic()
+        handle.returncode = None
+        handle.state = 'running'
+        self.watcher.watch_process(process, lambda p: self._on_exit(handle, p), handle.stderr.feed)
+
+    def _on_exit(self, handle, process):
+        if process is not handle.process:
+            return  # Processo già sostituito da un riavvio
+        handle.returncode = process.returncode
+        if handle.started_at and time.monotonic() - handle.started_at >= self.policy.reset_after:
+            handle.consecutive_restarts = 0
+
+        delay = None
+        if handle.stopping:
+            handle.state = 'stopped'
+        else:
+            delay = self.policy.restart_delay(process.returncode, handle.consecutive_restarts)
+            if delay is not None:
+                handle.state = 'backoff'
+            else:
+                handle.state = 'exited' if process.returncode == 0 else 'failed'
+        print(f"[{handle.name}] Processo terminato (codice {process.returncode}), stato: {handle.state}"
+              + (f", riavvio tra {delay:.1f} s" if delay is not None else ""))
+        if handle.on_exit is not None:
+            handle.on_exit(handle, process.returncode, delay)
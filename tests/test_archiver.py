@@ -0,0 +1,68 @@
+"""Archiviatore: politiche di conservazione e coerenza dell'indice.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archiver import INDEX_FILE, SessionArchiver  # noqa: E402
+
+
+class PolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test-archiver-')
+        self.path = os.path.join(self.workdir, 'archive')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+
+    def add_old_archive(self, days):
+        """Archivio di una sessione precedente, già presente nell'indice."""
+        name = '2026-01-01/OLD-20260101T000000.tar.gz'
+        os.makedirs(os.path.join(self.path, '2026-01-01'))
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(b'x' * 100)
+        entry = {'key': 'OLD', 'serial': 'OLD', 'file': name, 'files': ['OLD.pos'], 'size': 100,
+                 'original_size': 1000, 'archived_at': time.time() - days * 86400}
+        with open(os.path.join(self.path, INDEX_FILE), 'w') as f:
+            f.write(json.dumps(entry) + '\n')
+        return name
+
+    def archive_session(self, archiver, serial):
+        pos = os.path.join(self.workdir, f'{serial}.pos')
+        with open(pos, 'w') as f:
+            f.write('2026/10/18 09:00:00.000   45.0648   7.6712   240.5   1   12\n' * 50)
+        archiver.stage(serial, pos)
+        archiver.seal(serial, {'serial': serial, 'status': 'fix'})
+        self.assertTrue(archiver.flush(10))
+
+    def index_files(self):
+        with open(os.path.join(self.path, INDEX_FILE)) as f:
+            return [json.loads(line)['file'] for line in f]
+
+    def test_retention_with_min_free_updates_index(self):
+        old = self.add_old_archive(days=10)
+        archiver = SessionArchiver(self.path, compression='gzip', retention_days=1, min_free_bytes=0)
+        self.archive_session(archiver, 'R1')
+        self.assertFalse(os.path.exists(os.path.join(self.path, old)))
+        self.assertEqual([e['serial'] for e in archiver.entries()], ['R1'])
+        self.assertEqual(len(self.index_files()), 1)
+
+    def test_min_free_without_other_limits(self):
+        old = self.add_old_archive(days=10)
+        archiver = SessionArchiver(self.path, compression='gzip', retention_days=None,
+                                   min_free_bytes=shutil.disk_usage(self.workdir).total * 2)
+        self.archive_session(archiver, 'R1')
+        self.assertFalse(os.path.exists(os.path.join(self.path, old)))
+        self.assertEqual(archiver.entries(), [])
+        self.assertEqual(self.index_files(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Motore di convergenza (fix errati all'inizio della sessione) e timeline degli stati.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from convergence import ConvergenceEngine, StateTimeline, StopCriteria  # noqa: E402
+from geodesy import ecef_to_enu, enu_to_llh  # noqa: E402
+from pos_reader import Q_FIX, Q_FLOAT, Q_SINGLE  # noqa: E402
+
+BASE = (45.0648, 7.6712, 240.5)
+
+
+def epoch(rng, q, e=0.0, n=0.0, u=0.0, noise=0.005):
+    lat, lon, alt = enu_to_llh(e + rng.gauss(0, noise), n + rng.gauss(0, noise), u + rng.gauss(0, 2 * noise), *BASE)
+    return {'lat': lat, 'lon': lon, 'alt': alt, 'q': q, 'ratio': 10.0 if q == Q_FIX else 1.5}
+
+
+class FalseFixTest(unittest.TestCase):
+
+    def run_epochs(self, engine, epochs):
+        for item in epochs:
+            if engine.add_epoch(item):
+                return True
+        return False
+
+    def assert_near_truth(self, engine):
+        result = engine.result()
+        e, n, u = ecef_to_enu(result['x'], result['y'], result['z'], *BASE)
+        self.assertLess(abs(e) + abs(n) + abs(u), 0.02)
+
+    def test_false_fix_then_float_then_correct_fixes(self):
+        rng = random.Random(1)
+        engine = ConvergenceEngine(StopCriteria())
+        epochs = ([epoch(rng, Q_FIX, e=0.15) for _ in range(12)] +
+                  [epoch(rng, Q_FLOAT, noise=0.3) for _ in range(5)] +
+                  [epoch(rng, Q_FIX) for _ in range(2000)])
+        self.assertTrue(self.run_epochs(engine, epochs))
+        self.assertLess(engine.rejected, 10)
+        self.assert_near_truth(engine)
+
+    def test_false_fix_directly_followed_by_correct_fixes(self):
+        rng = random.Random(2)
+        engine = ConvergenceEngine(StopCriteria())
+        epochs = [epoch(rng, Q_FIX, e=0.15) for _ in range(12)] + [epoch(rng, Q_FIX) for _ in range(2000)]
+        self.assertTrue(self.run_epochs(engine, epochs))
+        self.assert_near_truth(engine)
+
+    def test_isolated_outlier_is_rejected(self):
+        rng = random.Random(3)
+        engine = ConvergenceEngine(StopCriteria(min_fixes=30))
+        epochs = [epoch(rng, Q_FIX) for _ in range(20)] + [epoch(rng, Q_FIX, u=1.0)]
+        self.run_epochs(engine, epochs)
+        self.assertEqual(engine.rejected, 1)
+        self.assertEqual(engine.count, 20)
+
+    def test_result_kept_after_fix_lost(self):
+        rng = random.Random(4)
+        engine = ConvergenceEngine(StopCriteria(min_fixes=30))
+        self.run_epochs(engine, [epoch(rng, Q_FIX) for _ in range(10)] + [epoch(rng, Q_FLOAT)])
+        self.assertEqual(engine.result()['fixes'], 10)
+
+
+class StateTimelineTest(unittest.TestCase):
+
+    def test_only_changes_recorded(self):
+        timeline = StateTimeline()
+        changes = [timeline.add(t, q) for t, q in ((0.0, Q_SINGLE), (1.0, Q_SINGLE), (12.44, Q_FLOAT),
+                                                      (13.0, Q_FLOAT), (61.06, Q_FIX))]
+        self.assertEqual(changes, [True, False, True, False, True])
+        self.assertEqual(timeline.to_list(), [{'t': 0.0, 'state': 'single'}, {'t': 12.4, 'state': 'float'},
+                                              {'t': 61.1, 'state': 'fix'}])
+
+    def test_encode_decode_roundtrip(self):
+        rng = random.Random(5)
+        timeline = StateTimeline(max_transitions=1000)
+        elapsed = 0.0
+        # Anche sessioni lunghe (oltre 100000 s): i decimi non devono andare persi
+        for _ in range(500):
+            elapsed += rng.uniform(0, 500)
+            timeline.add(elapsed, rng.choice((1, 2, 3, 4, 5, 6)))
+        self.assertGreater(elapsed, 100000)
+        self.assertEqual(StateTimeline.decode(timeline.encode()), timeline.to_list())
+        self.assertEqual(timeline.encode().count(','), len(timeline.transitions) - 1)
+        # Timeline vuota o assente nello storico
+        self.assertEqual(StateTimeline().encode(), '')
+        self.assertEqual(StateTimeline.decode(''), [])
+        self.assertEqual(StateTimeline.decode(None), [])
+
+    def test_max_transitions_cap(self):
+        # Soluzione che oscilla fra float e fix: la timeline non cresce oltre il limite
+        timeline = StateTimeline(max_transitions=10)
+        for i in range(1000):
+            timeline.add(i, Q_FIX if i % 2 else Q_FLOAT)
+        self.assertEqual(len(timeline.transitions), 10)
+        self.assertEqual(timeline.dropped, 990)
+        self.assertEqual(timeline.state, Q_FIX)
+        self.assertEqual(timeline.to_list()[-1], {'t': 9, 'state': 'fix'})
+        # Uno stato ripetuto non è una transizione, neanche oltre il limite
+        self.assertFalse(timeline.add(1000, Q_FIX))
+        self.assertEqual(timeline.dropped, 990)
+
+
+if __name__ == '__main__':
+    unittest.main()
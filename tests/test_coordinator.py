@@ -0,0 +1,123 @@
+"""Coordinatore e agenti su localhost: distribuzione delle sessioni e letture inoltrate all'agente.
+
+Due agenti (agent.py) con il proprio SessionManager e tools/fake_rtkrcv.py
+al posto di rtkrcv, ciascuno con un server HTTP su una porta locale.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agent import create_agent_app  # noqa: E402
+from coordinator import SessionCoordinator  # noqa: E402
+from sessions import SessionManager  # noqa: E402
+
+FAKE_RTKRCV = os.path.join(ROOT, 'tools', 'fake_rtkrcv.py')
+
+
+def closed_port():
+    # Master senza stream RTCM: si usano le coordinate configurate
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Agent:
+
+    def __init__(self, workdir):
+        self.manager = SessionManager(rtkrcv_path=FAKE_RTKRCV, correction_relay=False, archive_solutions=False)
+        self.manager.base_dir = workdir
+        self.server = make_server('127.0.0.1', 0, create_agent_app(self.manager, max_sessions=4), threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.manager.stop_sessions(self.manager.get_active_serials())
+        self.server.shutdown()
+
+
+class CoordinatorTest(unittest.TestCase):
+
+    def setUp(self):
+        env = mock.patch.dict(os.environ, {'FAKE_RTKRCV_RATE': '20', 'FAKE_RTKRCV_SINGLE': '0.2',
+                                           'FAKE_RTKRCV_FLOAT': '0.3', 'FAKE_RTKRCV_SEED': '1'})
+        env.start()
+        self.addCleanup(env.stop)
+        self.workdir = tempfile.mkdtemp(prefix='test-coordinator-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.agents = []
+        for name in ('a', 'b'):
+            os.makedirs(os.path.join(self.workdir, name))
+            agent = Agent(os.path.join(self.workdir, name))
+            self.addCleanup(agent.close)
+            self.agents.append(agent)
+        self.coordinator = SessionCoordinator([agent.url for agent in self.agents], poll_interval=0.2)
+        self.master = {'name': 'master', 'serial': 'M0', 'ip': '127.0.0.1', 'port': closed_port(),
+                       'role': 'Master', 'lat': 45.0641, 'lon': 7.6697, 'alt': 239.0}
+
+    def rover(self, i):
+        return {'name': f'rover{i}', 'serial': f'R{i}', 'ip': '127.0.0.1', 'port': 1, 'role': 'Rover'}
+
+    def wait_for(self, condition, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return
+            time.sleep(0.1)
+        self.fail("Condizione non raggiunta")
+
+    def test_sessions_spread_and_remote_reads(self):
+        results = self.coordinator.start_sessions([(self.rover(i), self.master) for i in range(4)])
+        self.assertTrue(all(result['success'] for result in results.values()), results)
+        by_agent = {agent.url: agent.manager.get_active_serials() for agent in self.agents}
+        self.assertEqual(sorted(sum(by_agent.values(), [])), ['R0', 'R1', 'R2', 'R3'])
+        self.assertTrue(all(by_agent.values()), by_agent)
+
+        self.wait_for(lambda: self.coordinator.get_session_status('R0') == 'fix')
+        # Timeline e output della sessione letti dall'agente che la esegue
+        owner = next(agent for agent in self.agents if 'R0' in agent.manager.get_snapshots())
+        self.wait_for(lambda: not owner.manager.is_session_running('R0'))
+        timeline = self.coordinator.get_session_timeline('R0')
+        self.assertEqual(timeline['agent'], owner.url)
+        self.assertEqual(timeline['transitions'][-1]['state'], 'fix')
+        self.assertIsNotNone(timeline['first_fix_at'])
+
+        output = self.coordinator.get_session_output('R0', lines=5)
+        self.assertEqual(output, owner.manager.get_session_output('R0', 5))
+        self.assertEqual(len(output['output']), 5)
+        version = self.coordinator.get_session_output_version('R0')
+        self.assertTrue(version.endswith(owner.manager.get_session_output_version('R0')))
+        # Sessione convergente: il file non cresce più, il cursore non restituisce righe nuove
+        again = self.coordinator.get_session_output('R0', after=output['offset'])
+        self.assertEqual((again['output'], again['offset'], again['reset']), ([], output['offset'], False))
+        self.assertEqual(self.coordinator.get_session_output_version('R0'), version)
+
+    def test_unknown_or_unreachable_session(self):
+        self.assertIsNone(self.coordinator.get_session_timeline('NOPE'))
+        self.assertIsNone(self.coordinator.get_session_output_version('NOPE'))
+        self.assertEqual(self.coordinator.get_session_output('NOPE', after=10)['offset'], 10)
+
+        success, _message = self.coordinator.start_session(self.rover(0), self.master)
+        self.assertTrue(success)
+        owner = next(agent for agent in self.agents if 'R0' in agent.manager.get_snapshots())
+        owner.server.shutdown()
+        owner.server.server_close()
+        self.assertIsNone(self.coordinator.get_session_timeline('R0'))
+        output = self.coordinator.get_session_output('R0')
+        self.assertIn(owner.url, output['output'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
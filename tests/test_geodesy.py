@@ -0,0 +1,110 @@
+"""Conversioni WGS84: andata e ritorno LLH/ECEF/ENU e coerenza fra percorso scalare e NumPy.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import math
+import os
+import random
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geodesy import (WGS84_A, WGS84_B, ecef_to_enu, ecef_to_enu_batch, ecef_to_llh,  # noqa: E402
+                     ecef_to_llh_batch, enu_rotation, enu_to_ecef, enu_to_ecef_batch, enu_to_llh,
+                     llh_to_ecef, llh_to_ecef_batch, llh_to_enu, llh_to_enu_batch)
+
+MASTER = (45.0641, 7.6697, 239.0)
+
+
+def random_llh(rng, count):
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180), rng.uniform(-500, 10000)) for _ in range(count)]
+    # Casi limite: equatore, antimeridiano, vicino ai poli, quota di un satellite
+    points += [(0.0, 0.0, 0.0), (0.0, 180.0, 0.0), (0.0, -179.9999999, 12.0), (89.9999, 45.0, 100.0),
+               (-89.9999, -120.0, 3000.0), (45.0, 7.0, 20200000.0)]
+    return points
+
+
+class ScalarTest(unittest.TestCase):
+
+    def test_known_points(self):
+        for expected, llh in (((WGS84_A, 0.0, 0.0), (0.0, 0.0, 0.0)),
+                              ((0.0, WGS84_A, 0.0), (0.0, 90.0, 0.0)),
+                              ((0.0, 0.0, WGS84_B), (90.0, 0.0, 0.0)),
+                              ((0.0, 0.0, -WGS84_B - 100), (-90.0, 0.0, 100.0))):
+            for value, target in zip(llh_to_ecef(*llh), expected):
+                self.assertAlmostEqual(value, target, delta=1e-6)
+        # Stazione 2003 del messaggio 1005 d'esempio dello standard RTCM
+        lat, lon, h = ecef_to_llh(1114104.5999, -4850729.7108, 3975521.4643)
+        self.assertAlmostEqual(lat, 38.80475943, places=8)
+        self.assertAlmostEqual(lon, -77.06477360, places=8)
+        self.assertAlmostEqual(h, 114.5611, places=4)
+
+    def test_llh_ecef_roundtrip(self):
+        for lat, lon, h in random_llh(random.Random(1), 2000):
+            x, y, z = llh_to_ecef(lat, lon, h)
+            lat2, lon2, h2 = ecef_to_llh(x, y, z)
+            self.assertAlmostEqual(lat2, lat, delta=1e-9)
+            self.assertAlmostEqual(h2, h, delta=1e-5)
+            # Vicino ai poli la longitudine è mal condizionata: si confronta la posizione
+            for a, b in zip(llh_to_ecef(lat2, lon2, h2), (x, y, z)):
+                self.assertAlmostEqual(a, b, delta=1e-5)
+
+    def test_enu_roundtrip(self):
+        rng = random.Random(2)
+        for _ in range(500):
+            ref = (rng.uniform(-89, 89), rng.uniform(-180, 180), rng.uniform(0, 3000))
+            e, n, u = rng.uniform(-50000, 50000), rng.uniform(-50000, 50000), rng.uniform(-500, 500)
+            x, y, z = enu_to_ecef(e, n, u, *ref)
+            for a, b in zip(ecef_to_enu(x, y, z, *ref), (e, n, u)):
+                self.assertAlmostEqual(a, b, delta=1e-6)
+            for a, b in zip(llh_to_enu(*enu_to_llh(e, n, u, *ref), *ref), (e, n, u)):
+                self.assertAlmostEqual(a, b, delta=1e-5)
+
+    def test_enu_axes(self):
+        lat, lon, h = MASTER
+        self.assertEqual(tuple(round(v, 9) for v in llh_to_enu(lat, lon, h, *MASTER)), (0.0, 0.0, 0.0))
+        # Un punto più alto sulla stessa verticale è solo 'up'; uno più a nord ha n > 0 ed e ~ 0
+        e, n, u = llh_to_enu(lat, lon, h + 10, *MASTER)
+        self.assertAlmostEqual(u, 10, delta=1e-6)
+        self.assertAlmostEqual(math.hypot(e, n), 0, delta=1e-6)
+        e, n, u = llh_to_enu(lat + 0.001, lon, h, *MASTER)
+        self.assertAlmostEqual(n, 111.1, delta=0.2)
+        self.assertAlmostEqual(e, 0, delta=1e-6)
+        # La rotazione è ortonormale
+        rot = np.array(enu_rotation(lat, lon))
+        np.testing.assert_allclose(rot @ rot.T, np.eye(3), atol=1e-15)
+
+
+class BatchTest(unittest.TestCase):
+    """Le versioni *_batch devono dare gli stessi risultati delle scalari."""
+
+    def setUp(self):
+        points = random_llh(random.Random(3), 5000)
+        self.llh = np.array(points)
+        self.xyz = np.array([llh_to_ecef(*p) for p in points])
+
+    def test_llh_to_ecef(self):
+        np.testing.assert_allclose(llh_to_ecef_batch(*self.llh.T), self.xyz, rtol=0, atol=1e-8)
+
+    def test_ecef_to_llh(self):
+        expected = np.array([ecef_to_llh(*p) for p in self.xyz])
+        np.testing.assert_allclose(ecef_to_llh_batch(self.xyz), expected, rtol=0, atol=1e-8)
+
+    def test_enu(self):
+        expected = np.array([ecef_to_enu(*p, *MASTER) for p in self.xyz])
+        enu = ecef_to_enu_batch(self.xyz, *MASTER)
+        np.testing.assert_allclose(enu, expected, rtol=0, atol=1e-7)
+        np.testing.assert_allclose(llh_to_enu_batch(*self.llh.T, *MASTER), expected, rtol=0, atol=1e-7)
+        np.testing.assert_allclose(enu_to_ecef_batch(enu, *MASTER), self.xyz, rtol=0, atol=1e-7)
+
+    def test_shapes(self):
+        self.assertEqual(llh_to_ecef_batch([], [], []).shape, (0, 3))
+        self.assertEqual(ecef_to_llh_batch(np.empty((0, 3))).shape, (0, 3))
+        self.assertEqual(llh_to_ecef_batch(*MASTER).shape, (3,))
+
+
+if __name__ == '__main__':
+    unittest.main()
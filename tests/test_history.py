@@ -0,0 +1,94 @@
+"""Storico delle sessioni: id assegnati da SQLite, scritture in blocco e sessioni interrotte.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryStore  # noqa: E402
+
+EPOCH = {'time': '2026/10/18 09:00:00.000', 'lat': 45.0648, 'lon': 7.6712, 'alt': 240.5, 'q': 1, 'ns': 20,
+         'ratio': 12.0}
+COORDS = {'x': 4472277.4766, 'y': 602388.5667, 'z': 4492609.4826, 'lat': 45.0648, 'lon': 7.6712, 'alt': 240.5,
+          'sigma_3d': 0.0108, 'fixes': 30}
+
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test-history-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.path = os.path.join(self.workdir, 'history.db')
+
+    def open(self, **kwargs):
+        kwargs.setdefault('epoch_interval', 0)
+        kwargs.setdefault('flush_interval', 0.05)
+        return HistoryStore(self.path, **kwargs)
+
+    def test_ids_from_sqlite(self):
+        first = self.open()
+        ids = [first.start_session(f'R{i}', start_time=1000 + i) for i in range(3)]
+        # Un secondo archivio sullo stesso database (altro processo o riavvio) non riusa gli id
+        second = self.open()
+        ids.append(second.start_session('R3', start_time=1003))
+        ids.append(first.start_session('R4', start_time=1004))
+        self.assertEqual(len(set(ids)), 5)
+        # La sessione esiste subito: epoche e fine possono riferirsi all'id
+        for store, session_id in ((first, ids[0]), (second, ids[3])):
+            store.record_epoch(session_id, EPOCH, now=2000)
+            store.end_session(session_id, 'fix', COORDS, time_to_fix=60, end_time=2060)
+            self.assertTrue(store.flush(5))
+        self.assertEqual(first.get_session(ids[3])['status'], 'fix')
+        self.assertEqual([row['serial'] for row in first.query_sessions()], ['R4', 'R3', 'R2', 'R1', 'R0'])
+        # Gli id delle sessioni cancellate non vengono riassegnati
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (ids[-1],))
+        self.assertGreater(first.start_session('R5'), ids[-1])
+
+    def test_bad_statement_does_not_drop_batch(self):
+        store = self.open(flush_interval=60)
+        session_id = store.start_session('R0', start_time=1000)
+        store.record_first_fix(session_id, 30)
+        store.record_epoch(session_id, EPOCH, now=1010)
+        # Valore non memorizzabile: l'operazione fallisce dentro la transazione del blocco
+        store.record_epoch(session_id, dict(EPOCH, ns=object()), now=1020)
+        store.record_epoch(session_id, EPOCH, now=1030)
+        store.end_session(session_id, 'fix', COORDS, time_to_fix=60, end_time=1060)
+        self.assertTrue(store.flush(5))
+        session = store.get_session(session_id)
+        self.assertEqual((session['status'], session['time_to_first_fix'], session['fixes']), ('fix', 30, 30))
+        self.assertEqual([epoch['time'] for epoch in store.session_epochs(session_id)], [1010, 1030])
+
+    def test_running_sessions_marked_interrupted_on_open(self):
+        store = self.open()
+        finished = store.start_session('R0', start_time=1000)
+        store.end_session(finished, 'fix', COORDS, time_to_fix=60, end_time=1060)
+        with_epochs = store.start_session('R1', start_time=1000)
+        store.record_epoch(with_epochs, EPOCH, now=1100)
+        store.record_epoch(with_epochs, EPOCH, now=1200)
+        without_epochs = store.start_session('R2', start_time=1000)
+        self.assertTrue(store.flush(5))
+
+        # Riapertura dopo un arresto senza end_session
+        reopened = self.open()
+        self.assertEqual(reopened.get_session(finished)['status'], 'fix')
+        self.assertEqual((reopened.get_session(with_epochs)['status'], reopened.get_session(with_epochs)['end_time']),
+                         ('interrupted', 1200))
+        self.assertEqual((reopened.get_session(without_epochs)['status'],
+                          reopened.get_session(without_epochs)['end_time']), ('interrupted', None))
+        # Le interrotte non contano nel tasso di fix
+        stats = reopened.ttf_stats(by='all')['*']
+        self.assertEqual((stats['sessions'], stats['fixed'], stats['fix_rate']), (3, 1, 1.0))
+        # Le sessioni avviate dopo l'apertura restano in corso
+        running = reopened.start_session('R3')
+        self.assertEqual(reopened.get_session(running)['status'], 'running')
+
+
+if __name__ == '__main__':
+    unittest.main()
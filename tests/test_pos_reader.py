@@ -0,0 +1,296 @@
+"""Lettura dei file .pos: tail incrementale, cursori ed ETag dell'output e parser colonnare.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import calendar
+import importlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pos_reader import (GPS_EPOCH_OFFSET, PosTailReader, _field_layout, _parse_fixed_width,  # noqa: E402
+                        iter_pos_columns, parse_pos_block, parse_pos_line)
+
+HEADER = "%  GPST                  latitude(deg) longitude(deg)  height(m)   Q  ns   sdn(m)   sde(m)   sdu(m)\n"
+
+
+def pos_line(second, q=1, lat=45.064819837, lon=7.671223711):
+    return (f"2026/10/18 09:00:{second:06.3f}   {lat:.9f}    {lon:.9f}   240.5037   {q}  23"
+            f"   0.0050   0.0050   0.0100   0.0000   0.0000   0.0000   1.00   19.6\n")
+
+
+class TempDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test-pos-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.path = os.path.join(self.workdir, 'R0.pos')
+
+    def write(self, text, mode='a', path=None):
+        with open(path or self.path, mode) as f:
+            f.write(text)
+
+
+class PosTailReaderTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        self.reader = PosTailReader(self.path)
+        self.addCleanup(self.reader.close)
+
+    def test_missing_file_then_created(self):
+        self.assertEqual(self.reader.read_lines(), [])
+        self.write(HEADER + pos_line(0))
+        self.assertEqual(self.reader.read_lines(), [HEADER.rstrip('\n'), pos_line(0).rstrip('\n')])
+
+    def test_only_new_lines(self):
+        self.write(HEADER + pos_line(0))
+        self.assertEqual(len(self.reader.read_lines()), 2)
+        self.assertEqual(self.reader.read_lines(), [])
+        self.write(pos_line(1) + pos_line(2))
+        self.assertEqual([e['time'] for e in self.reader.read_epochs()],
+                         ['2026/10/18 09:00:01.000', '2026/10/18 09:00:02.000'])
+
+    def test_partial_line_held_until_complete(self):
+        line = pos_line(0)
+        self.write(line[:40])
+        self.assertEqual(self.reader.read_lines(), [])
+        self.write(line[40:-1])
+        self.assertEqual(self.reader.read_lines(), [])
+        self.write('\n' + pos_line(1)[:10])
+        self.assertEqual(self.reader.read_lines(), [line.rstrip('\n')])
+        self.assertEqual(self.reader.offset, os.path.getsize(self.path))
+
+    def test_truncation_restarts_from_beginning(self):
+        self.write(HEADER + pos_line(0) + pos_line(1))
+        self.reader.read_lines()
+        self.write(pos_line(5), mode='w')
+        self.assertEqual(self.reader.read_lines(), [pos_line(5).rstrip('\n')])
+
+    def test_truncation_drops_partial_line(self):
+        self.write(pos_line(0) + pos_line(1)[:30])
+        self.reader.read_lines()
+        self.write(pos_line(2), mode='w')
+        self.assertEqual(self.reader.read_epochs()[0]['time'], '2026/10/18 09:00:02.000')
+
+    def test_rotation_reads_new_file(self):
+        self.write(pos_line(0))
+        self.reader.read_lines()
+        # Nuovo file (inode diverso) più lungo del precedente
+        rotated = os.path.join(self.workdir, 'R0.pos.new')
+        self.write(HEADER + pos_line(7) + pos_line(8), mode='w', path=rotated)
+        os.replace(rotated, self.path)
+        self.assertEqual([e['time'][-6:] for e in self.reader.read_epochs()], ['07.000', '08.000'])
+        self.write(pos_line(9))
+        self.assertEqual(len(self.reader.read_lines()), 1)
+
+    def test_removed_file_resumes_when_recreated(self):
+        self.write(pos_line(0))
+        self.reader.read_lines()
+        os.unlink(self.path)
+        self.assertEqual(self.reader.read_lines(), [])
+        self.write(pos_line(3))
+        self.assertEqual(self.reader.read_epochs()[0]['time'][-6:], '03.000')
+
+
+class OutputApiTest(TempDirTest):
+    """GET /api/sessions/<serial>/output: ETag, 304 e cursore ?after."""
+
+    @classmethod
+    def setUpClass(cls):
+        # Solo il manager locale: niente storico, verifiche, archivio o processi di supporto
+        env = {'RTKRCV_HISTORY_DB': '', 'RTKRCV_HEALTH_CHECK': '0', 'RTKRCV_ARCHIVE': '0', 'RTKRCV_REPLAY': '0',
+               'RTKRCV_SCHEDULER': '0', 'RTKRCV_CORRECTION_RELAY': '0', 'RTKRCV_AGENTS': ''}
+        cls.appdir = tempfile.mkdtemp(prefix='test-output-api-')
+        cwd = os.getcwd()
+        os.chdir(cls.appdir)  # pool_list.json dell'applicazione
+        try:
+            with mock.patch.dict(os.environ, env):
+                cls.app = importlib.import_module('app')
+        finally:
+            os.chdir(cwd)
+        cls.client = cls.app.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.appdir, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.workdir, 'output'))
+        self.path = os.path.join(self.workdir, 'output', 'R0.pos')
+        patcher = mock.patch.object(self.app.session_manager, 'base_dir', self.workdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get('/api/sessions/R0/output', query_string=params, headers=headers)
+
+    def test_missing_file(self):
+        response = self.get(after=0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'output': [], 'offset': 0, 'reset': False})
+        self.assertIsNone(response.headers.get('ETag'))
+
+    def test_not_modified_until_file_changes(self):
+        self.write(HEADER + pos_line(0) + pos_line(1))
+        first = self.get(lines=2)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json['output'], [pos_line(0).rstrip('\n'), pos_line(1).rstrip('\n')])
+        etag = first.headers['ETag']
+        not_modified = self.get(etag, lines=2)
+        self.assertEqual((not_modified.status_code, not_modified.data), (304, b''))
+        self.assertEqual(not_modified.headers['ETag'], etag)
+        # Stesso file, richiesta diversa: ETag diverso
+        self.assertEqual(self.get(etag, lines=3).status_code, 200)
+        self.write(pos_line(2))
+        changed = self.get(etag, lines=2)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+        self.assertEqual(changed.json['output'][-1], pos_line(2).rstrip('\n'))
+
+    def test_cursor_advances_after_append(self):
+        self.write(HEADER + pos_line(0))
+        first = self.get(lines=20).json
+        self.assertEqual(first['offset'], os.path.getsize(self.path))
+        # Nessuna riga nuova: stesso cursore, e 304 finché il file non cambia
+        response = self.get(after=first['offset'])
+        self.assertEqual(response.json, {'output': [], 'offset': first['offset'], 'reset': False})
+        self.assertEqual(self.get(response.headers['ETag'], after=first['offset']).status_code, 304)
+        # La riga incompleta resta al prossimo giro
+        self.write(pos_line(1) + pos_line(2)[:30])
+        second = self.get(after=first['offset']).json
+        self.assertEqual((second['output'], second['reset']), ([pos_line(1).rstrip('\n')], False))
+        self.assertEqual(second['offset'], first['offset'] + len(pos_line(1)))
+        self.write(pos_line(2)[30:])
+        third = self.get(after=second['offset']).json
+        self.assertEqual(third['output'], [pos_line(2).rstrip('\n')])
+        self.assertEqual(third['offset'], os.path.getsize(self.path))
+
+    def test_cursor_across_truncation(self):
+        self.write(HEADER + ''.join(pos_line(i) for i in range(10)))
+        offset = self.get().json['offset']
+        # rtkrcv riavviato: il file riparte da capo, più corto del cursore
+        self.write(HEADER + pos_line(30), mode='w')
+        response = self.get(after=offset).json
+        self.assertTrue(response['reset'])
+        self.assertEqual(response['output'], [HEADER.rstrip('\n'), pos_line(30).rstrip('\n')])
+        self.assertEqual(response['offset'], os.path.getsize(self.path))
+        self.write(pos_line(31))
+        response = self.get(after=response['offset']).json
+        self.assertEqual((response['output'], response['reset']), ([pos_line(31).rstrip('\n')], False))
+
+    def test_invalid_parameters(self):
+        for params in ({'lines': 'x'}, {'after': -1}, {'lines': -5}):
+            with self.subTest(**params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+
+def rtklib_line(rng, week_tow, xyz):
+    """Riga .pos come la scrive RTKLIB (campi a larghezza fissa), con coordinate anche negative."""
+    if week_tow:
+        stamp = f"{rng.randint(1000, 2400):4d} {rng.uniform(0, 604799.999):10.3f}"
+    else:
+        stamp = (f"{rng.randint(1990, 2099):04d}/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d} "
+                 f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.uniform(0, 59.999):06.3f}")
+    if xyz:
+        position = " ".join(f"{rng.uniform(-6400000, 6400000):14.4f}" for _ in range(3))
+    else:
+        position = f"{rng.uniform(-90, 90):14.9f} {rng.uniform(-180, 180):14.9f} {rng.uniform(-400, 9000):10.4f}"
+    sigmas = " ".join(f"{rng.uniform(0, 99):8.4f}" for _ in range(3))
+    cross = " ".join(f"{rng.uniform(-9, 9):8.4f}" for _ in range(3))
+    return (f"{stamp} {position} {rng.choice((1, 2, 5)):3d} {rng.randint(0, 40):3d} {sigmas} {cross}"
+            f" {rng.uniform(0, 99):6.2f} {rng.uniform(0, 999):6.1f}")
+
+
+def split_parse(lines):
+    """Parsing di riferimento, come nel codice originale: split e float campo per campo."""
+    return np.array([[float(token) for token in line.replace('/', ' ').replace(':', ' ').split()] for line in lines])
+
+
+def reference_time(row, week_tow):
+    if week_tow:
+        return GPS_EPOCH_OFFSET + row[0] * 604800 + row[1]
+    y, m, d, hh, mm, ss = row[:6]
+    return calendar.timegm((int(y), int(m), int(d), int(hh), int(mm), 0)) + ss
+
+
+class FixedWidthParserTest(TempDirTest):
+    """Il parser a larghezza fissa deve dare gli stessi valori del parsing con split."""
+
+    def check_block(self, week_tow, xyz, count=500):
+        rng = random.Random(week_tow * 2 + xyz)
+        lines = [rtklib_line(rng, week_tow, xyz) for _ in range(count)]
+        data = ''.join(line + '\n' for line in lines).encode()
+        # Il percorso vettoriale deve essere quello effettivamente usato
+        self.assertIsNotNone(_parse_fixed_width(data, _field_layout(lines[0].encode())))
+        values, ncols, time_cols = parse_pos_block(data)
+        expected = split_parse(lines)
+        self.assertEqual(time_cols, 2 if week_tow else 6)
+        self.assertEqual(values.shape, expected.shape)
+        np.testing.assert_allclose(values, expected, rtol=1e-15, atol=1e-12)
+        self.assertTrue((values[:, time_cols:time_cols + 3] < 0).any())
+        return lines, expected
+
+    def test_llh_calendar_time(self):
+        self.check_block(week_tow=False, xyz=False)
+
+    def test_llh_week_time(self):
+        self.check_block(week_tow=True, xyz=False)
+
+    def test_xyz_calendar_time(self):
+        self.check_block(week_tow=False, xyz=True)
+
+    def test_xyz_week_time(self):
+        self.check_block(week_tow=True, xyz=True)
+
+    def test_live_parser_agrees(self):
+        rng = random.Random(7)
+        lines = [rtklib_line(rng, False, False) for _ in range(200)]
+        values, _ncols, _time_cols = parse_pos_block(''.join(line + '\n' for line in lines).encode())
+        for line, row in zip(lines, values):
+            epoch = parse_pos_line(line)
+            self.assertEqual((epoch['lat'], epoch['lon'], epoch['alt'], epoch['q'], epoch['ns']),
+                             (row[6], row[7], row[8], int(row[9]), int(row[10])))
+            self.assertEqual(epoch['ratio'], row[-1])
+
+    def test_iter_pos_columns_across_chunks(self):
+        for week_tow in (False, True):
+            with self.subTest(week_tow=week_tow):
+                rng = random.Random(11 + week_tow)
+                lines = [rtklib_line(rng, week_tow, False) for _ in range(300)]
+                path = os.path.join(self.workdir, f'chunks{int(week_tow)}.pos')
+                self.write(HEADER + ''.join(line + '\n' for line in lines), mode='w', path=path)
+                # Blocchi piccoli: le righe vengono spezzate fra un blocco e l'altro
+                chunks = list(iter_pos_columns(path, chunk_size=1000))
+                self.assertGreater(len(chunks), 1)
+                time = np.concatenate([c['time'] for c in chunks])
+                pos = np.concatenate([c['pos'] for c in chunks])
+                q = np.concatenate([c['q'] for c in chunks])
+                ratio = np.concatenate([c['ratio'] for c in chunks])
+                expected = split_parse(lines)
+                c = 2 if week_tow else 6
+                np.testing.assert_allclose(time, [reference_time(row, week_tow) for row in expected], rtol=0, atol=1e-6)
+                np.testing.assert_allclose(pos, expected[:, c:c + 3], rtol=1e-15)
+                np.testing.assert_array_equal(q, expected[:, c + 3].astype(int))
+                np.testing.assert_allclose(ratio, expected[:, -1], rtol=1e-15)
+
+    def test_irregular_lines_fall_back(self):
+        lines = ["2026/10/18 09:00:00.000   -33.868819999   151.209295000    58.1234   1  12",
+                 "2026/10/18 09:00:01.000 -33.86882 151.2093 58.12 2 9",
+                 "riga non valida"]
+        values, _ncols, _time_cols = parse_pos_block(''.join(line + '\n' for line in lines).encode())
+        np.testing.assert_allclose(values, split_parse(lines[:2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
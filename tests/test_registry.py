@@ -0,0 +1,139 @@
+"""Registro dei dispositivi: scelta del master più vicino e salvataggio write-behind.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geodesy import llh_to_ecef  # noqa: E402
+from registry import DeviceRegistry  # noqa: E402
+from spatial import PointIndex  # noqa: E402
+
+
+def brute_force_nearest(points, lat, lon, alt):
+    target = llh_to_ecef(lat, lon, alt)
+    return min((math.dist(llh_to_ecef(*position), target), item) for position, item in points)
+
+
+class PointIndexTest(unittest.TestCase):
+
+    def check_against_brute_force(self, points, queries):
+        index = PointIndex(points)
+        self.assertEqual(len(index), len(points))
+        for query in queries:
+            item, distance = index.nearest(*query)
+            expected_distance, expected_item = brute_force_nearest(points, *query)
+            self.assertEqual(item, expected_item)
+            self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_regional_network(self):
+        # Rete di master di una regione e rover nella stessa area
+        rng = random.Random(1)
+        points = [((rng.uniform(44.0, 46.5), rng.uniform(6.6, 9.2), rng.uniform(100, 2500)), f'M{i}')
+                  for i in range(300)]
+        queries = [(rng.uniform(43.8, 46.7), rng.uniform(6.4, 9.4), rng.uniform(0, 3000)) for _ in range(500)]
+        self.check_against_brute_force(points, queries)
+
+    def test_global_points(self):
+        # Punti su tutto il globo: antimeridiano e poli compresi
+        rng = random.Random(2)
+        points = [((rng.uniform(-90, 90), rng.uniform(-180, 180), rng.uniform(-100, 4000)), i) for i in range(200)]
+        queries = [(rng.uniform(-90, 90), rng.uniform(-180, 180), 0.0) for _ in range(300)]
+        queries += [(0.0, 179.999, 0.0), (0.0, -179.999, 0.0), (89.99, 0.0, 0.0), (-89.99, 90.0, 0.0)]
+        self.check_against_brute_force(points, queries)
+
+    def test_empty_and_single(self):
+        self.assertIsNone(PointIndex().nearest(45.0, 7.0))
+        item, distance = PointIndex([((45.0, 7.0, 0.0), 'M0')]).nearest(45.0, 7.0)
+        self.assertEqual((item, distance), ('M0', 0.0))
+
+
+class DeviceRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test-registry-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.path = os.path.join(self.workdir, 'pool_list.json')
+
+    def make_registry(self, save_delay=0.2):
+        registry = DeviceRegistry(self.path, save_delay=save_delay)
+        self.addCleanup(registry.flush)
+        return registry
+
+    def test_write_behind_coalesces_changes(self):
+        registry = self.make_registry()
+        saves = []
+        save = registry._save_in_background
+        registry._save_in_background = lambda: (saves.append(time.monotonic()), save())
+        for i in range(20):
+            registry.add({'name': f'rover{i}', 'serial': f'R{i}', 'ip': '10.0.0.1', 'port': 2000 + i, 'role': 'Rover'})
+        registry.update('R3', {'name': 'rinominato'})
+        registry.remove('R19')
+        # Nessuna scrittura durante le modifiche
+        self.assertFalse(os.path.exists(self.path))
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.3)
+        self.assertEqual(len(saves), 1)
+        with open(self.path) as f:
+            saved = json.load(f)
+        self.assertEqual(len(saved['devices']), 19)
+        self.assertEqual(saved['devices'][3]['name'], 'rinominato')
+
+    def test_reload_after_flush(self):
+        with open(self.path, 'w') as f:
+            json.dump({'campaign': {'profile': 'static'}, 'devices': [
+                {'name': 'master', 'serial': 'M0', 'ip': '10.0.0.2', 'port': 2101, 'role': 'Master'}]}, f)
+        registry = self.make_registry(save_delay=60)
+        registry.add({'name': 'rover', 'serial': 'R0', 'ip': '10.0.0.3', 'port': 2222, 'role': 'Rover'})
+        registry.set_position('M0', 45.0641, 7.6697, 239.0, 'rtcm')
+        registry.flush()
+
+        reloaded = DeviceRegistry(self.path)
+        self.assertEqual(reloaded.list_devices(), registry.list_devices())
+        self.assertEqual(reloaded.get('M0')['position']['source'], 'rtcm')
+        self.assertEqual(reloaded.get_setting('campaign'), {'profile': 'static'})
+        self.assertEqual(reloaded.get_rover('R0')['port'], 2222)
+        self.assertIsNone(reloaded.get_rover('M0'))
+        # Senza modifiche il file non viene riscritto
+        mtime = os.stat(self.path).st_mtime_ns
+        reloaded.flush()
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+    def test_nearest_master_assignment(self):
+        registry = self.make_registry(save_delay=60)
+        registry.add({'name': 'torino', 'serial': 'MT', 'ip': '10.0.0.1', 'port': 1, 'role': 'Master',
+                      'lat': 45.0641, 'lon': 7.6697, 'alt': 239.0})
+        registry.add({'name': 'milano', 'serial': 'MM', 'ip': '10.0.0.2', 'port': 1, 'role': 'Master',
+                      'lat': 45.4642, 'lon': 9.1900, 'alt': 120.0})
+        registry.add({'name': 'senza posizione', 'serial': 'MX', 'ip': '10.0.0.3', 'port': 1, 'role': 'Master'})
+        registry.add({'name': 'r1', 'serial': 'R1', 'ip': '10.0.1.1', 'port': 1, 'role': 'Rover',
+                      'lat': 45.07, 'lon': 7.68, 'alt': 240.0})
+        registry.add({'name': 'r2', 'serial': 'R2', 'ip': '10.0.1.2', 'port': 1, 'role': 'Rover'})
+        registry.set_position('R2', 45.45, 9.15, 130.0, 'fix')
+        registry.add({'name': 'r3', 'serial': 'R3', 'ip': '10.0.1.3', 'port': 1, 'role': 'Rover'})
+
+        assignments = registry.get_masters_for(['R1', 'R2', 'R3', 'NOPE'])
+        self.assertEqual(assignments['R1']['master']['serial'], 'MT')
+        self.assertEqual(assignments['R2']['master']['serial'], 'MM')
+        # Rover senza posizione: master predefinito (l'ultimo configurato)
+        self.assertEqual((assignments['R3']['master']['serial'], assignments['R3']['distance']), ('MX', None))
+        self.assertIsNone(assignments['NOPE'])
+
+        # Un master spostato (posizione appresa da RTCM) aggiorna l'indice
+        registry.set_position('MM', 45.07, 7.68, 240.0, 'rtcm')
+        self.assertEqual(registry.get_masters_for(['R1'])['R1']['master']['serial'], 'MM')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""Relay delle correzioni: una connessione al master, fan-out ai rover, disconnessione dei client lenti.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from relay import CorrectionRelay  # noqa: E402
+
+
+class FakeMaster:
+    """Master TCP: invia il payload a ogni connessione dopo il via, poi resta collegato."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.connections = 0
+        self.go = threading.Event()
+        self.stop = threading.Event()
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            self.go.wait()
+            for i in range(0, len(self.payload), 16384):
+                conn.sendall(self.payload[i:i + 16384])
+            self.stop.wait()
+
+    def close(self):
+        self.stop.set()
+        self.go.set()
+        self.server.close()
+
+
+def read_exactly(sock, size, result):
+    chunks = []
+    received = 0
+    while received < size:
+        data = sock.recv(65536)
+        if not data:
+            break
+        chunks.append(data)
+        received += len(data)
+    result.append(b''.join(chunks))
+
+
+class CorrectionRelayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.payload = random.Random(0).randbytes(8 * 1024 * 1024)
+        self.master = FakeMaster(self.payload)
+        self.addCleanup(self.master.close)
+        self.relay = CorrectionRelay(max_client_buffer=64 * 1024, idle_timeout=0.2)
+
+    def connect(self, port, rcvbuf=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        sock.connect(('127.0.0.1', port))
+        sock.settimeout(10)
+        self.addCleanup(sock.close)
+        return sock
+
+    def wait_stats(self, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = self.relay.stats()
+            if stats and condition(stats[0]):
+                return stats[0]
+            time.sleep(0.02)
+        self.fail(f"Condizione non raggiunta: {self.relay.stats()}")
+
+    def test_fan_out_and_slow_consumer_drop(self):
+        host, port = self.relay.endpoint('127.0.0.1', self.master.port)
+        # Stesso master: stesso endpoint locale
+        self.assertEqual(self.relay.endpoint('127.0.0.1', self.master.port), (host, port))
+        fast = [self.connect(port) for _ in range(3)]
+        slow = self.connect(port, rcvbuf=4096)
+        self.wait_stats(lambda s: len(s['clients']) == 4 and s['connected'])
+
+        results = []
+        readers = [threading.Thread(target=read_exactly, args=(sock, len(self.payload), results)) for sock in fast]
+        for reader in readers:
+            reader.start()
+        self.master.go.set()
+        for reader in readers:
+            reader.join(30)
+
+        # I client veloci ricevono tutto, nell'ordine; il lento viene disconnesso
+        self.assertEqual(len(results), 3)
+        for data in results:
+            self.assertEqual(data, self.payload)
+        stats = self.wait_stats(lambda s: s['bytes_in'] == len(self.payload))
+        self.assertEqual(stats['dropped_clients'], 1)
+        self.assertEqual(len(stats['clients']), 3)
+        # Al client lento è arrivata solo una parte dello stream prima della disconnessione
+        self.assertGreaterEqual(stats['bytes_out'], 3 * len(self.payload))
+        self.assertLess(stats['bytes_out'] - 3 * len(self.payload), len(self.payload))
+        self.assertEqual(self.master.connections, 1)
+        # Il client lento trova la connessione chiusa dopo i byte già accodati
+        received = 0
+        while True:
+            try:
+                data = slow.recv(65536)
+            except (ConnectionResetError, socket.timeout):
+                break
+            if not data:
+                break
+            received += len(data)
+        self.assertLess(received, len(self.payload))
+
+    def test_idle_upstream_closed_and_reopened(self):
+        _host, port = self.relay.endpoint('127.0.0.1', self.master.port)
+        self.master.go.set()
+        sock = self.connect(port)
+        self.assertTrue(sock.recv(1))
+        sock.close()
+        # Nessun rover collegato: dopo idle_timeout la connessione al master viene chiusa
+        self.wait_stats(lambda s: not s['clients'] and not s['connected'])
+        sock = self.connect(port)
+        self.assertTrue(sock.recv(1))
+        self.assertEqual(self.master.connections, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+"""Decoder RTCM3 e cache delle posizioni dei master lette da 1005/1006.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import importlib.util
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from geodesy import llh_to_ecef  # noqa: E402
+from rtcm import (MasterPositionCache, RtcmFrameReader, build_frame, crc24q, decode_station,  # noqa: E402
+                  encode_station, read_station_position)
+
+POSITION = {'message': 1005, 'lat': 45.0641, 'lon': 7.6697, 'alt': 239.0}
+
+# Esempio di messaggio 1005 dello standard RTCM 10403 (stazione 2003)
+FRAME_1005 = bytes.fromhex('D300133ED7D30202980EDEEF34B4BD62AC0941986F33360B98')
+
+
+def load_tool(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, 'tools', f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class CrcTest(unittest.TestCase):
+
+    def test_check_value(self):
+        # Valore di controllo del CRC-24Q (CRC-24/LTE-A) sulla stringa standard
+        self.assertEqual(crc24q(b'123456789'), 0xCDE703)
+
+    def test_known_frame(self):
+        self.assertEqual(crc24q(FRAME_1005[:-3]), int.from_bytes(FRAME_1005[-3:], 'big'))
+        self.assertEqual(build_frame(FRAME_1005[3:-3]), FRAME_1005)
+
+
+class StationMessageTest(unittest.TestCase):
+
+    def test_decode_known_1005(self):
+        station = decode_station(FRAME_1005[3:-3])
+        self.assertEqual(station['message'], 1005)
+        self.assertEqual(station['station_id'], 2003)
+        self.assertEqual((station['x'], station['y'], station['z']), (1114104.5999, -4850729.7108, 3975521.4643))
+
+    def test_roundtrip_1005(self):
+        x, y, z = llh_to_ecef(45.0641, 7.6697, 239.0)
+        station = decode_station(encode_station(17, x, y, z))
+        self.assertEqual(station['message'], 1005)
+        self.assertEqual(station['station_id'], 17)
+        for decoded, value in zip((station['x'], station['y'], station['z']), (x, y, z)):
+            self.assertAlmostEqual(decoded, value, delta=0.00005)
+        self.assertAlmostEqual(station['lat'], 45.0641, places=7)
+        self.assertAlmostEqual(station['lon'], 7.6697, places=7)
+        self.assertAlmostEqual(station['alt'], 239.0, places=3)
+        self.assertNotIn('antenna_height', station)
+
+    def test_roundtrip_1006(self):
+        # Coordinate negative: verifica dei campi con segno a 38 bit
+        station = decode_station(encode_station(4095, -2694892.4601, -4297557.4726, 3854813.4160, antenna_height=1.5432))
+        self.assertEqual(station['message'], 1006)
+        self.assertEqual(station['station_id'], 4095)
+        self.assertEqual((station['x'], station['y'], station['z']), (-2694892.4601, -4297557.4726, 3854813.416))
+        self.assertEqual(station['antenna_height'], 1.5432)
+
+    def test_other_messages_ignored(self):
+        self.assertIsNone(decode_station(bytes.fromhex('43F0') + bytes(20)))  # 1087
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def test_frames_split_across_reads(self):
+        reader = RtcmFrameReader()
+        stream = FRAME_1005 * 3
+        payloads = []
+        for i in range(0, len(stream), 7):
+            payloads += reader.feed(stream[i:i + 7])
+        self.assertEqual(payloads, [FRAME_1005[3:-3]] * 3)
+
+    def test_resync_after_corrupted_frame(self):
+        corrupted = bytearray(FRAME_1005)
+        corrupted[10] ^= 0xFF
+        reader = RtcmFrameReader()
+        # Il payload corrotto contiene un falso preambolo (0xD3) con una lunghezza di 514 byte:
+        # il lettore lo scarta solo quando sono arrivati abbastanza dati, senza perdere i frame buoni
+        payloads = reader.feed(b'\x00\x01garbage' + bytes(corrupted))
+        for _ in range(30):
+            payloads += reader.feed(FRAME_1005)
+        self.assertEqual(payloads, [FRAME_1005[3:-3]] * 30)
+        self.assertGreaterEqual(reader.crc_errors, 1)
+
+
+class ReplayServerTest(unittest.TestCase):
+    """read_station_position contro tools/rtcm_replay.py al posto di un master reale."""
+
+    def start_replay(self, data, chunk_size, interval=0.01):
+        replay = load_tool('rtcm_replay')
+        server = replay.ThreadingServer(('127.0.0.1', 0), replay.make_handler(data, chunk_size, interval))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address
+
+    def test_read_station_position(self):
+        x, y, z = llh_to_ecef(45.0641, 7.6697, 239.0)
+        frame = build_frame(encode_station(0, x, y, z))
+        host, port = self.start_replay(frame, len(frame))
+        station = read_station_position(host, port, timeout=5)
+        self.assertAlmostEqual(station['lat'], 45.0641, places=7)
+        self.assertAlmostEqual(station['lon'], 7.6697, places=7)
+
+    def test_station_after_other_messages_in_small_chunks(self):
+        # Stream registrato: altri messaggi e un frame corrotto prima del 1006
+        other = build_frame(bytes.fromhex('43F0') + bytes(30))
+        corrupted = bytearray(FRAME_1005)
+        corrupted[-1] ^= 0x01
+        station_frame = build_frame(encode_station(5, 4472000.1234, 602000.5678, 4490000.9012, antenna_height=0.1))
+        host, port = self.start_replay(other + bytes(corrupted) + other + station_frame, chunk_size=5)
+        station = read_station_position(host, port, timeout=5)
+        self.assertEqual(station['message'], 1006)
+        self.assertEqual(station['x'], 4472000.1234)
+
+    def test_timeout_without_station_message(self):
+        other = build_frame(bytes.fromhex('43F0') + bytes(30))
+        host, port = self.start_replay(other, len(other), interval=0.05)
+        with self.assertRaises(TimeoutError):
+            read_station_position(host, port, timeout=0.3)
+
+
+class MasterPositionCacheTest(unittest.TestCase):
+
+    def make_cache(self, results, **kwargs):
+        calls = []
+
+        def reader(host, port, timeout):
+            calls.append((host, port))
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return MasterPositionCache(reader=reader, **kwargs), calls
+
+    def test_failure_is_cached_for_retry_window(self):
+        cache, calls = self.make_cache([ConnectionRefusedError(111, "Connection refused")])
+        self.assertIsNone(cache.get('127.0.0.1', 2101))
+        self.assertIsNone(cache.get('127.0.0.1', 2101))
+        self.assertEqual(len(calls), 1)
+
+    def test_failure_retried_after_window(self):
+        cache, calls = self.make_cache([TimeoutError("nessun 1005"), POSITION], retry_after=0)
+        self.assertIsNone(cache.get('127.0.0.1', 2101))
+        self.assertEqual(cache.get('127.0.0.1', 2101), POSITION)
+        self.assertEqual(len(calls), 2)
+
+    def test_failure_keeps_last_known_position(self):
+        cache, calls = self.make_cache([POSITION, OSError("rete non raggiungibile")], ttl=0)
+        self.assertEqual(cache.get('127.0.0.1', 2101), POSITION)
+        self.assertEqual(cache.get('127.0.0.1', 2101), POSITION)
+        self.assertEqual(cache.get('127.0.0.1', 2101), POSITION)
+        self.assertEqual(len(calls), 2)
+
+    def test_concurrent_callers_share_one_read(self):
+        release = threading.Event()
+        calls = []
+
+        def reader(host, port, timeout):
+            calls.append((host, port))
+            release.wait(5)
+            return POSITION
+
+        cache = MasterPositionCache(reader=reader)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('127.0.0.1', 2101))) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        # Tutti i chiamanti sono in attesa della stessa lettura
+        while not calls:
+            threading.Event().wait(0.01)
+        threading.Event().wait(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [POSITION] * 20)
+
+    def test_invalidate_forgets_failure(self):
+        cache, calls = self.make_cache([OSError("rete non raggiungibile"), POSITION])
+        self.assertIsNone(cache.get('127.0.0.1', 2101))
+        cache.invalidate('127.0.0.1', 2101)
+        self.assertEqual(cache.get('127.0.0.1', 2101), POSITION)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Configurazione di rtkrcv: livelli di profili/override e scrittura solo se il contenuto cambia.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rtkrcv_config import RtkrcvConfigEngine  # noqa: E402
+
+ROVER = {'name': 'rover', 'serial': 'R0', 'ip': '10.0.0.3', 'port': 2222}
+MASTER = {'name': 'master', 'serial': 'M0', 'ip': '10.0.0.2', 'port': 2101}
+COORDS = {'lat': 45.0641, 'lon': 7.6697, 'alt': 239.0}
+
+
+def options(content):
+    return dict((part.strip() for part in line.split('=', 1)) for line in content.splitlines()
+                if '=' in line and not line.startswith('#'))
+
+
+class RenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = RtkrcvConfigEngine()
+
+    def render(self, rover=ROVER):
+        return options(self.engine.render(rover, MASTER, COORDS, 'file', '/tmp/R0.pos'))
+
+    def test_session_values(self):
+        values = self.render()
+        self.assertEqual((values['ant2-pos1'], values['inpstr1-path'], values['inpstr2-path']),
+                         ('45.0641', '10.0.0.3:2222', '10.0.0.2:2101'))
+        self.assertEqual((values['outstr1-type'], values['outstr1-path']), ('file', '/tmp/R0.pos'))
+
+    def test_layers(self):
+        self.engine.set_campaign({'profile': 'fast-static', 'options': {'pos1-elmask': '12', 'misc-extra': 'x'}})
+        values = self.render()
+        self.assertEqual((values['pos1-elmask'], values['pos2-arthres'], values['misc-extra']), ('12', '2.5', 'x'))
+        # Profilo e opzioni del rover prevalgono su quelli della campagna
+        values = self.render(dict(ROVER, profile='kinematic', options={'pos1-elmask': '20'}))
+        self.assertEqual((values['pos1-posmode'], values['pos2-arthres'], values['pos1-elmask']),
+                         ('kinematic', '3', '20'))
+
+    def test_invalid_settings(self):
+        for settings in ({'profile': 'inesistente'}, {'options': {'ant2-pos1': '0'}},
+                         {'options': {'pos1-elmask': '10\ninpstr1-path=x'}}, {'sconosciuto': 1}):
+            with self.subTest(settings=settings):
+                self.assertRaises(ValueError, self.engine.set_campaign, settings)
+
+
+class WriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test-rtkrcv-config-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.path = os.path.join(self.workdir, 'R0.conf')
+        self.engine = RtkrcvConfigEngine()
+
+    def write(self, engine=None):
+        engine = engine or self.engine
+        return engine.write(self.path, engine.render(ROVER, MASTER, COORDS, 'file', '/tmp/R0.pos'))
+
+    def mtime(self):
+        return os.stat(self.path).st_mtime_ns
+
+    def test_identical_write_keeps_mtime(self):
+        self.assertTrue(self.write())
+        mtime = self.mtime()
+        self.assertFalse(self.write())
+        self.assertEqual(self.mtime(), mtime)
+        # Anche un nuovo motore (riavvio del manager) riconosce il file invariato
+        self.assertFalse(self.write(RtkrcvConfigEngine()))
+        self.assertEqual(self.mtime(), mtime)
+
+    def test_campaign_change_rewrites(self):
+        self.write()
+        os.utime(self.path, ns=(0, 0))
+        self.engine.set_campaign({'options': {'pos1-elmask': '25'}})
+        self.assertTrue(self.write())
+        self.assertNotEqual(self.mtime(), 0)
+        with open(self.path) as f:
+            self.assertEqual(options(f.read())['pos1-elmask'], '25')
+
+    def test_external_change_rewrites(self):
+        self.write()
+        with open(self.path, 'a') as f:
+            f.write('pos1-elmask =0\n')
+        self.assertTrue(self.write())
+        with open(self.path) as f:
+            self.assertEqual(options(f.read())['pos1-elmask'], '15')
+        self.assertEqual(os.listdir(self.workdir), ['R0.conf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+"""Pianificatore delle sessioni: posti liberi, ordine per fix attesi, durata massima e nuovi tentativi.
+
+Il SessionManager e lo storico sono sostituiti da oggetti minimi con la
+stessa interfaccia: le sessioni terminano quando il test pubblica il loro
+stato finale sull'EventBus, come fa il manager.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from convergence import StopCriteria  # noqa: E402
+from events import EventBus  # noqa: E402
+from scheduler import SessionScheduler  # noqa: E402
+
+
+class FakeSessions:
+    """Manager locale simulato: start_session registra l'avvio, finish() lo chiude."""
+
+    def __init__(self, failing=()):
+        self.events = EventBus()
+        self.stop_criteria = StopCriteria()
+        self.failing = set(failing)
+        self.started = []  # (serial, criteria) nell'ordine di avvio
+        self.active = {}  # serial -> stato
+        self.lock = threading.Lock()
+
+    def start_session(self, rover, master, criteria=None):
+        serial = rover['serial']
+        with self.lock:
+            self.started.append((serial, criteria))
+            if serial in self.failing:
+                return False, "Rover non raggiungibile"
+            self.active[serial] = 'running'
+        self.events.publish('status', {'serial': serial, 'status': 'running'})
+        return True, "Sessione avviata"
+
+    def finish(self, serial, status):
+        with self.lock:
+            self.active.pop(serial, None)
+        self.events.publish('status', {'serial': serial, 'status': status})
+
+    def get_active_serials(self):
+        with self.lock:
+            return list(self.active)
+
+    def get_snapshots(self):
+        with self.lock:
+            return {serial: SimpleNamespace(status=status) for serial, status in self.active.items()}
+
+    def get_session_status(self, serial):
+        with self.lock:
+            return self.active.get(serial, 'stopped')
+
+    def started_serials(self):
+        with self.lock:
+            return [serial for serial, _ in self.started]
+
+
+class FakeHistory:
+    """Statistiche dei tempi al fix come HistoryStore.ttf_stats, per gruppo."""
+
+    def __init__(self, stats):
+        self.stats = stats  # by -> {chiave: (mediana, p90, tasso di fix, sessioni)}
+
+    def ttf_stats(self, since=None, source=None, by='serial'):
+        return {key: {'fix_rate': rate, 'time_to_fix': {'median': median, 'p90': p90, 'count': count}}
+                for key, (median, p90, rate, count) in self.stats.get(by, {}).items()}
+
+
+def pair(serial, master='M0'):
+    return {'serial': serial, 'name': serial}, {'serial': master}
+
+
+class SessionSchedulerTest(unittest.TestCase):
+
+    def make(self, sessions, history=None, **kwargs):
+        kwargs.setdefault('retry_delay', 0)
+        kwargs.setdefault('min_timeout', 0)
+        return SessionScheduler(sessions, history, **kwargs)
+
+    def wait_started(self, sessions, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(sessions.started) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Nessun avvio oltre quelli attesi
+        time.sleep(0.1)
+        return sessions.started_serials()
+
+    def wait_finished(self, scheduler, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(scheduler.status()['finished']) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return scheduler.status()
+
+    def test_slots_include_manual_sessions(self):
+        sessions = FakeSessions()
+        sessions.active['MANUALE'] = 'running'
+        scheduler = self.make(sessions, max_sessions=3)
+        results = scheduler.submit([pair(f'R{i}') for i in range(5)] + [pair('MANUALE')])
+        self.assertFalse(results['MANUALE']['success'])
+        self.assertEqual(self.wait_started(sessions, 2), ['R0', 'R1'])
+        # Senza storico: ordine di arrivo; un posto si libera a ogni sessione conclusa
+        sessions.finish('R0', 'fix')
+        self.assertEqual(self.wait_started(sessions, 3), ['R0', 'R1', 'R2'])
+        sessions.finish('MANUALE', 'stopped')
+        self.assertEqual(self.wait_started(sessions, 4), ['R0', 'R1', 'R2', 'R3'])
+        status = scheduler.status()
+        self.assertEqual([job['serial'] for job in status['queued']], ['R4'])
+        self.assertEqual(status['fixes_last_hour'], 1)
+        # Già in coda o in esecuzione
+        self.assertFalse(scheduler.submit([pair('R4'), pair('R1')])['R1']['success'])
+
+    def test_order_by_expected_fix_rate(self):
+        history = FakeHistory({
+            'serial': {'LENTO': (600, 900, 1.0, 5), 'VELOCE': (60, 90, 1.0, 5), 'INCERTO': (60, 90, 0.05, 5),
+                       'POCHI': (10, 10, 1.0, 1)},
+            'master': {'SITO': (120, 200, 1.0, 10)},
+        })
+        sessions = FakeSessions()
+        scheduler = self.make(sessions, history, max_sessions=1)
+        scheduler.submit([pair('NUOVO'), pair('LENTO'), pair('POCHI'), pair('INCERTO'), pair('VELOCE'),
+                          pair('NEL_SITO', master='SITO')])
+        for count in range(1, 6):
+            started = self.wait_started(sessions, count)
+            sessions.finish(started[-1], 'fix')
+        started = self.wait_started(sessions, 6)
+        # POCHI ha troppe poche sessioni: stima del sito, qui assente, quindi in fondo con NUOVO
+        self.assertEqual(started, ['VELOCE', 'NEL_SITO', 'LENTO', 'INCERTO', 'NUOVO', 'POCHI'])
+        expected = {job['serial']: job['expected'] for job in self.wait_finished(scheduler, 5)['finished']}
+        self.assertEqual(expected['NEL_SITO']['source'], 'master')
+        self.assertEqual(expected['NUOVO']['source'], None)
+
+    def test_timeout_then_retry_with_doubled_duration(self):
+        history = FakeHistory({'all': {'*': (100, 400, 1.0, 20)}})
+        sessions = FakeSessions()
+        scheduler = self.make(sessions, history, max_sessions=1, timeout_factor=3, max_retries=1)
+        scheduler.submit([pair('R0'), pair('R1')])
+        self.wait_started(sessions, 1)
+        sessions.finish('R0', 'timeout')
+        # Il nuovo tentativo di R0 parte dopo il primo tentativo di R1
+        self.wait_started(sessions, 2)
+        sessions.finish('R1', 'fix')
+        self.wait_started(sessions, 3)
+        sessions.finish('R0', 'timeout')
+        status = self.wait_finished(scheduler, 2)
+
+        self.assertEqual(sessions.started_serials(), ['R0', 'R1', 'R0'])
+        durations = [criteria.max_duration for _, criteria in sessions.started]
+        self.assertEqual(durations, [400, 400, 800])  # max(mediana * 3, p90), poi doppia
+        final = {job['serial']: (job['status'], job['attempt']) for job in status['finished']}
+        self.assertEqual(final, {'R0': ('timeout', 1), 'R1': ('fix', 0)})
+        self.assertEqual((status['queued'], status['running']), ([], []))
+
+    def test_requested_duration_is_kept_if_shorter(self):
+        history = FakeHistory({'all': {'*': (100, 400, 1.0, 20)}})
+        sessions = FakeSessions()
+        scheduler = self.make(sessions, history)
+        scheduler.submit([pair('R0')], StopCriteria(min_fixes=10, max_duration=50))
+        self.wait_started(sessions, 1)
+        criteria = sessions.started[0][1]
+        self.assertEqual((criteria.max_duration, criteria.min_fixes), (50, 10))
+
+    def test_failed_start_frees_slot(self):
+        sessions = FakeSessions(failing={'R0'})
+        scheduler = self.make(sessions, max_sessions=1)
+        scheduler.submit([pair('R0'), pair('R1')])
+        self.assertEqual(self.wait_started(sessions, 2), ['R0', 'R1'])
+        failed = self.wait_finished(scheduler, 1)['finished'][0]
+        self.assertEqual((failed['serial'], failed['status'], failed['message']),
+                         ('R0', 'failed', "Rover non raggiungibile"))
+
+    def test_cancel_and_configure(self):
+        sessions = FakeSessions()
+        scheduler = self.make(sessions, max_sessions=1)
+        scheduler.submit([pair('R0'), pair('R1'), pair('R2')])
+        self.wait_started(sessions, 1)
+        self.assertEqual(scheduler.cancel(['R2', 'R0']), ['R2'])
+        scheduler.configure(max_sessions=2)
+        self.assertEqual(self.wait_started(sessions, 2), ['R0', 'R1'])
+        for kwargs in ({'max_sessions': 0}, {'timeout_factor': 1}, {'max_retries': -1}):
+            with self.subTest(**kwargs):
+                self.assertRaises(ValueError, scheduler.configure, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
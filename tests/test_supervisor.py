@@ -0,0 +1,115 @@
+"""Supervisore dei processi: politica di riavvio con backoff, buffer dello stderr e limiti di risorse.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from supervisor import ProcessLimits, ProcessSupervisor, RestartPolicy, StderrBuffer  # noqa: E402
+from watcher import SessionWatcher  # noqa: E402
+
+FAKE_RTKRCV = os.path.join(ROOT, 'tools', 'fake_rtkrcv.py')
+
+
+class RestartPolicyTest(unittest.TestCase):
+
+    def test_backoff_doubles_up_to_max(self):
+        policy = RestartPolicy(backoff=1.0, max_backoff=5.0, max_restarts=5)
+        self.assertEqual([policy.restart_delay(1, n) for n in range(6)], [1.0, 2.0, 4.0, 5.0, 5.0, None])
+
+    def test_modes(self):
+        self.assertIsNone(RestartPolicy('on-failure').restart_delay(0, 0))
+        self.assertEqual(RestartPolicy('always').restart_delay(0, 0), 1.0)
+        self.assertIsNone(RestartPolicy('never').restart_delay(1, 0))
+        self.assertRaises(ValueError, RestartPolicy, 'sempre')
+
+
+class StderrBufferTest(unittest.TestCase):
+
+    def test_ring_buffer_limits(self):
+        buffer = StderrBuffer(max_lines=3, max_line_length=10)
+        buffer.feed(b'riga 1\nriga 2\nri')
+        buffer.feed(b'ga 3\nriga 4\n' + b'x' * 50 + b'\r\n')
+        self.assertEqual(buffer.lines(), ['riga 3', 'riga 4', 'x' * 10])
+
+    def test_unterminated_line_is_bounded(self):
+        buffer = StderrBuffer(max_lines=3, max_line_length=10)
+        for _ in range(1000):
+            buffer.feed(b'y' * 100)
+        self.assertEqual(buffer.lines(), ['y' * 10])
+        buffer.feed(b'\xff fine\nok')
+        self.assertEqual(buffer.lines(), ['y' * 10, 'ok'])
+
+
+class ProcessSupervisorTest(unittest.TestCase):
+    """Processi reali: tools/fake_rtkrcv.py, che termina con codice 1 dopo FAKE_RTKRCV_CRASH_AFTER."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test-supervisor-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.config_path = os.path.join(self.workdir, 'R0.conf')
+        with open(self.config_path, 'w') as f:
+            f.write(f"outstr1-type =file\noutstr1-path ={os.path.join(self.workdir, 'R0.pos')}\n"
+                    "ant2-pos1 =45.0641\nant2-pos2 =7.6697\nant2-pos3 =239.0\n")
+        self.watcher = SessionWatcher()
+
+    def command(self, crash_after=''):
+        # Il supervisore non passa variabili d'ambiente: si usa env(1)
+        return ['env', f'FAKE_RTKRCV_CRASH_AFTER={crash_after}', 'FAKE_RTKRCV_RATE=20',
+                sys.executable, FAKE_RTKRCV, '-s', '-o', self.config_path]
+
+    def test_crash_restarts_with_backoff_then_fails(self):
+        supervisor = ProcessSupervisor(self.watcher, policy=RestartPolicy(backoff=0.2, max_backoff=0.4, max_restarts=3))
+        exits = []
+        done = threading.Event()
+
+        def on_exit(handle, returncode, delay):
+            exits.append((time.monotonic(), returncode, delay))
+            if delay is None:
+                done.set()
+            else:
+                self.watcher.call_later(delay, lambda: supervisor.respawn(handle))
+
+        handle = supervisor.spawn('R0', self.command(crash_after=0.1), on_exit=on_exit)
+        self.assertTrue(done.wait(20))
+        self.assertEqual([(code, delay) for _, code, delay in exits], [(1, 0.2), (1, 0.4), (1, 0.4), (1, None)])
+        self.assertEqual((handle.state, handle.restarts, handle.returncode), ('failed', 3, 1))
+        # Ogni processo vive almeno crash_after: la distanza fra le uscite include l'attesa
+        for (previous, _, delay), (current, _, _) in zip(exits, exits[1:]):
+            self.assertGreaterEqual(current - previous, delay + 0.1)
+        self.assertIn('crash simulato', '\n'.join(handle.stderr.lines()))
+
+    def test_stopped_process_is_not_restarted(self):
+        supervisor = ProcessSupervisor(self.watcher, policy=RestartPolicy('always', backoff=0.1))
+        exits = []
+        done = threading.Event()
+        handle = supervisor.spawn('R0', self.command(), on_exit=lambda h, code, delay: (exits.append(delay), done.set()))
+        self.assertEqual(handle.info()['state'], 'running')
+        supervisor.terminate(handle)
+        self.assertTrue(done.wait(10))
+        self.assertEqual((exits, handle.state), ([None], 'stopped'))
+        self.assertFalse(supervisor.respawn(handle))
+
+    def test_limits_applied(self):
+        limits = ProcessLimits(nice=5, rlimits={'RLIMIT_NOFILE': 256, 'RLIMIT_CORE': 0})
+        supervisor = ProcessSupervisor(self.watcher, limits=limits)
+        handle = supervisor.spawn('R0', self.command())
+        self.addCleanup(supervisor.stop, handle)
+        pid = handle.process.pid
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, pid), min(19, os.getpriority(os.PRIO_PROCESS, 0) + 5))
+        self.assertEqual(resource.prlimit(pid, resource.RLIMIT_NOFILE), (256, 256))
+        self.assertEqual(resource.prlimit(pid, resource.RLIMIT_CORE), (0, 0))
+        self.assertRaises(ValueError, ProcessLimits, rlimits={'RLIMIT_INESISTENTE': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
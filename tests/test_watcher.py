@@ -0,0 +1,157 @@
+"""Watcher delle sessioni: timer, file .pos, terminazione dei processi e streaming.
+
+Eseguibile con `python -m pytest tests` oppure `python -m unittest discover tests`.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from watcher import SessionWatcher  # noqa: E402
+
+FAKE_RTKRCV = os.path.join(ROOT, 'tools', 'fake_rtkrcv.py')
+
+# Finto rtkrcv: si collega, invia tutte le epoche in una volta e termina subito
+SENDER = textwrap.dedent("""\
+    import socket, sys
+    port, count = int(sys.argv[1]), int(sys.argv[2])
+    line = "2026/10/18 09:00:%06.3f   45.064819837    7.671223711   240.5037   1  23   0.0050   0.0050   0.0100   0.0000   0.0000   0.0000   1.00   19.6\\n"
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        sock.sendall(''.join(line % (i % 60) for i in range(count)).encode())
+""")
+
+
+def start_fake_rtkrcv(workdir, crash_after, stderr=None):
+    """Avvia tools/fake_rtkrcv.py con uscita su file; restituisce (processo, percorso del .pos)."""
+    pos_path = os.path.join(workdir, 'output', 'R0.pos')
+    config_path = os.path.join(workdir, 'R0.conf')
+    with open(config_path, 'w') as f:
+        f.write(f"outstr1-type =file\noutstr1-path ={pos_path}\n"
+                "ant2-pos1 =45.0641\nant2-pos2 =7.6697\nant2-pos3 =239.0\n")
+    env = dict(os.environ, FAKE_RTKRCV_RATE='50', FAKE_RTKRCV_SINGLE='0.1', FAKE_RTKRCV_FLOAT='0.1',
+               FAKE_RTKRCV_CRASH_AFTER=str(crash_after), FAKE_RTKRCV_SEED='1')
+    process = subprocess.Popen([sys.executable, FAKE_RTKRCV, '-s', '-o', config_path], env=env, stderr=stderr)
+    return process, pos_path
+
+
+def count_epochs(path):
+    with open(path) as f:
+        return sum(1 for line in f if line.strip() and not line.startswith('%'))
+
+
+class TimerTest(unittest.TestCase):
+
+    def test_call_later_order(self):
+        watcher = SessionWatcher()
+        calls = []
+        done = threading.Event()
+        watcher.call_later(0.15, lambda: calls.append('c'))
+        watcher.call_later(0.05, lambda: calls.append('a'))
+        watcher.call_later(0.1, lambda: calls.append('b1'))
+        watcher.call_later(0.1, lambda: calls.append('b2'))  # Stessa scadenza: ordine di inserimento
+        watcher.call_later(0.2, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls, ['a', 'b1', 'b2', 'c'])
+
+    def test_call_later_delay_and_thread(self):
+        watcher = SessionWatcher()
+        fired = []
+        done = threading.Event()
+        started = time.monotonic()
+        watcher.call_later(0.2, lambda: (fired.append((time.monotonic() - started, threading.current_thread().name)),
+                                         done.set()))
+        self.assertTrue(done.wait(5))
+        elapsed, thread = fired[0]
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertEqual(thread, 'session-watcher')
+
+    def test_failing_timer_does_not_stop_watcher(self):
+        watcher = SessionWatcher()
+        done = threading.Event()
+        watcher.call_later(0, lambda: 1 / 0)
+        watcher.call_later(0.05, done.set)
+        self.assertTrue(done.wait(5))
+
+
+class FileSessionTest(unittest.TestCase):
+    """Sessioni su file .pos con tools/fake_rtkrcv.py, con inotify e con il poller."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test-watcher-')
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+
+    def test_epochs_then_exit(self):
+        for use_inotify in (True, False):
+            with self.subTest(use_inotify=use_inotify):
+                watcher = SessionWatcher(use_inotify=use_inotify)
+                workdir = os.path.join(self.workdir, 'inotify' if use_inotify else 'poll')
+                os.makedirs(workdir)
+                process, pos_path = start_fake_rtkrcv(workdir, crash_after=0.5)
+                epochs = []
+                exited = threading.Event()
+                watcher.watch('R0', pos_path, process, lambda serial, epoch: epochs.append(epoch),
+                              lambda serial: exited.set())
+                self.assertTrue(exited.wait(10))
+                process.wait()
+                # Anche le epoche scritte subito prima della terminazione
+                self.assertEqual(len(epochs), count_epochs(pos_path))
+                self.assertEqual({epoch['q'] for epoch in epochs} & {1, 2, 5}, {1, 2, 5})
+
+    def test_done_epoch_stops_watching(self):
+        watcher = SessionWatcher()
+        process, pos_path = start_fake_rtkrcv(self.workdir, crash_after=1.0)
+        epochs = []
+        exited = threading.Event()
+        watcher.watch('R0', pos_path, process, lambda serial, epoch: epochs.append(epoch) or epoch['q'] == 1,
+                      lambda serial: exited.set())
+        process.wait()
+        # La sessione è stata rimossa al primo FIX: la terminazione non viene più notificata
+        self.assertFalse(exited.wait(0.5))
+        self.assertEqual(epochs[-1]['q'], 1)
+        self.assertEqual(sum(1 for epoch in epochs if epoch['q'] == 1), 1)
+
+    def test_watch_process_reaps_and_reads_stderr(self):
+        watcher = SessionWatcher()
+        process, _pos_path = start_fake_rtkrcv(self.workdir, crash_after=0.2, stderr=subprocess.PIPE)
+        stderr = []
+        exited = []
+        done = threading.Event()
+        watcher.watch_process(process, lambda proc: (exited.append(proc.returncode), done.set()), stderr.append)
+        self.assertTrue(done.wait(10))
+        self.assertEqual(exited, [1])
+        self.assertIn(b'crash simulato', b''.join(stderr))
+
+
+class StreamExitTest(unittest.TestCase):
+
+    def run_session(self, count, use_inotify):
+        watcher = SessionWatcher(use_inotify=use_inotify)
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        process = subprocess.Popen([sys.executable, '-c', SENDER, str(server.getsockname()[1]), str(count)])
+        epochs = []
+        exited = threading.Event()
+        watcher.watch_stream('R0', server, process, lambda serial, epoch: epochs.append(epoch), lambda serial: exited.set())
+        self.assertTrue(exited.wait(10))
+        process.wait()
+        return epochs
+
+    def test_all_epochs_read_before_exit(self):
+        # Più di una lettura da 64 KiB: le righe restano nel socket quando il processo termina
+        for use_inotify in (True, False):
+            with self.subTest(use_inotify=use_inotify):
+                self.assertEqual(len(self.run_session(3000, use_inotify)), 3000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Simulatore di rnx2rtkp per provare la rielaborazione offline (replay.py).
+
+Accetta gli argomenti usati dal manager (`-k <conf> -o <pos> file...`),
+legge dalla configurazione la posizione della base (ant2-pos1/2/3) e
+scrive subito nel file .pos le epoche di una sessione registrata: SINGLE,
+poi FLOAT, poi FIX, come tools/fake_rtkrcv.py e con le stesse variabili
+(FAKE_RTKRCV_RATE, FAKE_RTKRCV_SINGLE, FAKE_RTKRCV_FLOAT, FAKE_RTKRCV_NOISE,
+FAKE_RTKRCV_BASELINE, FAKE_RTKRCV_SEED), più:
+
+    FAKE_RNX2RTKP_DURATION   secondi di dati (default 3600)
+    FAKE_RNX2RTKP_START      inizio dei dati, AAAA/MM/GG hh:mm:ss UTC (default: mtime del primo file)
+    FAKE_RNX2RTKP_FAIL       termina con codice 1 senza soluzioni
+
+Uso (come rnx2rtkp):
+    python tools/fake_rnx2rtkp.py -k replay/ROVER01.conf -o replay/ROVER01.pos rover.obs base.obs base.nav
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_rtkrcv import HEADER, SIGMA, env_float, format_epoch, offset_llh, read_config  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='config', required=True, help="file di opzioni")
+    parser.add_argument('-o', dest='output', required=True, help="file .pos di uscita")
+    parser.add_argument('files', nargs='+', help="osservazioni del rover e della base, navigazione")
+    args, _ = parser.parse_known_args()
+
+    if os.environ.get('FAKE_RNX2RTKP_FAIL'):
+        print("fake_rnx2rtkp: errore simulato", file=sys.stderr)
+        return 1
+    missing = [path for path in args.files if not os.path.exists(path)]
+    if missing:
+        print(f"fake_rnx2rtkp: file non trovato: {missing[0]}", file=sys.stderr)
+        return 1
+
+    options = read_config(args.config)
+    base = [float(options.get(f'ant2-pos{i}') or 0) for i in (1, 2, 3)]
+    baseline = [float(v) for v in os.environ.get('FAKE_RTKRCV_BASELINE', '120,80,1.5').split(',')]
+    truth = offset_llh(*base, *baseline)
+
+    rate = env_float('FAKE_RTKRCV_RATE', 1.0)
+    single_time = env_float('FAKE_RTKRCV_SINGLE', 5.0)
+    float_time = env_float('FAKE_RTKRCV_FLOAT', 20.0)
+    noise = env_float('FAKE_RTKRCV_NOISE', 0.005)
+    duration = env_float('FAKE_RNX2RTKP_DURATION', 3600.0)
+    rng = random.Random(os.environ.get('FAKE_RTKRCV_SEED'))
+    if os.environ.get('FAKE_RNX2RTKP_START'):
+        start = datetime.strptime(os.environ['FAKE_RNX2RTKP_START'], '%Y/%m/%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    else:
+        start = datetime.fromtimestamp(int(os.path.getmtime(args.files[0])), timezone.utc)
+
+    lines = list(HEADER)
+    for i in range(int(duration * rate)):
+        elapsed = i / rate
+        q = 5 if elapsed < single_time else 2 if elapsed < single_time + float_time else 1
+        sigma = SIGMA.get(q, noise)
+        if q == 2:
+            sigma = max(noise * 4, sigma * (1 - (elapsed - single_time) / max(float_time, 1e-6)))
+        lat, lon, alt = offset_llh(*truth, rng.gauss(0, sigma), rng.gauss(0, sigma), rng.gauss(0, sigma * 2))
+        ratio = rng.uniform(5, 30) if q == 1 else rng.uniform(1, 2.9)
+        ns = rng.randint(4, 7) if q == 5 else rng.randint(12, 24)
+        lines.append(format_epoch(start + timedelta(seconds=elapsed), lat, lon, alt, q, ns, sigma, ratio))
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
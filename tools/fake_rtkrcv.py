@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Simulatore di rtkrcv per prove e benchmark senza ricevitori reali.
+
+Accetta gli stessi argomenti usati dal manager (`-s -o <conf>`), legge
+dalla configurazione la destinazione delle soluzioni (outstr1-type/path:
+file oppure tcpcli) e la posizione del master (ant2-pos1/2/3), e scrive
+epoche .pos realistiche: SINGLE, poi FLOAT, poi FIX, con rumore
+decrescente attorno a una posizione del rover a distanza fissa dal master.
+
+Il comportamento si regola con variabili d'ambiente (il manager non
+passa altri argomenti):
+
+    FAKE_RTKRCV_RATE         epoche al secondo (default 1)
+    FAKE_RTKRCV_SINGLE       secondi in SINGLE prima del FLOAT (default 5)
+    FAKE_RTKRCV_FLOAT        secondi in FLOAT prima del FIX (default 20)
+    FAKE_RTKRCV_NOISE        rumore (m, 1 sigma) delle epoche FIX (default 0.005)
+    FAKE_RTKRCV_BASELINE     baseline E,N,U dal master in metri (default 120,80,1.5)
+    FAKE_RTKRCV_CRASH_AFTER  termina con codice 1 dopo questi secondi
+    FAKE_RTKRCV_DELAY        ritardo aggiuntivo (s) di ogni epoca: output lento
+    FAKE_RTKRCV_STALL        probabilità per epoca di fermarsi 5 s senza scrivere
+    FAKE_RTKRCV_SEED         seme del generatore casuale
+
+Uso (come rtkrcv):
+    FAKE_RTKRCV_FLOAT=2 python tools/fake_rtkrcv.py -s -o config/ROVER01.conf
+"""
+import argparse
+import math
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+GPS_UTC_OFFSET = timedelta(seconds=18)
+HEADER = [
+    "% program   : RTKLIB ver.2.4.3 (simulatore)",
+    "%  GPST                  latitude(deg) longitude(deg)  height(m)   Q  ns   sdn(m)   sde(m)   sdu(m)"
+    "  sdne(m)  sdeu(m)  sdun(m) age(s)  ratio",
+]
+
+# Deviazione standard (m) iniziale per qualità della soluzione (FIX: FAKE_RTKRCV_NOISE)
+SIGMA = {2: 0.3, 5: 2.0}
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def read_config(path):
+    options = {}
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if '=' in line:
+                key, value = line.split('=', 1)
+                options[key.strip()] = value.strip()
+    return options
+
+
+def offset_llh(lat, lon, alt, e, n, u):
+    """Posizione spostata di (e, n, u) metri: approssimazione locale, sufficiente per pochi km."""
+    a, e2 = 6378137.0, 0.00669437999014
+    phi = math.radians(lat)
+    w = math.sqrt(1 - e2 * math.sin(phi) ** 2)
+    meridian = a * (1 - e2) / w ** 3
+    normal = a / w
+    return (lat + math.degrees(n / meridian),
+            lon + math.degrees(e / (normal * math.cos(phi))),
+            alt + u)
+
+
+class Output:
+    """Destinazione delle soluzioni: file .pos oppure client TCP (come outstr1)."""
+
+    def __init__(self, kind, path):
+        self.kind = kind
+        self.path = path
+        self._file = None
+        self._sock = None
+
+    def open(self):
+        if self.kind == 'tcpcli':
+            host, port = self.path.rsplit(':', 1)
+            self._sock = socket.create_connection((host, int(port)), timeout=10)
+        else:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'w', buffering=1)
+        self.write(HEADER)
+
+    def write(self, lines):
+        data = ''.join(line + '\n' for line in lines)
+        if self._sock is not None:
+            self._sock.sendall(data.encode())
+        else:
+            self._file.write(data)
+
+
+def format_epoch(now, lat, lon, alt, q, ns, sigma, ratio):
+    gpst = (now + GPS_UTC_OFFSET).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3]
+    return (f"{gpst} {lat:14.9f} {lon:14.9f} {alt:10.4f} {q:3d} {ns:3d} "
+            f"{sigma:8.4f} {sigma:8.4f} {sigma * 2:8.4f} {0:8.4f} {0:8.4f} {0:8.4f} {1.0:6.2f} {ratio:6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-s', action='store_true', help="avvio immediato (ignorato)")
+    parser.add_argument('-o', dest='config', required=True, help="file di configurazione rtkrcv")
+    args, _ = parser.parse_known_args()
+
+    options = read_config(args.config)
+    master = [float(options.get(f'ant2-pos{i}') or 0) for i in (1, 2, 3)]
+    baseline = [float(v) for v in os.environ.get('FAKE_RTKRCV_BASELINE', '120,80,1.5').split(',')]
+    truth = offset_llh(*master, *baseline)
+
+    rate = env_float('FAKE_RTKRCV_RATE', 1.0)
+    single_time = env_float('FAKE_RTKRCV_SINGLE', 5.0)
+    float_time = env_float('FAKE_RTKRCV_FLOAT', 20.0)
+    noise = env_float('FAKE_RTKRCV_NOISE', 0.005)
+    crash_after = env_float('FAKE_RTKRCV_CRASH_AFTER', None)
+    delay = env_float('FAKE_RTKRCV_DELAY', 0.0)
+    stall = env_float('FAKE_RTKRCV_STALL', 0.0)
+    rng = random.Random(os.environ.get('FAKE_RTKRCV_SEED'))
+
+    # Arresto pulito su SIGTERM, come rtkrcv
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    output = Output(options.get('outstr1-type', 'file'), options.get('outstr1-path', 'output/fake.pos'))
+    try:
+        output.open()
+    except OSError as e:
+        print(f"fake_rtkrcv: impossibile aprire l'output {output.path}: {e}", file=sys.stderr)
+        return 2
+
+    start = time.monotonic()
+    period = 1.0 / rate
+    next_epoch = start
+    while True:
+        elapsed = time.monotonic() - start
+        if crash_after is not None and elapsed >= crash_after:
+            print("fake_rtkrcv: crash simulato", file=sys.stderr)
+            return 1
+
+        if elapsed < single_time:
+            q = 5
+        elif elapsed < single_time + float_time:
+            q = 2
+        else:
+            q = 1
+        sigma = SIGMA.get(q, noise)
+        if q == 2:
+            # Il FLOAT converge progressivamente verso il FIX
+            sigma = max(noise * 4, sigma * (1 - (elapsed - single_time) / max(float_time, 1e-6)))
+        lat, lon, alt = offset_llh(*truth, rng.gauss(0, sigma), rng.gauss(0, sigma), rng.gauss(0, sigma * 2))
+        ratio = rng.uniform(5, 30) if q == 1 else rng.uniform(1, 2.9)
+        ns = rng.randint(4, 7) if q == 5 else rng.randint(12, 24)
+        try:
+            output.write([format_epoch(datetime.now(timezone.utc), lat, lon, alt, q, ns, sigma, ratio)])
+        except OSError as e:
+            print(f"fake_rtkrcv: errore di scrittura: {e}", file=sys.stderr)
+            return 2
+
+        if stall and rng.random() < stall:
+            time.sleep(5)
+            next_epoch = time.monotonic()
+        next_epoch += period + delay
+        time.sleep(max(0.0, next_epoch - time.monotonic()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
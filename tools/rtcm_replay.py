@@ -0,0 +1,75 @@
+"""Server TCP che riproduce uno stream RTCM3, in sostituzione di un master reale.
+
+Ogni client connesso riceve il contenuto di un file RTCM registrato (ad
+esempio con `str2str -in tcpcli://master:2222 -out file://master.rtcm`),
+ripetuto in ciclo e a velocità controllata. In alternativa, senza file,
+il server genera un messaggio 1005 con la posizione indicata.
+
+Uso:
+    python tools/rtcm_replay.py --file master.rtcm --port 2222
+    python tools/rtcm_replay.py --station 45.0641 7.6697 239.0 --port 2222
+"""
+import argparse
+import os
+import socketserver
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import rtcm  # noqa: E402
+from geodesy import llh_to_ecef  # noqa: E402
+
+
+def make_handler(data, chunk_size, interval):
+    class ReplayHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            print(f"Client connesso: {self.client_address[0]}:{self.client_address[1]}")
+            try:
+                while True:
+                    for offset in range(0, len(data), chunk_size):
+                        self.request.sendall(data[offset:offset + chunk_size])
+                        time.sleep(interval)
+            except OSError:
+                pass
+            print(f"Client disconnesso: {self.client_address[0]}:{self.client_address[1]}")
+    return ReplayHandler
+
+
+class ThreadingServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--file', help="file RTCM3 registrato")
+    source.add_argument('--station', nargs=3, type=float, metavar=('LAT', 'LON', 'ALT'),
+                        help="genera un messaggio 1005 con questa posizione")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--chunk-size', type=int, default=1024, help="byte inviati per volta")
+    parser.add_argument('--interval', type=float, default=0.1, help="pausa fra due invii (s)")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            data = f.read()
+    else:
+        # Un 1005 al secondo, come un master reale
+        data = rtcm.build_frame(rtcm.encode_station(0, *llh_to_ecef(*args.station)))
+        args.chunk_size = len(data)
+        args.interval = 1.0
+
+    with ThreadingServer((args.host, args.port), make_handler(data, args.chunk_size, args.interval)) as server:
+        print(f"Replay RTCM su {args.host}:{args.port} ({len(data)} byte in ciclo)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+import ctypes
+import ctypes.util
+import heapq
+import itertools
+import os
+import selectors
+import struct
+import threading
+import time
+
+from metrics import REGISTRY
+from pos_reader import PosStreamReader, PosTailReader
+
+LOOP_DURATION = REGISTRY.histogram('rtkrcv_watcher_loop_seconds',
+                                   "Durata di un giro del watcher (esclusa l'attesa in select)")
+BYTES_READ = REGISTRY.histogram('rtkrcv_watcher_read_bytes', "Byte di soluzioni letti per lettura", ['source'],
+                                buckets=(0, 128, 512, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+
+# Costanti inotify (da <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """Wrapper minimale di inotify tramite ctypes (solo Linux)."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 fallita")
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch fallita per {path}")
+        return wd
+
+    def read_events(self):
+        """Restituisce una lista di (wd, mask, nome) per gli eventi pendenti."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            pos = 0
+            while pos + _EVENT_HEADER.size <= len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+                pos += _EVENT_HEADER.size
+                name = data[pos:pos + length].rstrip(b'\0').decode('utf-8', errors='replace')
+                pos += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _open_pidfd(process):
+    """Apre un pidfd per il processo, se supportato dal sistema."""
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(process.pid)
+    except OSError:
+        return None
+
+
+class SessionWatcher:
+    """Unico thread che osserva i file .pos e i processi di tutte le sessioni.
+
+    Su Linux usa inotify sulle directory di output e un pidfd per ogni
+    processo, così una nuova riga o la terminazione di rtkrcv vengono
+    notificate immediatamente. Dove non disponibili, ricade su un unico
+    poller periodico per tutte le sessioni. In entrambi i casi il numero
+    di thread è costante, indipendentemente dal numero di rover.
+    """
+
+    def __init__(self, poll_interval=0.05, use_inotify=True):
+        self.poll_interval = poll_interval
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._pending = []  # Comandi da applicare nel thread del watcher
+        self._entries = {}  # serial -> dati della sessione osservata
+        self._processes = {}  # pid -> processo osservato (terminazione e stderr)
+        self._by_path = {}  # percorso assoluto -> serial
+        self._dir_watches = {}  # wd -> directory
+        self._timers = []  # heap di (scadenza, seq, callback)
+        self._timer_seq = itertools.count()
+        self._thread = None
+
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, ('wake', None))
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+                self._selector.register(self._inotify.fd, selectors.EVENT_READ, ('inotify', None))
+            except (OSError, AttributeError):
+                self._inotify = None
+
+    @property
+    def mode(self):
+        return 'inotify' if self._inotify else 'poll'
+
+    def watch(self, serial, path, process, on_epoch, on_exit, on_lines=None):
+        """Inizia a osservare il file .pos e il processo di una sessione.
+
+        on_epoch(serial, epoch) viene chiamata per ogni nuova epoca; se
+        restituisce True l'osservazione della sessione termina.
+        on_exit(serial) viene chiamata quando il processo termina.
+        on_lines(serial, lines), se indicata, riceve le nuove righe grezze.
+        """
+        self._submit(('watch', serial, os.path.abspath(path), process, on_epoch, on_exit, on_lines))
+
+    def watch_stream(self, serial, server_socket, process, on_epoch, on_exit, on_lines=None):
+        """Come watch(), ma le soluzioni arrivano su un socket TCP in ascolto.
+
+        Il watcher accetta le connessioni di rtkrcv su server_socket e ne
+        diventa proprietario (lo chiude con unwatch). on_lines(serial, lines)
+        riceve le righe grezze, ad esempio per archiviarle o inoltrarle.
+        """
+        self._submit(('watch_stream', serial, server_socket, process, on_epoch, on_exit, on_lines))
+
+    def watch_process(self, process, on_exit, on_stderr=None):
+        """Osserva un processo indipendentemente dalle sessioni.
+
+        on_exit(process) viene chiamata dopo che il processo è terminato ed
+        è stato raccolto (nessuno zombie). Se process.stderr è una pipe e
+        on_stderr è indicata, on_stderr(data) riceve i byte letti.
+        """
+        self._submit(('watch_process', process, on_exit, on_stderr))
+
+    def unwatch(self, serial):
+        """Smette di osservare una sessione."""
+        self._submit(('unwatch', serial))
+
+    def call_later(self, delay, callback):
+        """Esegue callback() nel thread del watcher dopo delay secondi."""
+        self._submit(('timer', time.monotonic() + delay, callback))
+
+    def _submit(self, command):
+        with self._lock:
+            self._pending.append(command)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='session-watcher', daemon=True)
+                self._thread.start()
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass  # Il thread è già stato svegliato
+
+    def _apply_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for command in pending:
+            if command[0] == 'watch':
+                self._add_entry(*command[1:])
+            elif command[0] == 'watch_stream':
+                self._add_stream_entry(*command[1:])
+            elif command[0] == 'watch_process':
+                self._add_process(*command[1:])
+            elif command[0] == 'unwatch':
+                self._remove_entry(command[1])
+            elif command[0] == 'timer':
+                heapq.heappush(self._timers, (command[1], next(self._timer_seq), command[2]))
+
+    def _add_entry(self, serial, path, process, on_epoch, on_exit, on_lines):
+        self._remove_entry(serial)
+        entry = {
+            'serial': serial,
+            'path': path,
+            'reader': PosTailReader(path),
+            'server': None,
+            'process': process,
+            'pidfd': _open_pidfd(process),
+            'on_epoch': on_epoch,
+            'on_exit': on_exit,
+            'on_lines': on_lines,
+        }
+        if entry['pidfd'] is not None:
+            self._selector.register(entry['pidfd'], selectors.EVENT_READ, ('pidfd', serial))
+        if self._inotify:
+            directory = os.path.dirname(path)
+            if directory not in self._dir_watches.values():
+                os.makedirs(directory, exist_ok=True)
+                wd = self._inotify.add_watch(directory, IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO)
+                self._dir_watches[wd] = directory
+        self._entries[serial] = entry
+        self._by_path[path] = serial
+        # Il file potrebbe già contenere dati
+        self._read_entry(entry)
+
+    def _add_stream_entry(self, serial, server_socket, process, on_epoch, on_exit, on_lines):
+        self._remove_entry(serial)
+        server_socket.setblocking(False)
+        entry = {
+            'serial': serial,
+            'path': None,
+            'reader': None,
+            'stream': PosStreamReader(),
+            'server': server_socket,
+            'connections': [],
+            'process': process,
+            'pidfd': _open_pidfd(process),
+            'on_epoch': on_epoch,
+            'on_exit': on_exit,
+            'on_lines': on_lines,
+        }
+        if entry['pidfd'] is not None:
+            self._selector.register(entry['pidfd'], selectors.EVENT_READ, ('pidfd', serial))
+        self._selector.register(server_socket, selectors.EVENT_READ, ('accept', serial))
+        self._entries[serial] = entry
+
+    def _add_process(self, process, on_exit, on_stderr):
+        watched = {
+            'process': process,
+            'pidfd': _open_pidfd(process),
+            'stderr': None,
+            'on_exit': on_exit,
+            'on_stderr': on_stderr,
+        }
+        if watched['pidfd'] is not None:
+            self._selector.register(watched['pidfd'], selectors.EVENT_READ, ('process', process.pid))
+        if process.stderr is not None and on_stderr is not None:
+            watched['stderr'] = process.stderr.fileno()
+            os.set_blocking(watched['stderr'], False)
+            self._selector.register(watched['stderr'], selectors.EVENT_READ, ('stderr', process.pid))
+        self._processes[process.pid] = watched
+
+    def _read_stderr(self, watched):
+        fd = watched['stderr']
+        if fd is None:
+            return
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._selector.unregister(fd)
+            watched['stderr'] = None
+            watched['process'].stderr.close()
+            return
+        try:
+            watched['on_stderr'](data)
+        except Exception as e:
+            print(f"Errore nella gestione dello stderr del processo {watched['process'].pid}: {e}")
+
+    def _check_process(self, pid):
+        watched = self._processes.get(pid)
+        if watched is None or watched['process'].poll() is None:
+            return
+        # Ultimi dati su stderr prima della chiusura
+        while watched['stderr'] is not None:
+            before = watched['stderr']
+            self._read_stderr(watched)
+            if watched['stderr'] == before:
+                break
+        del self._processes[pid]
+        if watched['pidfd'] is not None:
+            self._selector.unregister(watched['pidfd'])
+            os.close(watched['pidfd'])
+        if watched['stderr'] is not None:
+            self._selector.unregister(watched['stderr'])
+            watched['process'].stderr.close()
+        try:
+            watched['on_exit'](watched['process'])
+        except Exception as e:
+            print(f"Errore nella gestione della terminazione del processo {pid}: {e}")
+
+    def _remove_entry(self, serial):
+        entry = self._entries.pop(serial, None)
+        if entry is None:
+            return None
+        if entry['path'] is not None and self._by_path.get(entry['path']) == serial:
+            del self._by_path[entry['path']]
+        if entry['pidfd'] is not None:
+            self._selector.unregister(entry['pidfd'])
+            os.close(entry['pidfd'])
+        if entry['reader'] is not None:
+            entry['reader'].close()
+        if entry.get('server') is not None:
+            for conn in entry['connections']:
+                self._selector.unregister(conn)
+                conn.close()
+            self._selector.unregister(entry['server'])
+            entry['server'].close()
+        return entry
+
+    def _accept(self, entry):
+        try:
+            conn, _addr = entry['server'].accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        entry['connections'].append(conn)
+        self._selector.register(conn, selectors.EVENT_READ, ('conn', entry['serial']))
+
+    def _receive(self, entry, conn):
+        """Legge dal socket di rtkrcv; restituisce False se non c'era nulla da leggere."""
+        try:
+            data = conn.recv(64 * 1024)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b''
+        BYTES_READ.labels('stream').observe(len(data))
+        if not data:
+            # rtkrcv ha chiuso la connessione (potrebbe riconnettersi)
+            self._selector.unregister(conn)
+            conn.close()
+            entry['connections'].remove(conn)
+            entry['stream'].reset()
+            return True
+        self._dispatch(entry, entry['stream'].feed(data))
+        return True
+
+    def _drain_stream(self, entry):
+        """Legge dai socket della sessione tutti i dati già arrivati (fino a EAGAIN o EOF)."""
+        # Anche una connessione non ancora accettata può contenere le ultime righe
+        while True:
+            count = len(entry['connections'])
+            self._accept(entry)
+            if len(entry['connections']) == count:
+                break
+        for conn in list(entry['connections']):
+            # _dispatch rimuove la sessione se la convergenza è raggiunta
+            while self._entries.get(entry['serial']) is entry and conn in entry['connections']:
+                if not self._receive(entry, conn):
+                    break
+
+    def _read_entry(self, entry):
+        if entry['reader'] is None:
+            # Sessione in streaming: i dati vengono letti dal socket
+            return
+        reader = entry['reader']
+        offset = reader.offset
+        lines = reader.read_lines()
+        # Dopo una rotazione del file l'offset riparte da zero
+        BYTES_READ.labels('file').observe(reader.offset - offset if reader.offset >= offset else reader.offset)
+        self._dispatch(entry, lines)
+
+    def _dispatch(self, entry, lines):
+        serial = entry['serial']
+        if not lines:
+            return
+        if entry['on_lines'] is not None:
+            try:
+                entry['on_lines'](serial, lines)
+            except Exception as e:
+                print(f"[{serial}] Errore nella gestione delle righe: {e}")
+        for epoch in PosStreamReader.parse(lines):
+            try:
+                done = entry['on_epoch'](serial, epoch)
+            except Exception as e:
+                print(f"[{serial}] Errore nella gestione dell'epoca: {e}")
+                done = False
+            if done:
+                self._remove_entry(serial)
+                return
+
+    def _check_exit(self, entry):
+        if entry['process'].poll() is None:
+            return
+        # Leggi le ultime righe scritte prima della terminazione
+        if entry['reader'] is not None:
+            self._read_entry(entry)
+        else:
+            self._drain_stream(entry)
+        if self._remove_entry(entry['serial']) is not None:
+            try:
+                entry['on_exit'](entry['serial'])
+            except Exception as e:
+                print(f"[{entry['serial']}] Errore nella gestione della terminazione: {e}")
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _deadline, _seq, callback = heapq.heappop(self._timers)
+            try:
+                callback()
+            except Exception as e:
+                print(f"Errore in un timer del watcher: {e}")
+
+    def _next_timeout(self):
+        timeout = None if self._inotify else self.poll_interval
+        if (any(entry['pidfd'] is None for entry in self._entries.values())
+                or any(watched['pidfd'] is None for watched in self._processes.values())):
+            timeout = self.poll_interval
+        if self._timers:
+            delay = max(0.0, self._timers[0][0] - time.monotonic())
+            timeout = delay if timeout is None else min(timeout, delay)
+        return timeout
+
+    def _run(self):
+        while True:
+            self._apply_pending()
+            self._run_timers()
+            ready = self._selector.select(self._next_timeout())
+            started = time.perf_counter()
+
+            changed = set()
+            exited = set()
+            exited_processes = set()
+            for key, _mask in ready:
+                kind, serial = key.data
+                if kind == 'wake':
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif kind == 'inotify':
+                    for wd, _ev_mask, name in self._inotify.read_events():
+                        directory = self._dir_watches.get(wd)
+                        if directory and name:
+                            changed_serial = self._by_path.get(os.path.join(directory, name))
+                            if changed_serial is not None:
+                                changed.add(changed_serial)
+                elif kind == 'pidfd':
+                    exited.add(serial)
+                elif kind == 'process':
+                    exited_processes.add(serial)
+                elif kind == 'stderr':
+                    watched = self._processes.get(serial)
+                    if watched is not None:
+                        self._read_stderr(watched)
+                elif kind == 'accept':
+                    entry = self._entries.get(serial)
+                    if entry is not None:
+                        self._accept(entry)
+                elif kind == 'conn':
+                    entry = self._entries.get(serial)
+                    if entry is not None and key.fileobj in entry['connections']:
+                        self._receive(entry, key.fileobj)
+
+            if not self._inotify:
+                # Poller di fallback: una sola scansione per tutte le sessioni
+                changed.update(s for s, e in self._entries.items() if e['reader'] is not None)
+            for serial in changed:
+                entry = self._entries.get(serial)
+                if entry is not None:
+                    self._read_entry(entry)
+
+            # I processi senza pidfd vengono controllati ad ogni giro
+            exited.update(s for s, e in self._entries.items() if e['pidfd'] is None)
+            for serial in exited:
+                entry = self._entries.get(serial)
+                if entry is not None:
+                    self._check_exit(entry)
+
+            # Processi osservati con watch_process, dopo le sessioni: chi
+            # gestisce la terminazione trova già lette le ultime soluzioni
+            exited_processes.update(pid for pid, w in self._processes.items() if w['pidfd'] is None)
+            for pid in exited_processes:
+                self._check_process(pid)
+
+            LOOP_DURATION.observe(time.perf_counter() - started)
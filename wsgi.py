@@ -0,0 +1,18 @@
+"""Punto di ingresso WSGI per i worker dell'API in produzione.
+
+Lo stato delle sessioni vive nel processo manager_server.py; ogni worker
+vi accede tramite il socket Unix indicato in RTKRCV_MANAGER_SOCKET:
+
+    python manager_server.py --socket /run/rtkrcv/manager.sock
+    RTKRCV_MANAGER_SOCKET=/run/rtkrcv/manager.sock gunicorn -w 4 --threads 16 -b 0.0.0.0:5000 wsgi:app
+
+Ogni connessione SSE (/api/events) occupa un thread del worker per tutta
+la sua durata: dimensionare --threads di conseguenza.
+"""
+import os
+
+if not os.environ.get('RTKRCV_MANAGER_SOCKET'):
+    # Senza il processo proprietario ogni worker avvierebbe un proprio manager
+    raise RuntimeError("RTKRCV_MANAGER_SOCKET non impostata: avviare manager_server.py e indicarne il socket")
+
+from app import app  # noqa: E402,F401